@@ -34,6 +34,8 @@ setup(
     version=__version__,
     scripts=[
         'src/bin/benchmark.py',
+        'src/bin/benchmark_oncokb_cache.py',
+        'src/bin/benchmark_provenance.py',
         'src/bin/djerba.py',
         'src/bin/generate_ini.py',
         'src/bin/mini_djerba.py',
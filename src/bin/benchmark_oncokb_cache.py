@@ -0,0 +1,43 @@
+#! /usr/bin/env python3
+
+"""Benchmark OncoKB cache backends"""
+
+import argparse
+import sys
+import tempfile
+
+sys.path.pop(0) # do not import from script directory
+from djerba.util.logger import logger
+from djerba.util.oncokb.benchmark import oncokb_cache_benchmark
+from djerba.util.validator import path_validator
+
+def get_parser():
+    """Construct the parser for command-line arguments"""
+    parser = argparse.ArgumentParser(
+        description='benchmark_oncokb_cache: Time MAF annotation from a synthetic OncoKB cache, with the JSON, SQLite and memory-mapped binary backends',
+    )
+    parser.add_argument('-d', '--debug', action='store_true', help='More verbose logging')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Verbose logging')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Logging for error messages only')
+    parser.add_argument('-l', '--log-path', metavar='PATH', help='Output file for log messages; defaults to STDERR')
+    parser.add_argument('-n', '--entries', metavar='INT', type=int, default=oncokb_cache_benchmark.DEFAULT_ENTRIES, help='Number of MAF cache entries')
+    parser.add_argument('-r', '--rows', metavar='INT', type=int, default=oncokb_cache_benchmark.DEFAULT_ROWS, help='Number of input MAF rows; half are in the cache')
+    parser.add_argument('-o', '--out', metavar='PATH', help='Output path for JSON results')
+    return parser
+
+def main(args):
+    log_level = logger.get_log_level(args.debug, args.verbose, args.quiet)
+    validator = path_validator(log_level)
+    if args.log_path:
+        validator.validate_output_file(args.log_path)
+    if args.out:
+        validator.validate_output_file(args.out)
+    benchmark = oncokb_cache_benchmark(log_level, args.log_path)
+    with tempfile.TemporaryDirectory(prefix='djerba_benchmark_oncokb_') as tmp_dir:
+        results = benchmark.run(tmp_dir, args.entries, args.rows)
+    print(benchmark.format_results(results), end='')
+    if args.out:
+        benchmark.write_results(results, args.out)
+
+if __name__ == '__main__':
+    main(get_parser().parse_args())
@@ -0,0 +1,128 @@
+#! /usr/bin/env python3
+
+"""Benchmark reading of the file provenance report (FPR)"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.pop(0) # do not import from script directory
+from djerba.util.logger import logger
+from djerba.util.provenance_benchmark import provenance_benchmark
+from djerba.util.testing.provenance_generator import provenance_generator
+from djerba.util.validator import path_validator
+
+GENERATE = 'generate'
+DECOMPRESSION = 'decompression'
+FILTER = 'filter'
+SUITE = 'suite'
+
+def get_parser():
+    """Construct the parser for command-line arguments"""
+    parser = argparse.ArgumentParser(
+        description='benchmark_provenance: Benchmark reading of the file provenance report',
+    )
+    parser.add_argument('-d', '--debug', action='store_true', help='More verbose logging')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Verbose logging')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Logging for error messages only')
+    parser.add_argument('-l', '--log-path', metavar='PATH', help='Output file for log messages; defaults to STDERR')
+    subparsers = parser.add_subparsers(title='subcommands', help='sub-command help', dest='subparser_name')
+    generate_parser = subparsers.add_parser(GENERATE, help='Write a synthetic FPR')
+    generate_parser.add_argument('-o', '--out', metavar='PATH', required=True, help='Output path for the gzipped FPR')
+    generate_parser.add_argument('-n', '--rows', metavar='INT', type=int, required=True, help='Number of rows')
+    generate_parser.add_argument('--donors', metavar='INT', type=int, help='Number of donors; default is one per 100 rows')
+    generate_parser.add_argument('--seed', metavar='INT', type=int, default=42, help='Random seed')
+    generate_parser.add_argument('--studies', metavar='INT', type=int, help='Number of studies; default is 5')
+    generate_parser.add_argument('--workflow', metavar='NAME', action='append', help='Workflow name to write; may be repeated; default is the standard set of workflows')
+    generate_parser.add_argument('--reruns', metavar='INT', type=int, default=provenance_generator.DEFAULT_RERUNS, help='Number of runs of each workflow')
+    generate_parser.add_argument('--bgzf', action='store_true', help='Write BGZF instead of standard gzip')
+    decompression_parser = subparsers.add_parser(DECOMPRESSION, help='Time a full scan of one or more FPR files with each available decompression backend')
+    decompression_parser.add_argument('-p', '--provenance', metavar='PATH', action='append', required=True, help='Path to a gzipped FPR; may be repeated, eg. for gzip and BGZF copies')
+    decompression_parser.add_argument('-t', '--threads', metavar='INT', type=int, default=0, help='Threads for decompression; 0 = all available CPUs')
+    decompression_parser.add_argument('-o', '--out', metavar='PATH', help='Output path for JSON results')
+    filter_parser = subparsers.add_parser(FILTER, help='Time a search of the FPR for one or more donors, with and without the byte-level prefilter')
+    filter_parser.add_argument('-p', '--provenance', metavar='PATH', required=True, help='Path to a gzipped FPR')
+    filter_parser.add_argument('-k', '--key', metavar='STUDY:DONOR', action='append', required=True, help='Study and donor to search for, separated by a colon; may be repeated')
+    filter_parser.add_argument('-o', '--out', metavar='PATH', help='Output path for JSON results')
+    suite_parser = subparsers.add_parser(SUITE, help='Time each phase of finding workflow outputs for a donor, and optionally compare with a baseline')
+    suite_input = suite_parser.add_mutually_exclusive_group(required=True)
+    suite_input.add_argument('-p', '--provenance', metavar='PATH', help='Path to a gzipped FPR')
+    suite_input.add_argument('-n', '--rows', metavar='INT', type=int, help='Number of rows for a synthetic FPR, written to a temporary directory')
+    suite_parser.add_argument('-k', '--key', metavar='STUDY:DONOR', help='Study and donor, separated by a colon; required with --provenance; default for a synthetic FPR is its first donor')
+    suite_parser.add_argument('-t', '--threads', metavar='INT', type=int, default=0, help='Threads for decompression; 0 = all available CPUs')
+    suite_parser.add_argument('-b', '--baseline', metavar='PATH', help='JSON results of a previous run, for comparison')
+    suite_parser.add_argument('--tolerance', metavar='FLOAT', type=float, default=provenance_benchmark.DEFAULT_TOLERANCE, help='Ratio of time to baseline time which is reported as a regression')
+    suite_parser.add_argument('-o', '--out', metavar='PATH', help='Output path for JSON results')
+    return parser
+
+def run_suite(args, log_level, validator):
+    """Run the benchmark suite; return True if no regressions were found"""
+    if args.out:
+        validator.validate_output_file(args.out)
+    if args.baseline:
+        validator.validate_input_file(args.baseline)
+    benchmark = provenance_benchmark(log_level, args.log_path)
+    with tempfile.TemporaryDirectory(prefix='djerba_benchmark_fpr_') as tmp_dir:
+        if args.provenance:
+            validator.validate_input_file(args.provenance)
+            if not args.key:
+                print("--key is required with --provenance", file=sys.stderr)
+                sys.exit(1)
+            path = args.provenance
+        else:
+            generator = provenance_generator(log_level=log_level, log_path=args.log_path)
+            path = generator.write(os.path.join(tmp_dir, 'fpr.tsv.gz'), args.rows)
+            if not args.key:
+                args.key = '{0}:{1}'.format(generator.STUDIES[0], generator.donor_name(0))
+        [study, donor] = args.key.split(':', 1)
+        results = benchmark.run_suite(path, study, donor, args.threads)
+    if args.baseline:
+        baseline = benchmark.read_results(args.baseline)
+        results = benchmark.compare_results(results, baseline, args.tolerance)
+    print(benchmark.format_results(results), end='')
+    if args.out:
+        benchmark.write_results(results, args.out)
+    return not any([x.get(provenance_benchmark.REGRESSION) for x in results])
+
+def main(args):
+    log_level = logger.get_log_level(args.debug, args.verbose, args.quiet)
+    validator = path_validator(log_level)
+    if args.log_path:
+        validator.validate_output_file(args.log_path)
+    if args.subparser_name == GENERATE:
+        validator.validate_output_file(args.out)
+        generator = provenance_generator(args.seed, log_level, args.log_path)
+        generator.write(
+            args.out, args.rows, args.donors, args.bgzf, args.studies, args.workflow, args.reruns
+        )
+    elif args.subparser_name == DECOMPRESSION:
+        for path in args.provenance:
+            validator.validate_input_file(path)
+        if args.out:
+            validator.validate_output_file(args.out)
+        benchmark = provenance_benchmark(log_level, args.log_path)
+        results = benchmark.run_decompression(args.provenance, args.threads)
+        print(benchmark.format_results(results), end='')
+        if args.out:
+            benchmark.write_results(results, args.out)
+    elif args.subparser_name == FILTER:
+        validator.validate_input_file(args.provenance)
+        if args.out:
+            validator.validate_output_file(args.out)
+        keys = [tuple(x.split(':', 1)) for x in args.key]
+        benchmark = provenance_benchmark(log_level, args.log_path)
+        results = benchmark.run_filter(args.provenance, keys)
+        print(benchmark.format_results(results), end='')
+        if args.out:
+            benchmark.write_results(results, args.out)
+    elif args.subparser_name == SUITE:
+        if not run_suite(args, log_level, validator):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    parser = get_parser()
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+    main(parser.parse_args())
@@ -9,6 +9,7 @@ sys.path.pop(0) # do not import from script directory
 from djerba.core.main import main, arg_processor, DjerbaSubcommandError
 from djerba.version import get_djerba_version
 import djerba.util.constants as constants
+import djerba.util.decompression as decompression
 
 def get_parser():
     """Construct the parser for command-line arguments"""
@@ -56,6 +57,34 @@ def get_parser():
     update_parser.add_argument('-p', '--pdf', action='store_true', help='Generate PDF output from HTML')
     update_parser.add_argument('-w', '--work-dir', metavar='PATH', help='Path to workspace directory; optional, defaults to value of --out-dir')
     update_parser.add_argument('--no-archive', action='store_true', help='Do not archive the JSON report file')
+    provenance_parser = subparsers.add_parser(constants.PROVENANCE, help='Prepare shared file provenance resources for multiple reports')
+    provenance_subparsers = provenance_parser.add_subparsers(title='actions', help='provenance action help', dest='provenance_action')
+    index_parser = provenance_subparsers.add_parser(constants.PROVENANCE_INDEX, help='Write an indexed snapshot of the file provenance report, for fast lookup by study and donor')
+    index_parser.add_argument('-p', '--provenance', metavar='PATH', required=True, help='Path to the gzipped file provenance report')
+    index_parser.add_argument('-o', '--index-dir', metavar='DIR', help='Directory for output of snapshot files; defaults to the directory of the file provenance report')
+    index_parser.add_argument('-D', '--decompression', choices=decompression.BACKENDS, default=decompression.AUTO, help='Backend to decompress the file provenance report')
+    index_parser.add_argument('-t', '--threads', metavar='INT', type=int, default=0, help='Threads for decompression; 0 = all available CPUs')
+    subset_parser = provenance_subparsers.add_parser(constants.PROVENANCE_SUBSET, help='Write provenance subsets for a batch of donors, with a single read of the file provenance report')
+    subset_parser.add_argument('-p', '--provenance', metavar='PATH', required=True, help='Path to the gzipped file provenance report')
+    subset_parser.add_argument('-b', '--batch', metavar='PATH', required=True, help='Tab-separated file with columns: study, donor, workspace directory')
+    subset_parser.add_argument('-o', '--index-dir', metavar='DIR', help='Directory with provenance snapshot or store files, if any; defaults to the directory of the file provenance report')
+    subset_parser.add_argument('-f', '--force', action='store_true', help='Overwrite existing provenance subsets in workspace directories')
+    subset_parser.add_argument('-D', '--decompression', choices=decompression.BACKENDS, default=decompression.AUTO, help='Backend to decompress the file provenance report')
+    subset_parser.add_argument('-t', '--threads', metavar='INT', type=int, default=0, help='Threads for decompression; 0 = all available CPUs')
+    store_parser = provenance_subparsers.add_parser(constants.PROVENANCE_STORE, help='Load the file provenance report into a SQLite store, for indexed queries by study, donor, sample and workflow')
+    store_parser.add_argument('-p', '--provenance', metavar='PATH', required=True, help='Path to the gzipped file provenance report')
+    store_parser.add_argument('-o', '--index-dir', metavar='DIR', help='Directory for output of the store; defaults to the directory of the file provenance report')
+    store_parser.add_argument('-f', '--force', action='store_true', help='Reload the store, even if it is current')
+    store_parser.add_argument('-D', '--decompression', choices=decompression.BACKENDS, default=decompression.AUTO, help='Backend to decompress the file provenance report')
+    store_parser.add_argument('-t', '--threads', metavar='INT', type=int, default=0, help='Threads for decompression; 0 = all available CPUs')
+    audit_parser = provenance_subparsers.add_parser(constants.PROVENANCE_AUDIT, help='Check provenance readiness of all donors in one or more studies, with a single read of the file provenance report')
+    audit_parser.add_argument('-p', '--provenance', metavar='PATH', required=True, help='Path to the gzipped file provenance report')
+    audit_parser.add_argument('-s', '--study', metavar='STUDY', action='append', required=True, help='Study to audit; may be repeated')
+    audit_parser.add_argument('-d', '--donor', metavar='DONOR', action='append', help='Donor to audit; may be repeated. Optional, defaults to all donors in each study')
+    audit_parser.add_argument('-o', '--out', metavar='PATH', required=True, help='Output path for the audit table')
+    audit_parser.add_argument('--json', action='store_true', help='Write output in JSON format, instead of TSV')
+    audit_parser.add_argument('-D', '--decompression', choices=decompression.BACKENDS, default=decompression.AUTO, help='Backend to decompress the file provenance report')
+    audit_parser.add_argument('-t', '--threads', metavar='INT', type=int, default=0, help='Threads for decompression; 0 = all available CPUs')
     return parser
 
 if __name__ == '__main__':
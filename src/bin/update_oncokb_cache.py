@@ -3,39 +3,162 @@
 """Update the OncoKB cache"""
 
 import argparse
+import os
 import sys
 from argparse import RawTextHelpFormatter
 
 sys.path.pop(0) # do not import from script directory
 
-from djerba.extract.oncokb.cache import oncokb_cache
+import djerba.util.oncokb.constants as oncokb_constants
+from djerba.util.oncokb.annotator import oncokb_annotator
+from djerba.util.oncokb.cache import oncokb_cache
+from djerba.util.oncokb.prewarm import oncokb_cache_prewarmer
 from djerba.util.logger import logger
 from djerba.util.validator import path_validator
 
+UPDATE = 'update'
+MIGRATE = 'migrate'
+COMPACT = 'compact'
+PREWARM = 'prewarm'
+
 def get_parser():
     """Construct the parser for command-line arguments"""
     parser = argparse.ArgumentParser(
-        description='Update Djerba\'s JSON cache files for OncoKB data.\n- This script is for convenience/demonstration purposes; for production use, see the --update-cache and --apply-cache options to djerba.py.\n- This script is *not* aware of the OncoTree code, and simply writes to the given cache directory.',
+        description='Update Djerba\'s cache files for OncoKB data.\n- This script is for convenience/demonstration purposes; for production use, see the --update-cache and --apply-cache options to djerba.py.\n- The update subcommand is *not* aware of the OncoTree code, and simply writes to the given cache directory.',
         epilog='Run with -h/--help for additional information',
         formatter_class=RawTextHelpFormatter
     )
-    parser.add_argument('-c', '--cache-dir', metavar='PATH', help='Directory for output of JSON cache files; should *include* the OncoTree subdirectory, if any', required=True)
-    parser.add_argument('-i', '--input-dir', metavar='PATH', help='Djerba report directory; must be created with --no-cleanup', required=True)
     parser.add_argument('-d', '--debug', action='store_true', help='More verbose logging')
     parser.add_argument('-l', '--log-path', metavar='PATH', help='Output file for log messages; defaults to STDERR')
     parser.add_argument('-q', '--quiet', action='store_true', help='Quiet mode; logging errors only')
     parser.add_argument('-v', '--verbose', action='store_true', help='Verbose logging')
+    subparsers = parser.add_subparsers(title='subcommands', help='sub-command help', dest='subparser_name')
+    update_parser = subparsers.add_parser(UPDATE, help='Update the cache from an annotated Djerba report directory')
+    update_parser.add_argument('-c', '--cache-dir', metavar='PATH', help='Cache directory; should *include* the OncoTree subdirectory, if any', required=True)
+    update_parser.add_argument('-i', '--input-dir', metavar='PATH', help='Djerba report directory; must be created with --no-cleanup', required=True)
+    update_parser.add_argument('--data-version', metavar='VERSION', help='OncoKB data version of the annotations, eg. v4.20; recorded with each cache entry')
+    migrate_parser = subparsers.add_parser(MIGRATE, help='Convert JSON cache files to a SQLite store or memory-mapped binary files, in the cache directory and each OncoTree subdirectory; these are then used in place of the JSON files')
+    migrate_parser.add_argument('-c', '--cache-dir', metavar='PATH', help='Base cache directory', required=True)
+    migrate_parser.add_argument('-f', '--format', choices=[oncokb_constants.BACKEND_SQLITE, oncokb_constants.BACKEND_MMAP], default=oncokb_constants.BACKEND_SQLITE, help='Output format; default is sqlite')
+    compact_parser = subparsers.add_parser(COMPACT, help='Remove stale entries from all cache files, in the cache directory and each OncoTree subdirectory')
+    compact_parser.add_argument('-c', '--cache-dir', metavar='PATH', help='Base cache directory', required=True)
+    compact_parser.add_argument('-t', '--ttl', metavar='DAYS', type=int, help='Remove entries older than the given number of days')
+    compact_parser.add_argument('--data-version', metavar='VERSION', help='Current OncoKB data version; remove entries from any other version, or with no version')
+    prewarm_parser = subparsers.add_parser(PREWARM, help='Annotate all MAF, CNA and fusion inputs for a cohort which are not in the cache, using the OncoKB API, and update the cache subdirectory for each OncoTree code. Requires the {0} environment variable, with the path of an OncoKB token file.'.format(oncokb_annotator.ONCOKB_TOKEN_VARIABLE))
+    prewarm_parser.add_argument('-c', '--cache-dir', metavar='PATH', help='Base cache directory', required=True)
+    prewarm_parser.add_argument('-r', '--report-dir', metavar='PATH', action='append', default=[], help='Directory tree of Djerba reports, created with --no-cleanup; each report directory is found by its OncoKB clinical info file. May be repeated.')
+    prewarm_parser.add_argument('--maf', metavar=('ONCOTREE_CODE', 'PATH'), nargs=2, action='append', default=[], help='MAF input and its OncoTree code; may be repeated')
+    prewarm_parser.add_argument('--cna', metavar=('ONCOTREE_CODE', 'PATH'), nargs=2, action='append', default=[], help='CNA input and its OncoTree code; may be repeated')
+    prewarm_parser.add_argument('--fusion', metavar=('ONCOTREE_CODE', 'PATH'), nargs=2, action='append', default=[], help='Fusion input and its OncoTree code; may be repeated')
+    prewarm_parser.add_argument('-f', '--format', choices=oncokb_constants.BACKENDS, help='Cache backend; default is SQLite if the store exists, otherwise binary files if they exist, otherwise JSON')
+    prewarm_parser.add_argument('-b', '--batch-size', metavar='INT', type=int, default=oncokb_cache_prewarmer.DEFAULT_BATCH_SIZE, help='Queries per OncoKB API request; default {0}'.format(oncokb_cache_prewarmer.DEFAULT_BATCH_SIZE))
+    prewarm_parser.add_argument('-u', '--url', metavar='URL', help='Base URL of the OncoKB API; defaults to the public API')
+    prewarm_parser.add_argument('-t', '--ttl', metavar='DAYS', type=int, help='Annotate again any cache entries older than the given number of days')
+    prewarm_parser.add_argument('--data-version', metavar='VERSION', help='OncoKB data version of the annotations; defaults to the current version from the API. Cache entries from any other version are annotated again.')
     return parser
 
+def get_cache_dirs(base_dir):
+    """Base directory and its subdirectories, if they contain any cache files"""
+    names = [
+        oncokb_constants.CACHE_CNA,
+        oncokb_constants.CACHE_FUSION,
+        oncokb_constants.CACHE_MAF,
+        oncokb_constants.CACHE_MMAP_CNA,
+        oncokb_constants.CACHE_MMAP_FUSION,
+        oncokb_constants.CACHE_MMAP_MAF,
+        oncokb_constants.CACHE_SQLITE
+    ]
+    cache_dirs = []
+    for cache_dir in [base_dir]+[os.path.join(base_dir, x) for x in sorted(os.listdir(base_dir))]:
+        if os.path.isdir(cache_dir) and any([os.path.exists(os.path.join(cache_dir, x)) for x in names]):
+            cache_dirs.append(cache_dir)
+    return cache_dirs
+
 def main(args):
     log_level = logger.get_log_level(args.debug, args.verbose, args.quiet)
     validator = path_validator(log_level)
     if args.log_path:
         validator.validate_output_file(args.log_path)
-    validator.validate_input_dir(args.input_dir)
     validator.validate_output_dir(args.cache_dir)
-    cache = oncokb_cache(args.cache_dir, log_level=log_level, log_path=args.log_path)
-    cache.update_cache_files(args.input_dir)
+    if args.subparser_name == UPDATE:
+        validator.validate_input_dir(args.input_dir)
+        cache = oncokb_cache(
+            args.cache_dir,
+            log_level=log_level,
+            log_path=args.log_path,
+            data_version=args.data_version
+        )
+        cache.update_cache_files(args.input_dir)
+    elif args.subparser_name == MIGRATE:
+        json_names = [oncokb_constants.CACHE_CNA, oncokb_constants.CACHE_FUSION, oncokb_constants.CACHE_MAF]
+        cache_dirs = [args.cache_dir]
+        for name in sorted(os.listdir(args.cache_dir)):
+            path = os.path.join(args.cache_dir, name)
+            if os.path.isdir(path):
+                cache_dirs.append(path)
+        for cache_dir in cache_dirs:
+            if any([os.path.exists(os.path.join(cache_dir, x)) for x in json_names]):
+                validator.validate_output_dir(cache_dir)
+                cache = oncokb_cache(
+                    cache_dir,
+                    log_level=log_level,
+                    log_path=args.log_path,
+                    backend=args.format
+                )
+                total = cache.migrate(args.format)
+                if args.format == oncokb_constants.BACKEND_SQLITE:
+                    print("{0}\t{1}".format(cache.store.path, total))
+                else:
+                    print("{0}\t{1}".format(cache_dir, total))
+    elif args.subparser_name == COMPACT:
+        if args.ttl == None and args.data_version == None:
+            print("At least one of --ttl and --data-version is required", file=sys.stderr)
+            sys.exit(1)
+        for cache_dir in get_cache_dirs(args.cache_dir):
+            validator.validate_output_dir(cache_dir)
+            cache = oncokb_cache(
+                cache_dir,
+                log_level=log_level,
+                log_path=args.log_path,
+                data_version=args.data_version,
+                ttl_days=args.ttl
+            )
+            for (path, [kept, removed]) in cache.compact().items():
+                print("{0}\t{1}\t{2}".format(path, kept, removed))
+    elif args.subparser_name == PREWARM:
+        if not (args.report_dir or args.maf or args.cna or args.fusion):
+            print("At least one of --report-dir, --maf, --cna and --fusion is required", file=sys.stderr)
+            sys.exit(1)
+        token_variable = oncokb_annotator.ONCOKB_TOKEN_VARIABLE
+        if token_variable not in os.environ:
+            print("Environment variable {0} is required".format(token_variable), file=sys.stderr)
+            sys.exit(1)
+        validator.validate_input_file(os.environ[token_variable])
+        with open(os.environ[token_variable]) as token_file:
+            token = token_file.read().strip()
+        prewarmer = oncokb_cache_prewarmer(
+            args.cache_dir,
+            token,
+            args.url,
+            batch_size=args.batch_size,
+            backend=args.format,
+            data_version=args.data_version,
+            ttl_days=args.ttl,
+            log_level=log_level,
+            log_path=args.log_path
+        )
+        for report_dir in args.report_dir:
+            validator.validate_input_dir(report_dir)
+            prewarmer.add_report_tree(report_dir)
+        for (cache_type, inputs) in [
+                (oncokb_constants.MAF, args.maf),
+                (oncokb_constants.CNA, args.cna),
+                (oncokb_constants.FUSION, args.fusion)
+        ]:
+            for (oncotree_code, input_path) in inputs:
+                validator.validate_input_file(input_path)
+                prewarmer.add_input(oncotree_code, cache_type, input_path)
+        print(prewarmer.format_results(prewarmer.run()), end='')
 
 if __name__ == '__main__':
     parser = get_parser()
@@ -12,6 +12,7 @@ from configparser import ConfigParser
 from uuid import uuid4
 from djerba.core.base import base as core_base
 from djerba.util.logger import logger
+from djerba.util.validator import path_validator
 import djerba.core.constants as cc
 import djerba.util.ini_fields as ini
 
@@ -198,6 +199,7 @@ class configurable(core_base, ABC):
         - If fallback value is defined, use that
         - Otherwise, raise an error
         The json_key parameter is used in case JSON and INI keys differ.
+        A path read from the path info is checked against its recorded stat, if any.
         """
         if json_key == None:
             json_key = config_key
@@ -211,6 +213,12 @@ class configurable(core_base, ABC):
                     msg = "Cannot find {0} in workspace file {1}".format(json_key, file_name)
                     self.logger.error(msg)
                     raise DjerbaConfigError(msg) from err
+                if file_name == cc.DEFAULT_PATH_INFO and isinstance(value, str):
+                    # use the stat recorded by the provenance helper, if any
+                    file_stats = self.read_file_stats()
+                    if value in file_stats:
+                        validator = path_validator(self.log_level, self.log_path)
+                        validator.validate_input_file(value, file_stats)
                 wrapper.set_my_param(config_key, value)
             elif fallback != None:
                 msg = "File {0} not found, setting {1} to fallback value {2}"
@@ -225,6 +233,16 @@ class configurable(core_base, ABC):
             self.logger.debug("Using existing config value for {0}".format(config_key))
         return wrapper
 
+    def read_file_stats(self):
+        """
+        Size and mtime, or an error, for each path in the path info, as recorded by the
+        provenance helper; empty if not available. Input for path_validator.
+        """
+        if self.workspace.has_file(cc.DEFAULT_FILE_STATS):
+            return self.workspace.read_json(cc.DEFAULT_FILE_STATS)
+        else:
+            return {}
+
     def validate_minimal_config(self, config):
         """Check for required/unknown config keys in minimal config"""
         self.logger.info("Validating minimal config for component "+self.identifier)
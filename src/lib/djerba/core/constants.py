@@ -71,6 +71,8 @@ NORMAL_ID = 'normal_id'
 
 # core config defaults
 DEFAULT_PATH_INFO = "path_info.json"
+# size/mtime of each path in the path info, so plugins need not stat the files again
+DEFAULT_FILE_STATS = "file_stats.json"
 DEFAULT_SAMPLE_INFO = "sample_info.json"
 DEFAULT_CSS = "stylesheet.css"
 DEFAULT_AUTHOR = "CGI Author"
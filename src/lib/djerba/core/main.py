@@ -66,6 +66,21 @@ class main_base(core_base):
     def _get_render_priority(self, plugin_data):
         return plugin_data[cc.PRIORITIES][cc.RENDER]
 
+    def _configure_component(self, name, component, config_in, config_out):
+        """Validate and run configuration for one component; update config_in and config_out"""
+        component.validate_minimal_config(config_in)
+        config_tmp = component.configure(config_in)
+        component.validate_full_config(config_tmp)
+        config_in[name] = config_tmp[name] # update config_in to support dependencies
+        config_out[name] = config_tmp[name]
+
+    def _get_dependencies(self, depends_key, config, component, name):
+        if config.has_option(name, depends_key):
+            depends_str = config.get(name, depends_key)
+        else:
+            depends_str = component.get_reserved_default(depends_key)
+        return self._parse_comma_separated_list(depends_str)
+
     def _load_component(self, name):
         if name == ini.CORE:
             component = self.core_config_loader.load(self.workspace)
@@ -85,11 +100,7 @@ class main_base(core_base):
 
     def _resolve_ini_deps(self, depends_key, config, components, ordered_names):
         for name in ordered_names:
-            if config.has_option(name, depends_key):
-                depends_str = config.get(name, depends_key)
-            else:
-                depends_str = components[name].get_reserved_default(depends_key)
-            depends = self._parse_comma_separated_list(depends_str)
+            depends = self._get_dependencies(depends_key, config, components[name], name)
             if len(depends)>0:
                 failed = 0
                 for dependency in depends:
@@ -231,10 +242,18 @@ class main_base(core_base):
             self.path_validator.validate_output_file(config_path_out)
         components = {}
         priorities = {}
+        # workspace files written by helpers with background work, eg. reading file provenance
+        prefetch_outputs = {}
         # 1. Load components, set priorities, resolve dependencies (if any)
         self.logger.debug('Loading components and finding config priority levels')
-        for section in config_in.sections():
+        # load helpers first, and start their background work (if any) immediately
+        sections = sorted(config_in.sections(), key=lambda x: not self._is_helper_name(x))
+        for section in sections:
             components[section] = self._load_component(section)
+            if self._is_helper_name(section):
+                outputs = components[section].prefetch(config_in)
+                if outputs:
+                    prefetch_outputs[section] = outputs
             # if input has a configure priority, use that
             # otherwise, use default priority for the component
             if config_in.has_option(section, cc.CONFIGURE_PRIORITY):
@@ -242,23 +261,44 @@ class main_base(core_base):
             else:
                 priority = components[section].get_reserved_default(cc.CONFIGURE_PRIORITY)
             priorities[section] = priority
+        # keep INI section order for components of equal priority
+        priorities = {x: priorities[x] for x in config_in.sections()}
         self.logger.debug('Configuring components in priority order')
         ordered_names = sorted(priorities.keys(), key=lambda x: priorities[x])
         self._resolve_configure_dependencies(config_in, components, ordered_names)
         # 2. Validate and run configuration for each component; store in config_out
+        # helpers with background work are configured when their outputs are first needed:
+        # by the core, by a component which depends on them, or on workspace access to an
+        # output file; independent components are configured in the meantime
         config_out = ConfigParser()
-        order = 0
         for name in ordered_names:
-            order += 1
-            component = components[name]
-            priority = priorities[name]
-            msg = 'Configuring {0}, priority {1}, order {2}'.format(name, priority, order)
-            self.logger.debug(msg)
-            component.validate_minimal_config(config_in)
-            config_tmp = component.configure(config_in)
-            component.validate_full_config(config_tmp)
-            config_in[name] = config_tmp[name] # update config_in to support dependencies
-            config_out[name] = config_tmp[name]
+            config_out.add_section(name) # keep priority order in the output
+        deferred = [x for x in ordered_names if x in prefetch_outputs]
+        def configure_deferred(name):
+            if name in deferred:
+                deferred.remove(name)
+                self.logger.debug('Configuring {0}, after deferral'.format(name))
+                self._configure_component(name, components[name], config_in, config_out)
+        for name in deferred:
+            self.workspace.set_pending(prefetch_outputs[name], lambda x=name: configure_deferred(x))
+        try:
+            order = 0
+            for name in ordered_names:
+                order += 1
+                if name in deferred:
+                    self.logger.debug('Deferring configuration of {0}'.format(name))
+                    continue
+                depends = self._get_dependencies(cc.DEPENDS_CONFIGURE, config_in, components[name], name)
+                for helper_name in list(deferred):
+                    if name == ini.CORE or helper_name in depends:
+                        configure_deferred(helper_name)
+                msg = 'Configuring {0}, priority {1}, order {2}'.format(name, priorities[name], order)
+                self.logger.debug(msg)
+                self._configure_component(name, components[name], config_in, config_out)
+            for name in list(deferred):
+                configure_deferred(name)
+        finally:
+            self.workspace.clear_pending()
         if config_path_out:
             self.logger.debug('Writing INI output to {0}'.format(config_path_out))
             with open(config_path_out, 'w') as out_file:
@@ -417,6 +457,10 @@ class main(main_base):
             pdf = ap.is_pdf_enabled()
             force = ap.is_forced()
             self.update(config_path, jp, out_dir, archive, pdf, summary_only, force)
+        elif mode == constants.PROVENANCE:
+            # imported here, so core does not depend on the provenance helper for other modes
+            from djerba.helpers.provenance_helper.commands import provenance_commands
+            provenance_commands(self.log_level, self.log_path).run(args)
         else:
             msg = "Mode '{0}' is not defined in Djerba core.main!".format(mode)
             self.logger.error(msg)
@@ -642,6 +686,22 @@ class arg_processor(arg_processor_base):
             v.validate_output_dir(args.out_dir)
             if args.work_dir != None: # work_dir is optional in report mode
                 v.validate_output_dir(args.work_dir)
+        elif args.subparser_name == constants.PROVENANCE:
+            if args.provenance_action == None:
+                msg = "No provenance action given; run with -h/--help for valid names"
+                raise DjerbaSubcommandError(msg)
+            elif args.provenance_action in [constants.PROVENANCE_INDEX, constants.PROVENANCE_STORE]:
+                v.validate_input_file(args.provenance)
+                if args.index_dir != None:
+                    v.validate_output_dir(args.index_dir)
+            elif args.provenance_action == constants.PROVENANCE_AUDIT:
+                v.validate_input_file(args.provenance)
+                v.validate_output_file(args.out)
+            elif args.provenance_action == constants.PROVENANCE_SUBSET:
+                v.validate_input_file(args.provenance)
+                v.validate_input_file(args.batch)
+                if args.index_dir != None:
+                    v.validate_input_dir(args.index_dir)
         elif args.subparser_name == None:
             msg = "No subcommand name given; run with -h/--help for valid names"
             raise DjerbaSubcommandError(msg)
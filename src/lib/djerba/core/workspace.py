@@ -10,6 +10,7 @@ import gzip
 import json
 import logging
 import os
+import threading
 from djerba.util.logger import logger
 from djerba.util.validator import path_validator
 
@@ -23,15 +24,36 @@ class workspace(logger):
         self.validator = path_validator(self.log_level, self.log_path)
         self.validator.validate_output_dir(dir_path)
         self.dir_path = dir_path
+        # files to be written by a deferred step; see set_pending()
+        self.pending = {}
+        self.pending_thread = None
+
+    def _wait_for_pending(self, rel_path):
+        """If the file is pending, run the step which writes it"""
+        # background work for the deferred step, eg. in a helper's prefetch thread, may
+        # access its own outputs; only the thread which registered the step runs it
+        if threading.get_ident() != self.pending_thread:
+            return
+        callback = self.pending.get(os.path.normpath(rel_path))
+        if callback != None:
+            # remove all files for the callback first, so the step may access them itself
+            self.pending = {x: y for (x, y) in self.pending.items() if y is not callback}
+            self.logger.debug("Running deferred step to write {0}".format(rel_path))
+            callback()
 
     def abs_path(self, rel_path):
         """Return the absolute path of a file in the workspace"""
+        self._wait_for_pending(rel_path)
         return os.path.abspath(os.path.join(self.dir_path, rel_path))
 
     def get_work_dir(self):
         return self.dir_path
 
+    def clear_pending(self):
+        self.pending = {}
+
     def has_file(self, rel_path):
+        self._wait_for_pending(rel_path)
         return os.path.exists(os.path.join(self.dir_path, rel_path))
 
     def open_gzip_file(self, rel_path, write=False):
@@ -39,6 +61,7 @@ class workspace(logger):
             mode = 'wt'
         else:
             mode = 'rt'
+            self._wait_for_pending(rel_path)
         in_path = os.path.join(self.dir_path, rel_path)
         if not write:
             self.validator.validate_input_file(in_path)
@@ -48,6 +71,7 @@ class workspace(logger):
         """Return a File object, eg. for use by csv.reader or csv.writer"""
         file_path = os.path.join(self.dir_path, rel_path)
         if 'r' in mode:
+            self._wait_for_pending(rel_path)
             self.validator.validate_input_file(file_path)
         else:
             self.validator.validate_output_file(file_path)
@@ -57,6 +81,7 @@ class workspace(logger):
         return self.dir_path
 
     def read_json(self, rel_path):
+        self._wait_for_pending(rel_path)
         in_path = os.path.join(self.dir_path, rel_path)
         self.validator.validate_input_file(in_path)
         with open(in_path) as in_file:
@@ -80,12 +105,22 @@ class workspace(logger):
         return data
 
     def read_string(self, rel_path):
+        self._wait_for_pending(rel_path)
         in_path = os.path.join(self.dir_path, rel_path)
         self.validator.validate_input_file(in_path)
         with open(in_path) as in_file:
             content = in_file.read()
         return content
 
+    def set_pending(self, rel_paths, callback):
+        """
+        Register files to be written by a deferred step, eg. configuring a helper; the first
+        access to any of them by the read methods runs callback(), which must write them
+        """
+        self.pending_thread = threading.get_ident()
+        for rel_path in rel_paths:
+            self.pending[os.path.normpath(rel_path)] = callback
+
     def remove_file(self, rel_path):
         os.remove(os.path.join(self.dir_path, rel_path))
     
@@ -40,6 +40,20 @@ class helper_base(configurable, ABC):
         msg = "Using placeholder method of parent class; does nothing"
         self.logger.debug(msg)
 
+    def prefetch(self, config):
+        """
+        Optionally start slow work in the background, eg. reading a large input file
+        Called by the core for each helper after INI parsing, before any component is
+        configured; the helper's configure() method must wait for the result.
+        Input is the full ConfigParser, which must not be modified.
+        Returns a list of workspace files written by configure(), if work was started. The
+        core then defers configure() until a component needs them: the core configurer,
+        a component with a configure dependency on the helper, or any read of the files
+        from the workspace. Otherwise, returns an empty list.
+        """
+        self.logger.debug("Using placeholder prefetch method of parent class; does nothing")
+        return []
+
     def set_priority_defaults(self, priority):
         for key in self.PRIORITY_KEYS:
             self.ini_defaults[key] = priority
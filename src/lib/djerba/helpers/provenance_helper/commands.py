@@ -0,0 +1,146 @@
+"""
+Run actions of the `djerba.py provenance` subcommand
+
+These operate on the file provenance report (FPR) independently of any single report,
+eg. to prepare shared files which speed up the provenance helper for many reports
+"""
+
+import csv
+import logging
+import os
+import djerba.util.constants as constants
+from djerba.helpers.provenance_helper.helper import main as helper_main, \
+    provenance_subset_writer
+from djerba.util.decompression import AUTO
+from djerba.util.logger import logger
+from djerba.util.provenance_audit import provenance_audit
+from djerba.util.provenance_snapshot import provenance_snapshot
+from djerba.util.provenance_store import provenance_store
+from djerba.util.validator import path_validator
+
+class provenance_commands(logger):
+
+    def __init__(self, log_level=logging.WARNING, log_path=None):
+        self.log_level = log_level
+        self.log_path = log_path
+        self.logger = self.get_logger(log_level, __name__, log_path)
+
+    def run(self, args):
+        action = args.provenance_action
+        if action == constants.PROVENANCE_INDEX:
+            self.write_index(args.provenance, args.index_dir, args.decompression, args.threads)
+        elif action == constants.PROVENANCE_SUBSET:
+            self.write_subsets(
+                args.provenance,
+                args.batch,
+                args.index_dir,
+                args.force,
+                args.decompression,
+                args.threads
+            )
+        elif action == constants.PROVENANCE_STORE:
+            self.write_store(
+                args.provenance,
+                args.index_dir,
+                args.force,
+                args.decompression,
+                args.threads
+            )
+        elif action == constants.PROVENANCE_AUDIT:
+            self.write_audit(
+                args.provenance,
+                args.study,
+                args.donor,
+                args.out,
+                args.json,
+                args.decompression,
+                args.threads
+            )
+        else:
+            msg = "Unknown provenance action: '{0}'".format(action)
+            self.logger.error(msg)
+            raise RuntimeError(msg)
+
+    def write_index(self, provenance_path, index_dir=None, decompression=AUTO, threads=0):
+        """Write a provenance snapshot for the FPR, if it is not already current"""
+        snapshot = provenance_snapshot(provenance_path, index_dir, self.log_level, self.log_path)
+        if snapshot.is_current():
+            msg = "Provenance snapshot {0} is current, ".format(snapshot.index_path)+\
+                "will not overwrite"
+            self.logger.info(msg)
+        else:
+            snapshot.build(decompression, threads)
+        return snapshot.index_path
+
+    def write_audit(self, provenance_path, studies, donors, out_path, json_output=False,
+                    decompression=AUTO, threads=0):
+        """
+        Audit provenance readiness of donors in the given studies, with a single FPR scan
+        If donors is None, audit all donors in the studies
+        Output is a TSV table, or JSON if json_output is True
+        """
+        audit = provenance_audit(self.log_level, self.log_path)
+        results = audit.audit(provenance_path, studies, donors, decompression, threads)
+        if json_output:
+            audit.write_json(results, out_path)
+        else:
+            audit.write_tsv(results, out_path)
+        ready = len([x for x in results if x[audit.STATUS]==audit.READY])
+        self.logger.info("{0} of {1} donors are ready".format(ready, len(results)))
+        return results
+
+    def write_store(self, provenance_path, index_dir=None, force=False, decompression=AUTO, threads=0):
+        """Load the FPR into a provenance store, if the store is not already current"""
+        store_path = provenance_store.get_default_path(provenance_path, index_dir)
+        store = provenance_store(store_path, self.log_level, self.log_path)
+        if store.is_current(provenance_path) and not force:
+            msg = "Provenance store {0} is current, will not overwrite".format(store_path)
+            self.logger.info(msg)
+        else:
+            store.load(provenance_path, decompression, threads)
+        return store_path
+
+    def read_batch(self, batch_path):
+        """
+        Read a batch file: Tab-separated, with columns for study, donor, and workspace
+        directory. Blank lines and lines starting with # are ignored.
+        """
+        targets = []
+        validator = path_validator(self.log_level, self.log_path)
+        with open(batch_path) as batch_file:
+            for row in csv.reader(batch_file, delimiter="\t"):
+                if len(row)==0 or row[0].startswith('#'):
+                    continue
+                elif len(row)!=3:
+                    msg = "Expected 3 columns (study, donor, workspace) in "+\
+                        "batch file {0}, found: {1}".format(batch_path, row)
+                    self.logger.error(msg)
+                    raise ValueError(msg)
+                validator.validate_output_dir(row[2])
+                targets.append(tuple(row))
+        self.logger.debug("Read {0} targets from batch file {1}".format(len(targets), batch_path))
+        return targets
+
+    def write_subsets(self, provenance_path, batch_path, index_dir=None, force=False,
+                      decompression=AUTO, threads=0):
+        """
+        Write provenance subsets for all donors in the batch file, with a single FPR scan
+        Existing subsets in a workspace are not overwritten, unless force is True
+        """
+        targets = []
+        for (study, donor, work_dir) in self.read_batch(batch_path):
+            out_path = os.path.join(work_dir, helper_main.PROVENANCE_OUTPUT)
+            if os.path.exists(out_path) and not force:
+                msg = "Provenance subset {0} exists, will not overwrite".format(out_path)
+                self.logger.info(msg)
+            else:
+                targets.append((study, donor, out_path))
+        if len(targets)==0:
+            self.logger.info("No provenance subsets to write")
+            kept = {}
+        else:
+            writer = provenance_subset_writer(
+                provenance_path, index_dir, self.log_level, self.log_path, decompression, threads
+            )
+            kept = writer.write(targets)
+        return kept
@@ -2,8 +2,12 @@
 Helper for writing a subset of file provenance to the shared workspace
 
 Outputs to the workspace:
-- Subset of sample provenance for the donor and study supplied by the user
+- Subset of sample provenance for the donor and study supplied by the user, with only
+  the columns used by Djerba (see djerba.util.provenance_row)
 - JSON file with donor, study, and sample names
+- JSON file with paths of workflow outputs
+- JSON file with the size and mtime of each workflow output; paths are checked
+  concurrently at configure time, and any which are invalid are logged
 
 Plugins can then create their own provenance reader objects using params in the JSON, to
 find relevant file paths. Reading the provenance subset is very much faster than reading 
@@ -14,18 +18,40 @@ import os
 import csv
 import gzip
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
 import djerba.core.constants as core_constants
 import djerba.util.ini_fields as ini  # TODO new module for these constants?
-import djerba.util.provenance_index as index
 from djerba.helpers.base import helper_base
+from djerba.util.decompression import decompressor, AUTO
+from djerba.util.logger import logger
+from djerba.util.provenance_cache import provenance_cache
 from djerba.util.provenance_reader import provenance_reader, sample_name_container, \
     InvalidConfigurationError
+from djerba.util.provenance_filter import provenance_filter
+from djerba.util.provenance_row import provenance_row, write_projected_header
+from djerba.util.provenance_snapshot import provenance_snapshot
+from djerba.util.provenance_store import provenance_store
+from djerba.util.validator import path_validator
 
 class main(helper_base):
 
     DEFAULT_PROVENANCE_INPUT = '/scratch2/groups/gsi/production/vidarr/'+\
         'vidarr_files_report_latest.tsv.gz'
     PROVENANCE_INPUT_KEY = 'provenance_input_path'
+    DEFAULT_PROVENANCE_INDEX_DIR = '/scratch2/groups/gsi/production/vidarr/'
+    PROVENANCE_INDEX_KEY = 'provenance_index_dir'
+    # shared cache of provenance subsets; disabled if the directory does not exist,
+    # or maximum size is zero
+    DEFAULT_PROVENANCE_CACHE_DIR = '/scratch2/groups/gsi/production/djerba/provenance_cache/'
+    PROVENANCE_CACHE_KEY = 'provenance_cache_dir'
+    DEFAULT_PROVENANCE_CACHE_SIZE = 10
+    PROVENANCE_CACHE_SIZE_KEY = 'provenance_cache_max_size_gb'
+    DEFAULT_PROVENANCE_CACHE_AGE = 30
+    PROVENANCE_CACHE_AGE_KEY = 'provenance_cache_max_age_days'
+    # backend to decompress the FPR, and number of threads; 0 threads = all available CPUs
+    PROVENANCE_DECOMPRESSION_KEY = 'provenance_decompression'
+    PROVENANCE_THREADS_KEY = 'provenance_threads'
     STUDY_TITLE = 'project'
     ROOT_SAMPLE_NAME = 'donor'
     PROVENANCE_OUTPUT = 'provenance_subset.tsv.gz'
@@ -37,12 +63,18 @@ class main(helper_base):
     ]
 
     # identifiers for bam/bai files
-    WG_N_BAM = 'whole genome normal bam'
-    WG_N_IDX = 'whole genome normal bam index'
-    WG_T_BAM = 'whole genome tumour bam'
-    WG_T_IDX = 'whole genome tumour bam index'
-    WT_T_BAM = 'whole transcriptome tumour bam'
-    WT_T_IDX = 'whole transcriptome tumour bam index'
+    WG_N_BAM = provenance_reader.WG_N_BAM
+    WG_N_IDX = provenance_reader.WG_N_IDX
+    WG_T_BAM = provenance_reader.WG_T_BAM
+    WG_T_IDX = provenance_reader.WG_T_IDX
+    WT_T_BAM = provenance_reader.WT_T_BAM
+    WT_T_IDX = provenance_reader.WT_T_IDX
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # background write of the provenance subset, if any; see prefetch()
+        self.prefetch_future = None
+        self.prefetch_params = None
 
     def configure(self, config):
         """
@@ -51,6 +83,9 @@ class main(helper_base):
         config = self.apply_defaults(config)
         wrapper = self.get_config_wrapper(config)
         provenance_path = wrapper.get_my_string(self.PROVENANCE_INPUT_KEY)
+        index_dir = wrapper.get_my_string(self.PROVENANCE_INDEX_KEY)
+        decompression = wrapper.get_my_string(self.PROVENANCE_DECOMPRESSION_KEY)
+        threads = wrapper.get_my_int(self.PROVENANCE_THREADS_KEY)
         input_data = self.workspace.read_maybe_input_params()
         if input_data == None:
             msg = "Input params JSON does not exist. Parameters must be set manually."
@@ -67,14 +102,20 @@ class main(helper_base):
                     wrapper.set_my_param(key, input_data[key])
         study = wrapper.get_my_string(self.STUDY_TITLE)
         donor = wrapper.get_my_string(self.ROOT_SAMPLE_NAME)
-        if self.workspace.has_file(self.PROVENANCE_OUTPUT):
+        params = (study, donor, provenance_path, index_dir, decompression, threads)
+        if self.wait_for_prefetch(params):
+            self.logger.debug("Provenance subset cache was written by prefetch")
+        elif self.workspace.has_file(self.PROVENANCE_OUTPUT):
             self.logger.debug("Provenance subset cache exists, will not overwrite")
         else:
             self.logger.info("Writing provenance subset cache to workspace")
-            self.write_provenance_subset(study, donor, provenance_path)
+            cache = self.get_provenance_cache(wrapper)
+            self.write_provenance_subset(
+                study, donor, provenance_path, index_dir, cache, decompression, threads
+            )
         # write sample_info.json; populate sample names from provenance if needed
         samples = self.get_sample_name_container(wrapper)
-        sample_info, path_info = self.read_provenance(study, donor, samples)
+        sample_info, path_info = self.read_provenance(study, donor, samples, decompression, threads)
         self.write_path_info(path_info)
         keys = [core_constants.TUMOUR_ID, core_constants.NORMAL_ID]
         keys.extend(self.SAMPLE_NAME_KEYS)
@@ -105,6 +146,9 @@ class main(helper_base):
         self.validate_full_config(config)
         wrapper = self.get_config_wrapper(config)
         provenance_path = wrapper.get_my_string(self.PROVENANCE_INPUT_KEY)
+        index_dir = wrapper.get_my_string(self.PROVENANCE_INDEX_KEY)
+        decompression = wrapper.get_my_string(self.PROVENANCE_DECOMPRESSION_KEY)
+        threads = wrapper.get_my_int(self.PROVENANCE_THREADS_KEY)
         study = wrapper.get_my_string(self.STUDY_TITLE)
         donor = wrapper.get_my_string(self.ROOT_SAMPLE_NAME)
         if self.workspace.has_file(self.PROVENANCE_OUTPUT):
@@ -113,14 +157,17 @@ class main(helper_base):
             self.logger.info(msg)
         else:
             self.logger.info("Writing provenance subset cache to workspace")
-            self.write_provenance_subset(study, donor, provenance_path)
+            cache = self.get_provenance_cache(wrapper)
+            self.write_provenance_subset(
+                study, donor, provenance_path, index_dir, cache, decompression, threads
+            )
         if self.workspace.has_file(core_constants.DEFAULT_SAMPLE_INFO) and \
            self.workspace.has_file(core_constants.DEFAULT_PATH_INFO):
             msg = "extract: sample/path info files already in workspace, will not overwrite"
             self.logger.info(msg)
         else:
             samples = self.get_sample_name_container(wrapper)
-            sample_info, path_info = self.read_provenance(study, donor, samples)
+            sample_info, path_info = self.read_provenance(study, donor, samples, decompression, threads)
             if not self.workspace.has_file(core_constants.DEFAULT_SAMPLE_INFO):
                 self.logger.debug('extract: writing sample info')
                 self.write_sample_info(sample_info)
@@ -128,6 +175,29 @@ class main(helper_base):
                 self.logger.debug('extract: writing path info')
                 self.write_path_info(path_info)
 
+    def get_provenance_cache(self, config_wrapper):
+        """Get the shared provenance subset cache, or None if it is not in use"""
+        cache_dir = config_wrapper.get_my_string(self.PROVENANCE_CACHE_KEY)
+        max_size_gb = config_wrapper.get_my_float(self.PROVENANCE_CACHE_SIZE_KEY)
+        max_age_days = config_wrapper.get_my_float(self.PROVENANCE_CACHE_AGE_KEY)
+        if max_size_gb <= 0:
+            self.logger.debug("Provenance cache maximum size is zero, not using cache")
+            cache = None
+        elif not os.path.isdir(cache_dir):
+            msg = "Provenance cache directory {0} does not exist, ".format(cache_dir)+\
+                "not using cache"
+            self.logger.info(msg)
+            cache = None
+        else:
+            cache = provenance_cache(
+                cache_dir,
+                int(max_size_gb*1024**3),
+                max_age_days*24*60*60,
+                self.log_level,
+                self.log_path
+            )
+        return cache
+
     def get_sample_name_container(self, config_wrapper):
         """
         Populate a sample name container for input to the file provenance reader
@@ -152,7 +222,83 @@ class main(helper_base):
             raise InvalidConfigurationError(msg)
         return samples
 
-    def read_provenance(self, study, donor, samples):
+    def prefetch(self, config):
+        """
+        Start writing the provenance subset in a background thread, if possible
+        Requires study and donor, from the INI or the input params JSON; configure()
+        waits for the result. Returns the workspace files written by configure() if the
+        prefetch was started, otherwise an empty list; see helper_base.prefetch()
+        """
+        if self.workspace.has_file(self.PROVENANCE_OUTPUT):
+            self.logger.debug("Provenance subset cache exists, no prefetch needed")
+            return []
+        # work on a copy of the config, which may not be modified
+        config_copy = ConfigParser()
+        config_copy.read_dict({self.identifier: config[self.identifier]})
+        wrapper = self.get_config_wrapper(self.apply_defaults(config_copy))
+        input_data = self.workspace.read_maybe_input_params()
+        for key in [self.STUDY_TITLE, self.ROOT_SAMPLE_NAME]:
+            if wrapper.my_param_is_null(key):
+                if input_data == None or input_data.get(key) == None:
+                    msg = "Cannot resolve '{0}' before configuration, no prefetch".format(key)
+                    self.logger.debug(msg)
+                    return []
+                wrapper.set_my_param(key, input_data[key])
+        try:
+            params = (
+                wrapper.get_my_string(self.STUDY_TITLE),
+                wrapper.get_my_string(self.ROOT_SAMPLE_NAME),
+                wrapper.get_my_string(self.PROVENANCE_INPUT_KEY),
+                wrapper.get_my_string(self.PROVENANCE_INDEX_KEY),
+                wrapper.get_my_string(self.PROVENANCE_DECOMPRESSION_KEY),
+                wrapper.get_my_int(self.PROVENANCE_THREADS_KEY)
+            )
+            cache = self.get_provenance_cache(wrapper)
+        except ValueError as err:
+            # invalid params are reported by configure()
+            self.logger.debug("Cannot read provenance params, no prefetch: {0}".format(err))
+            return []
+        (study, donor, provenance_path, index_dir, decompression, threads) = params
+        self.logger.info("Prefetch: writing provenance subset in the background")
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.prefetch_params = params
+        self.prefetch_future = executor.submit(
+            self.write_provenance_subset,
+            study, donor, provenance_path, index_dir, cache, decompression, threads
+        )
+        executor.shutdown(wait=False)
+        return [
+            self.PROVENANCE_OUTPUT,
+            core_constants.DEFAULT_SAMPLE_INFO,
+            core_constants.DEFAULT_PATH_INFO,
+            core_constants.DEFAULT_FILE_STATS
+        ]
+
+    def wait_for_prefetch(self, params):
+        """
+        Wait for the prefetch started by prefetch(), if any
+        Returns True if the prefetch wrote the provenance subset for the given params
+        """
+        if self.prefetch_future == None:
+            return False
+        self.logger.debug("Waiting for provenance prefetch to finish")
+        future = self.prefetch_future
+        self.prefetch_future = None
+        try:
+            future.result()
+        except Exception as err:
+            msg = "Provenance prefetch failed, will retry: {0}".format(err)
+            self.logger.warning(msg)
+            return False
+        if params != self.prefetch_params:
+            msg = "Provenance params changed after prefetch, will rewrite provenance subset: "+\
+                "Expected {0}, found {1}".format(self.prefetch_params, params)
+            self.logger.warning(msg)
+            self.workspace.remove_file(self.PROVENANCE_OUTPUT)
+            return False
+        return True
+
+    def read_provenance(self, study, donor, samples, decompression=AUTO, threads=0):
         """
         Parse file provenance and populate the sample info data structure
         If the sample names are unknown, get from file provenance given study and donor
@@ -165,7 +311,9 @@ class main(helper_base):
             donor,
             samples,
             log_level=self.log_level,
-            log_path=self.log_path
+            log_path=self.log_path,
+            decompression=decompression,
+            threads=threads
         )
         names = reader.get_sample_names()
         ids = reader.get_identifiers()
@@ -179,40 +327,21 @@ class main(helper_base):
             ini.SAMPLE_NAME_WG_N: names.get(ini.SAMPLE_NAME_WG_N),
             ini.SAMPLE_NAME_WT_T: names.get(ini.SAMPLE_NAME_WT_T)
         }
-        # find paths of workflow outputs; values may be None
-        path_info = {
-            reader.WF_ARRIBA: reader.parse_arriba_path(),
-            reader.WF_BMPP: {
-                self.WG_T_BAM: reader.parse_wg_bam_path(),
-                self.WG_T_IDX: reader.parse_wg_index_path(),
-                self.WG_N_BAM: reader.parse_wg_bam_ref_path(),
-                self.WG_N_IDX: reader.parse_wg_index_ref_path()
-            },
-            reader.WF_DELLY: reader.parse_delly_path(),
-            reader.WF_GRIDSS: reader.parse_gridss_path(),
-            reader.WF_HRDETECT: reader.parse_hrdetect_path(),
-            reader.WF_MAVIS: reader.parse_mavis_path(),
-            reader.WF_MRDETECT: reader.parse_mrdetect_path(),
-            reader.WF_MSISENSOR: reader.parse_msi_path(),
-            reader.WF_MUTECT: reader.parse_mutect_path(),
-            reader.WF_PURPLE: reader.parse_purple_zip_path(),
-            reader.WF_RSEM: reader.parse_gep_path(),
-            reader.WF_SEQUENZA: reader.parse_sequenza_path(),
-            reader.WF_STAR: {
-                self.WT_T_BAM: reader.parse_wt_bam_path(),
-                self.WT_T_IDX: reader.parse_wt_index_path()
-            },
-            reader.WF_STARFUSION: reader.parse_starfusion_predictions_path(),
-            reader.WF_VEP: reader.parse_maf_path(),
-            reader.WF_VIRUS: reader.parse_virus_path(),
-            reader.WF_IMMUNE: reader.parse_immune_path()
-        }
+        # find paths of workflow outputs, in one pass over the provenance subset
+        # outputs are specified by provenance_reader.get_outputs(); values may be None
+        path_info = reader.resolve_output_paths()
         return sample_info, path_info
 
     def specify_params(self):
         self.logger.debug("Specifying params for provenance helper")
         self.set_priority_defaults(self.PRIORITY)
         self.set_ini_default(self.PROVENANCE_INPUT_KEY, self.DEFAULT_PROVENANCE_INPUT)
+        self.set_ini_default(self.PROVENANCE_INDEX_KEY, self.DEFAULT_PROVENANCE_INDEX_DIR)
+        self.set_ini_default(self.PROVENANCE_CACHE_KEY, self.DEFAULT_PROVENANCE_CACHE_DIR)
+        self.set_ini_default(self.PROVENANCE_CACHE_SIZE_KEY, self.DEFAULT_PROVENANCE_CACHE_SIZE)
+        self.set_ini_default(self.PROVENANCE_CACHE_AGE_KEY, self.DEFAULT_PROVENANCE_CACHE_AGE)
+        self.set_ini_default(self.PROVENANCE_DECOMPRESSION_KEY, AUTO)
+        self.set_ini_default(self.PROVENANCE_THREADS_KEY, 0)
         self.add_ini_discovered(self.STUDY_TITLE)
         self.add_ini_discovered(self.ROOT_SAMPLE_NAME)
         self.add_ini_discovered(ini.SAMPLE_NAME_WG_N)
@@ -221,31 +350,150 @@ class main(helper_base):
         self.add_ini_discovered(core_constants.TUMOUR_ID)
         self.add_ini_discovered(core_constants.NORMAL_ID)
 
+    def get_file_stats(self, path_info):
+        """
+        Stat all paths in the path info concurrently, and report any which are invalid
+        Returns a dictionary: path -> size and mtime, or an error message
+        """
+        paths = []
+        pending = [path_info]
+        while pending:
+            for value in pending.pop().values():
+                if isinstance(value, dict):
+                    pending.append(value)
+                elif value != None:
+                    paths.append(value)
+        file_stats = path_validator(self.log_level, self.log_path).stat_input_files(paths)
+        for (path, result) in file_stats.items():
+            if path_validator.ERROR in result:
+                self.logger.warning("Invalid workflow output: {0}".format(result[path_validator.ERROR]))
+        return file_stats
+
     def write_path_info(self, path_info):
         self.workspace.write_json(core_constants.DEFAULT_PATH_INFO, path_info)
+        file_stats = self.get_file_stats(path_info)
+        self.workspace.write_json(core_constants.DEFAULT_FILE_STATS, file_stats)
         self.logger.debug("Wrote path info to workspace: {0}".format(path_info))
 
-    def write_provenance_subset(self, study, donor, provenance_path):
-        self.logger.info('Started reading file provenance from {0}'.format(provenance_path))
-        total = 0
-        kept = 0
-        with gzip.open(provenance_path, 'rt') as in_file, \
-             self.workspace.open_gzip_file(self.PROVENANCE_OUTPUT, write=True) as out_file:
-            reader = csv.reader(in_file, delimiter="\t")
-            writer = csv.writer(out_file, delimiter="\t")
-            for row in reader:
-                total += 1
-                if total % 100000 == 0:
-                    self.logger.debug("Read {0} input rows".format(total))
-                if row[index.STUDY_TITLE] == study and row[index.ROOT_SAMPLE_NAME] == donor:
-                    writer.writerow(row)
-                    kept += 1
-        self.logger.info('Done reading FPR; kept {0} of {1} rows'.format(kept, total))
+    def write_provenance_subset(self, study, donor, provenance_path, index_dir=None, cache=None,
+                                decompression=AUTO, threads=0):
+        """
+        Write rows for the given study and donor to the workspace
+        If a provenance_cache is given, copy from the cache if possible; otherwise
+        write the subset and add it to the cache
+        """
+        out_path = self.workspace.abs_path(self.PROVENANCE_OUTPUT)
+        if cache != None and cache.get(provenance_path, study, donor, out_path):
+            self.logger.debug('Copied provenance subset from cache')
+            return
+        entry_path = None if cache == None else cache.get_entry_path(provenance_path, study, donor)
+        writer = provenance_subset_writer(
+            provenance_path, index_dir, self.log_level, self.log_path, decompression, threads
+        )
+        writer.write([(study, donor, out_path)])
+        if cache != None:
+            cache.put(provenance_path, study, donor, out_path, entry_path)
         self.logger.debug('Wrote provenance subset to {0}'.format(self.PROVENANCE_OUTPUT))
 
     def write_sample_info(self, sample_info):
         self.workspace.write_json(core_constants.DEFAULT_SAMPLE_INFO, sample_info)
         self.logger.debug("Wrote sample info to workspace: {0}".format(sample_info))
 
+class provenance_subset_writer(logger):
+    """
+    Write provenance subsets for one or more (study, donor) pairs
+    - If the provenance store is current, query it for each donor
+    - Otherwise, if the provenance snapshot is current, read only the blocks for each donor
+    - Otherwise, read the entire FPR once and route each row to its output(s)
+    Batch wall time is then one FPR scan, instead of one scan per donor
+    """
+
+    def __init__(self, provenance_path, index_dir=None, log_level=logging.WARNING, log_path=None,
+                 decompression=AUTO, threads=0):
+        self.log_level = log_level
+        self.log_path = log_path
+        self.logger = self.get_logger(log_level, __name__, log_path)
+        self.provenance_path = provenance_path
+        self.snapshot = provenance_snapshot(provenance_path, index_dir, log_level, log_path)
+        store_path = provenance_store.get_default_path(provenance_path, index_dir)
+        self.store = provenance_store(store_path, log_level, log_path)
+        self.decompressor = decompressor(decompression, threads, log_level, log_path)
+
+    def _read_full_provenance(self, keys):
+        # read the entire FPR, and yield projected rows whose (study, donor) is in keys
+        # provenance_filter parses only rows which may match
+        row_filter = provenance_filter(keys)
+        with self.decompressor.open_binary(self.provenance_path) as in_file:
+            for row in row_filter.filter_rows(in_file):
+                yield provenance_row.from_full_row(row)
+        msg = "Done reading FPR; skipped {0} of {1} chunks, parsed {2} lines".format(
+            row_filter.skipped_chunks, row_filter.total_chunks, row_filter.parsed_lines
+        )
+        self.logger.info(msg)
+
+    def _read_store(self, keys):
+        for (study, donor) in keys:
+            yield from self.store.read_rows(study, donor)
+
+    def _read_snapshot(self, keys):
+        for (study, donor) in keys:
+            for row in self.snapshot.read_rows(study, donor):
+                yield provenance_row.from_full_row(row)
+
+    def write(self, targets):
+        """
+        Input is a list of (study, donor, output_path) tuples
+        Each output is a gzipped TSV of projected rows, with the columns of provenance_row;
+        it is written to a temporary file and renamed when complete, so a report reading
+        the subset never sees a partial file
+        Returns a dictionary of rows written, indexed by output path
+        """
+        outputs = {} # (study, donor) -> list of output paths
+        for (study, donor, out_path) in targets:
+            outputs.setdefault((study, donor), []).append(out_path)
+        if self.store.is_current(self.provenance_path):
+            self.logger.info('Reading file provenance from store {0}'.format(self.store.store_path))
+            rows = self._read_store(outputs.keys())
+        elif self.snapshot.is_current():
+            self.logger.info('Reading file provenance from snapshot {0}'.format(self.snapshot.bgzf_path))
+            rows = self._read_snapshot(outputs.keys())
+        else:
+            self.logger.info('Started reading file provenance from {0}'.format(self.provenance_path))
+            rows = self._read_full_provenance(outputs.keys())
+        suffix = '.tmp.{0}'.format(os.getpid())
+        handles = {}
+        writers = {}
+        kept = {}
+        complete = False
+        try:
+            for key, out_paths in outputs.items():
+                handles[key] = [gzip.open(x+suffix, 'wt') for x in out_paths]
+                writers[key] = [csv.writer(x, delimiter="\t") for x in handles[key]]
+                for writer in writers[key]:
+                    write_projected_header(writer)
+                for out_path in out_paths:
+                    kept[out_path] = 0
+            for row in rows:
+                key = (row.study_title, row.root_sample_name)
+                values = row.to_list()
+                for writer in writers[key]:
+                    writer.writerow(values)
+                for out_path in outputs[key]:
+                    kept[out_path] += 1
+            complete = True
+        finally:
+            for key_handles in handles.values():
+                for handle in key_handles:
+                    handle.close()
+            for out_path in kept.keys():
+                if complete:
+                    os.replace(out_path+suffix, out_path)
+                    self.logger.debug('Kept {0} rows for {1}'.format(kept[out_path], out_path))
+                elif os.path.exists(out_path+suffix):
+                    os.remove(out_path+suffix)
+        self.logger.info('Wrote {0} provenance subset(s)'.format(len(kept)))
+        return kept
+
+
 class DjerbaProvenanceError(Exception):
     pass
@@ -0,0 +1,220 @@
+"""
+Read and write BGZF (blocked gzip) files, as used by htslib/samtools
+
+A BGZF file is a series of gzip members, each holding at most 64 KiB of uncompressed
+data, followed by an empty EOF block. Any gzip reader can decompress the whole file;
+because each block records its own compressed size, a BGZF-aware reader can also seek
+directly to a block by its offset in the compressed file.
+
+The writer here only starts a new block at a record boundary, so each record is found
+in a single block unless it is too large to fit in one.
+"""
+
+import io
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# uncompressed payload per block; same limit as htslib, leaves room for incompressible data
+MAX_BLOCK_DATA = 0xff00
+# gzip header with FEXTRA set, XLEN=6 and a 'BC' subfield; BSIZE is appended
+BLOCK_HEADER = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+HEADER_LENGTH = 18
+FOOTER_LENGTH = 8
+# standard empty block written at the end of every BGZF file
+EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def is_bgzf(path):
+    """Check if the file at the given path starts with a BGZF block header"""
+    with open(path, 'rb') as in_file:
+        header = in_file.read(HEADER_LENGTH)
+    return len(header) == HEADER_LENGTH and header[0:16] == BLOCK_HEADER
+
+
+def compress_block(data, level=6):
+    """Compress up to MAX_BLOCK_DATA bytes into a complete BGZF block"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    bsize = len(cdata) + HEADER_LENGTH + FOOTER_LENGTH - 1
+    footer = struct.pack('<II', zlib.crc32(data), len(data))
+    return BLOCK_HEADER + struct.pack('<H', bsize) + cdata + footer
+
+
+def decompress_block(block):
+    """Decompress a complete BGZF block, as read by bgzf_reader.read_raw_block()"""
+    data = zlib.decompress(block[HEADER_LENGTH:-FOOTER_LENGTH], -15)
+    (crc, isize) = struct.unpack('<II', block[-FOOTER_LENGTH:])
+    if isize != len(data) or crc != zlib.crc32(data):
+        raise BGZFError("Checksum or size mismatch in BGZF block")
+    return data
+
+
+class bgzf_writer:
+    """
+    Write records to a BGZF file, tracking the block offset of each record
+    Records are bytes, and should include their line terminator (if any)
+    """
+
+    def __init__(self, path, level=6):
+        self.out_file = open(path, 'wb')
+        self.level = level
+        self.buffer = bytearray()
+        self.block_offset = 0 # compressed offset of the block now being buffered
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _flush_block(self):
+        if len(self.buffer) > 0:
+            block = compress_block(bytes(self.buffer), self.level)
+            self.out_file.write(block)
+            self.block_offset += len(block)
+            self.buffer = bytearray()
+
+    def close(self):
+        if not self.out_file.closed:
+            self._flush_block()
+            self.out_file.write(EOF_BLOCK)
+            self.out_file.close()
+
+    def write_record(self, record):
+        """
+        Write a record and return the list of block offsets it occupies
+        The list has one element, unless the record is larger than a block; in that
+        case, the record is followed by a block boundary, so no other record shares
+        a block with any part of it except the first
+        """
+        if len(self.buffer) + len(record) > MAX_BLOCK_DATA:
+            self._flush_block()
+        offsets = [self.block_offset]
+        start = 0
+        while len(record) - start > MAX_BLOCK_DATA:
+            self.buffer.extend(record[start:start+MAX_BLOCK_DATA])
+            start += MAX_BLOCK_DATA
+            self._flush_block()
+            offsets.append(self.block_offset)
+        self.buffer.extend(record[start:])
+        if len(offsets) > 1:
+            self._flush_block()
+        return offsets
+
+
+class bgzf_reader:
+    """Random access to the blocks of a BGZF file"""
+
+    def __init__(self, path):
+        self.in_file = open(path, 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.in_file.close()
+
+    def read_raw_block(self, offset):
+        """Return the compressed block at the given offset; empty bytes at end of file"""
+        self.in_file.seek(offset)
+        header = self.in_file.read(HEADER_LENGTH)
+        if len(header) == 0:
+            return b''
+        elif len(header) < HEADER_LENGTH or header[0:16] != BLOCK_HEADER:
+            raise BGZFError("No valid BGZF block header at offset {0}".format(offset))
+        bsize = struct.unpack('<H', header[16:18])[0]
+        block = header + self.in_file.read(bsize + 1 - HEADER_LENGTH)
+        if len(block) != bsize + 1:
+            raise BGZFError("Truncated BGZF block at offset {0}".format(offset))
+        return block
+
+    def read_block(self, offset):
+        """Return the uncompressed data of the block at the given offset, and the next offset"""
+        block = self.read_raw_block(offset)
+        data = decompress_block(block) if block else b''
+        return data, offset + len(block)
+
+    def read_blocks(self, offsets):
+        """
+        Decompress the blocks at the given offsets, in file order
+        Yield the data of each run of consecutive blocks as a single bytes object,
+        so a record split across adjacent blocks is returned whole
+        """
+        run = []
+        next_offset = None
+        for offset in sorted(set(offsets)):
+            if run and offset != next_offset:
+                yield b''.join(run)
+                run = []
+            data, next_offset = self.read_block(offset)
+            run.append(data)
+        if run:
+            yield b''.join(run)
+
+
+class bgzf_parallel_reader(io.RawIOBase):
+    """
+    Decompress an entire BGZF file with a pool of threads, as a readable binary stream
+    Compressed blocks are read in order and decompressed in batches by worker threads;
+    zlib releases the GIL, so batches are decompressed in parallel. Output is in order.
+    Wrap in io.BufferedReader and io.TextIOWrapper for text input, eg. to csv.reader.
+    """
+
+    BLOCKS_PER_TASK = 64
+
+    def __init__(self, path, threads):
+        self.reader = bgzf_reader(path)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.max_pending = 2*threads
+        self.pending = deque()
+        self.offset = 0
+        self.eof = False
+        self.data = b''
+        self.position = 0
+
+    def _submit_tasks(self):
+        while not self.eof and len(self.pending) < self.max_pending:
+            blocks = []
+            while len(blocks) < self.BLOCKS_PER_TASK:
+                block = self.reader.read_raw_block(self.offset)
+                if len(block) == 0:
+                    self.eof = True
+                    break
+                self.offset += len(block)
+                blocks.append(block)
+            if blocks:
+                self.pending.append(self.executor.submit(self._decompress_blocks, blocks))
+
+    @staticmethod
+    def _decompress_blocks(blocks):
+        return b''.join([decompress_block(x) for x in blocks])
+
+    def close(self):
+        if not self.closed:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.reader.close()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.position == len(self.data):
+            self._submit_tasks()
+            if len(self.pending) == 0:
+                return 0
+            self.data = self.pending.popleft().result()
+            self.position = 0
+        size = min(len(buffer), len(self.data) - self.position)
+        buffer[0:size] = self.data[self.position:self.position+size]
+        self.position += size
+        return size
+
+
+class BGZFError(Exception):
+    pass
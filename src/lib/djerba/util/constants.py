@@ -50,6 +50,13 @@ DRAFT = 'draft'
 EXTRACT = 'extract'
 RENDER = 'render'
 UPDATE = 'update'
+PROVENANCE = 'provenance'
+
+# actions for the provenance subcommand of djerba.py
+PROVENANCE_INDEX = 'index'
+PROVENANCE_SUBSET = 'subset'
+PROVENANCE_STORE = 'store'
+PROVENANCE_AUDIT = 'audit'
 
 # mode names for benchmark.py
 # REPORT = 'report' # duplicate of top-level JSON section name; this is fine
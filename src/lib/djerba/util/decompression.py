@@ -0,0 +1,111 @@
+"""
+Backends to decompress gzipped text files, eg. the file provenance report (FPR)
+
+- gzip: Python gzip module; always available, single-threaded
+- pigz: external 'pigz -dc' process, run with subprocess_runner; decompression then
+  runs in parallel with parsing, on another core
+- bgzf: block-parallel decompression with a pool of threads; the file must be BGZF,
+  eg. compressed with bgzip, or a Djerba provenance snapshot
+- auto: bgzf if the file is BGZF and more than one thread is available, otherwise
+  pigz if it is installed, otherwise gzip
+
+If the requested backend cannot be used for a given file, gzip is used instead.
+"""
+
+import gzip
+import io
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+
+import djerba.util.constants as constants
+from djerba.util.bgzf import bgzf_parallel_reader, is_bgzf
+from djerba.util.logger import logger
+from djerba.util.subprocess_runner import subprocess_runner
+
+AUTO = 'auto'
+BGZF = 'bgzf'
+GZIP = 'gzip'
+PIGZ = 'pigz'
+BACKENDS = [AUTO, BGZF, GZIP, PIGZ]
+
+
+def available_threads():
+    """Number of CPUs available to this process"""
+    try:
+        threads = len(os.sched_getaffinity(0))
+    except AttributeError:
+        threads = os.cpu_count()
+    return threads if threads else 1
+
+
+class decompressor(logger):
+
+    PIGZ_COMMAND = 'pigz'
+
+    def __init__(self, backend=AUTO, threads=0, log_level=logging.WARNING, log_path=None):
+        """threads=0 uses all available CPUs"""
+        self.log_level = log_level
+        self.log_path = log_path
+        self.logger = self.get_logger(log_level, __name__, log_path)
+        if backend not in BACKENDS:
+            msg = "Unknown decompression backend '{0}'; must be one of {1}".format(backend, BACKENDS)
+            self.logger.error(msg)
+            raise DecompressionError(msg)
+        self.backend = backend
+        self.threads = threads if threads > 0 else available_threads()
+
+    def get_backend(self, path):
+        """Find the backend to use for the given file"""
+        pigz_ok = shutil.which(self.PIGZ_COMMAND) != None
+        if self.backend == AUTO:
+            if self.threads > 1 and is_bgzf(path):
+                backend = BGZF
+            elif pigz_ok:
+                backend = PIGZ
+            else:
+                backend = GZIP
+        elif self.backend == BGZF and not is_bgzf(path):
+            msg = "{0} is not BGZF compressed, using {1} backend".format(path, GZIP)
+            self.logger.warning(msg)
+            backend = GZIP
+        elif self.backend == PIGZ and not pigz_ok:
+            msg = "{0} not found on PATH, using {1} backend".format(self.PIGZ_COMMAND, GZIP)
+            self.logger.warning(msg)
+            backend = GZIP
+        else:
+            backend = self.backend
+        self.logger.debug("Using {0} backend to decompress {1}".format(backend, path))
+        return backend
+
+    @contextmanager
+    def open_binary(self, path):
+        """Yield a binary stream of the decompressed file"""
+        backend = self.get_backend(path)
+        if backend == BGZF:
+            with io.BufferedReader(bgzf_parallel_reader(path, self.threads)) as in_file:
+                yield in_file
+        elif backend == PIGZ:
+            command = [self.PIGZ_COMMAND, '-dc', '-p', str(self.threads), path]
+            runner = subprocess_runner(self.log_level, self.log_path)
+            with runner.open_stdout(command, 'pigz decompression', binary=True) as in_file:
+                yield in_file
+        else:
+            with gzip.open(path, 'rb') as in_file:
+                yield in_file
+
+    @contextmanager
+    def open_text(self, path):
+        """Yield a text stream of the decompressed file, suitable for csv.reader"""
+        with self.open_binary(path) as in_file:
+            text = io.TextIOWrapper(in_file, encoding=constants.TEXT_ENCODING, newline='')
+            try:
+                yield text
+            finally:
+                # leave the binary stream to be closed by open_binary()
+                text.detach()
+
+
+class DecompressionError(Exception):
+    pass
@@ -0,0 +1,116 @@
+"""
+File locking and atomic writes, for files shared between concurrent Djerba processes
+
+Locks are advisory, using flock() on a separate lock file; so they are respected by
+other Djerba processes, but do not prevent other programs from writing. Atomic writes
+go to a temporary file in the same directory, which is renamed to the destination when
+complete; so a reader sees either the previous version of a file or the new one.
+"""
+
+import fcntl
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+LOCK_SUFFIX = '.lock'
+TMP_INFIX = '.tmp.'
+
+
+class file_lock:
+    """
+    Advisory lock on a file path, usable as a context manager
+    - shared=True allows concurrent shared holders, eg. readers
+    - blocking=False returns immediately if the lock is held elsewhere; check
+      the return value of acquire(), or the 'locked' attribute in a with statement
+    - timeout (seconds) waits at most the given time, then raises FileLockError
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path, shared=False, blocking=True, timeout=None):
+        self.lock_path = path if path.endswith(LOCK_SUFFIX) else path+LOCK_SUFFIX
+        self.shared = shared
+        self.blocking = blocking
+        self.timeout = timeout
+        self.lock_file = None
+        self.locked = False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def acquire(self):
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        self.lock_file = open(self.lock_path, 'a')
+        if self.blocking and self.timeout == None:
+            fcntl.flock(self.lock_file, mode)
+            self.locked = True
+        else:
+            start = time.time()
+            while not self.locked:
+                try:
+                    fcntl.flock(self.lock_file, mode | fcntl.LOCK_NB)
+                    self.locked = True
+                except BlockingIOError:
+                    if not self.blocking:
+                        break
+                    elif time.time() - start > self.timeout:
+                        self.lock_file.close()
+                        self.lock_file = None
+                        msg = "Timed out after {0}s waiting for lock {1}".format(
+                            self.timeout, self.lock_path
+                        )
+                        raise FileLockError(msg)
+                    time.sleep(self.POLL_INTERVAL)
+        if not self.locked:
+            self.lock_file.close()
+            self.lock_file = None
+        return self.locked
+
+    def release(self):
+        if self.lock_file != None:
+            if self.locked:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+        self.lock_file = None
+        self.locked = False
+
+
+def temporary_path(path):
+    """Unique temporary path in the same directory as the given path"""
+    return "{0}{1}{2}.{3}".format(path, TMP_INFIX, os.getpid(), uuid.uuid4().hex[0:8])
+
+
+def is_temporary_path(path):
+    return TMP_INFIX in os.path.basename(path)
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Context manager yielding a file handle for a temporary file
+    On success, the temporary file is renamed to the given path; on error, it is removed
+    """
+    tmp_path = temporary_path(path)
+    try:
+        with open(tmp_path, mode) as out_file:
+            yield out_file
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def atomic_copy(src, dest):
+    """Copy a file, so the destination appears complete or not at all"""
+    with open(src, 'rb') as in_file, atomic_write(dest, 'wb') as out_file:
+        shutil.copyfileobj(in_file, out_file)
+
+
+class FileLockError(Exception):
+    pass
@@ -3,12 +3,19 @@
 # The Python scripts in oncokb-annotator do not have a class structure and would be difficult to import
 # Instead, we run them as subprocesses
 
+import csv
 import os
 import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import djerba.core.constants as core_constants
 import djerba.util.oncokb.constants as oncokb_constants
+import djerba.util.oncokb.metrics as metrics
 import djerba.util.constants as constants
 from djerba.util.oncokb.cache import oncokb_cache, oncokb_cache_params
+from djerba.util.oncokb.client import oncokb_client
+from djerba.util.oncokb.metrics import oncokb_metrics, reset_metrics_file, update_metrics_file
 from djerba.util.logger import logger
 from djerba.util.subprocess_runner import subprocess_runner
 from djerba.util.validator import path_validator
@@ -22,14 +29,37 @@ class annotator_factory(logger):
         self.logger = self.get_logger(log_level, __name__, log_path)
 
     def get_annotator(self, work_dir, config_wrapper):
+        # hybrid cache is optional in plugin configs
+        hybrid_cache = config_wrapper.has_my_param(oncokb_constants.HYBRID_CACHE) and \
+            config_wrapper.get_my_boolean(oncokb_constants.HYBRID_CACHE)
+        # data version and TTL are optional; used to find stale cache entries
+        if config_wrapper.has_my_param(oncokb_constants.DATA_VERSION):
+            data_version = config_wrapper.get_my_string(oncokb_constants.DATA_VERSION)
+        else:
+            data_version = None
+        if config_wrapper.has_my_param(oncokb_constants.CACHE_TTL):
+            ttl_days = config_wrapper.get_my_int(oncokb_constants.CACHE_TTL)
+        else:
+            ttl_days = None
         cache_params = oncokb_cache_params(
             config_wrapper.get_my_string(oncokb_constants.ONCOKB_CACHE),
             config_wrapper.get_my_boolean(oncokb_constants.APPLY_CACHE),
             config_wrapper.get_my_boolean(oncokb_constants.UPDATE_CACHE),
             log_level=self.log_level,
-            log_path=self.log_path
+            log_path=self.log_path,
+            hybrid_cache=hybrid_cache,
+            data_version=data_version,
+            ttl_days=ttl_days
         )
         self.logger.debug("OncoKB cache params: {0}".format(cache_params))
+        # concurrency limit is optional in plugin configs
+        if config_wrapper.has_my_param(oncokb_constants.CONCURRENCY):
+            max_concurrent = config_wrapper.get_my_int(oncokb_constants.CONCURRENCY)
+        else:
+            max_concurrent = oncokb_annotator.DEFAULT_MAX_CONCURRENT
+        # HTTP client is optional in plugin configs; if False, use annotator scripts
+        http_client = config_wrapper.has_my_param(oncokb_constants.HTTP_CLIENT) and \
+            config_wrapper.get_my_boolean(oncokb_constants.HTTP_CLIENT)
         annotator = oncokb_annotator(
             config_wrapper.get_my_string(core_constants.TUMOUR_ID),
             config_wrapper.get_my_string(oncokb_constants.ONCOTREE_CODE),
@@ -37,7 +67,9 @@ class annotator_factory(logger):
             work_dir, # temporary dir -- same as output
             cache_params,
             self.log_level,
-            self.log_path
+            self.log_path,
+            max_concurrent,
+            http_client
         )
         return annotator
 
@@ -47,6 +79,23 @@ class oncokb_annotator(logger):
     # environment variable for ONCOKB token path
     ONCOKB_TOKEN_VARIABLE = 'ONCOKB_TOKEN'
 
+    # maximum number of annotator scripts to run at once in annotate_all()
+    DEFAULT_MAX_CONCURRENT = 4
+    # keys for annotate_all() results
+    MAF = oncokb_constants.MAF
+    CNA = oncokb_constants.CNA
+    FUSION = oncokb_constants.FUSION
+    BIOMARKERS = 'biomarkers'
+
+    # MAF columns which determine the OncoKB query, with and without '-q Genomic_Change'
+    GENOMIC_CHANGE_COLUMNS = [
+        'Chromosome', 'Start_Position', 'End_Position', 'Reference_Allele',
+        'Tumor_Seq_Allele1', 'Tumor_Seq_Allele2'
+    ]
+    PROTEIN_CHANGE_COLUMNS = [
+        'Hugo_Symbol', 'Variant_Classification', 'HGVSp_Short', 'HGVSp', 'Protein_position'
+    ]
+
     # fields for empty oncoKB annotated fusion file
     ONCOKB_FUSION_ANNOTATED_HEADERS = [
         'Tumor_Sample_Barcode', 'Fusion', 'mutation_effect', 'ONCOGENIC',
@@ -56,10 +105,13 @@ class oncokb_annotator(logger):
     ]
 
     def __init__(self, tumour_id, oncotree_code, report_dir, scratch_dir=None,
-                 cache_params=None, log_level=logging.WARNING, log_path=None):
+                 cache_params=None, log_level=logging.WARNING, log_path=None,
+                 max_concurrent=DEFAULT_MAX_CONCURRENT, http_client=False):
         # report_dir is for input and (persistent) output; must contain appropriate input files
         # if given, scratch_dir is for working files not needed for final output
         # cache_params is a djerba.extract.oncokb.cache.params object
+        # max_concurrent is the default limit on concurrent jobs for annotate_all()
+        # if http_client is True, query the OncoKB API in-process instead of running scripts
         self.log_level = log_level
         self.log_path = log_path
         self.logger = self.get_logger(log_level, __name__, log_path)
@@ -72,6 +124,20 @@ class oncokb_annotator(logger):
         else:
             self.scratch_dir = self.report_dir
         self.runner = subprocess_runner(log_level, log_path)
+        if max_concurrent < 1:
+            msg = "Maximum concurrent OncoKB annotations must be at least 1, "+\
+                "found {0}".format(max_concurrent)
+            self.logger.error(msg)
+            raise RuntimeError(msg)
+        self.max_concurrent = max_concurrent
+        self.tumour_id = tumour_id
+        # counters by annotation job; written to the report directory after each job
+        # the metrics file is reset, so it has counts for this annotator only
+        # concurrent jobs write it in turn, under metrics_lock
+        self.metrics = oncokb_metrics()
+        self.metrics_lock = threading.Lock()
+        self.metrics_path = os.path.join(self.report_dir, oncokb_constants.ONCOKB_METRICS)
+        reset_metrics_file(self.metrics_path)
         # Write sample name and oncotree code to a file, for use by annotation scripts
         self.info_path = os.path.join(self.scratch_dir, oncokb_constants.ONCOKB_CLINICAL_INFO)
         args = [tumour_id, oncotree_code]
@@ -81,6 +147,17 @@ class oncokb_annotator(logger):
         # Read the oncokb access token
         with open(os.environ[self.ONCOKB_TOKEN_VARIABLE]) as token_file:
             self.oncokb_token = token_file.read().strip()
+        if http_client:
+            self.client = oncokb_client(
+                self.oncokb_token,
+                tumour_id,
+                oncotree_code,
+                pool_size=max_concurrent,
+                log_level=log_level,
+                log_path=log_path
+            )
+        else:
+            self.client = None
         # Check cache params and configure caching (if any)
         if cache_params==None:
             self.logger.debug("No OncoKB cache parameters supplied; cache operations omitted")
@@ -88,37 +165,48 @@ class oncokb_annotator(logger):
         else:
             self.logger.debug("Using supplied OncoKB cache parameters: {}".format(cache_params))
         cache_dir = cache_params.get_cache_dir()
+        self.apply_cache = cache_params.get_apply_cache()
+        self.update_cache = cache_params.get_update_cache()
+        # hybrid: apply the cache, and run annotator scripts only for cache misses
+        self.hybrid_cache = cache_params.get_hybrid_cache()
+        data_version = cache_params.get_data_version()
+        # the data version is only used to write or refresh entries; apply-cache mode is offline
+        writes_cache = self.hybrid_cache or self.update_cache
+        if cache_dir and writes_cache and data_version == None and self.client != None:
+            try:
+                data_version = self.client.get_data_version()
+            except RuntimeError as err:
+                msg = "Continuing without an OncoKB data version for the cache: {0}".format(err)
+                self.logger.warning(msg)
         if cache_dir:
-            self.cache = oncokb_cache(cache_dir, oncotree_code, log_level, log_path)
+            self.cache = oncokb_cache(
+                cache_dir,
+                oncotree_code,
+                log_level,
+                log_path,
+                data_version=data_version,
+                ttl_days=cache_params.get_ttl_days()
+            )
         else:
             self.cache = None
-        self.apply_cache = cache_params.get_apply_cache()
-        self.update_cache = cache_params.get_update_cache()
 
-    def _run_annotator_script(self, command, description):
-        """Redact the OncoKB token (-b argument) from logging"""
-        self.runner.run(command, description, ['-b',])
-        
-    def annotate_cna(self, in_file_extension=''):
+    def _annotate_cna(self, in_file_extension):
         in_path = os.path.join(self.report_dir, ''.join((in_file_extension,oncokb_constants.DATA_CNA_ONCOKB_GENES_NON_DIPLOID)))
         self.validator.validate_input_file(in_path)
         out_path = os.path.join(self.report_dir, ''.join((in_file_extension,oncokb_constants.DATA_CNA_ONCOKB_GENES_NON_DIPLOID_ANNOTATED)))
         if self.apply_cache:
             self.cache.annotate_cna(in_path, out_path, self.info_path)
+        elif self.hybrid_cache:
+            run_script = self._get_script_runner('CnaAnnotator.py', 'CNA annotator')
+            self.cache.annotate_cna(in_path, out_path, self.info_path, run_script)
         else:
-            cmd = [
-                'CnaAnnotator.py',
-                '-i', in_path,
-                '-o', out_path,
-                '-c', self.info_path,
-                '-b', self.oncokb_token
-            ]
-            self._run_annotator_script(cmd, 'CNA annotator')
+            run_script = self._get_script_runner('CnaAnnotator.py', 'CNA annotator')
+            run_script(in_path, out_path)
             if self.update_cache:
                 self.cache.write_cna_cache(out_path)
         return out_path
 
-    def annotate_fusion(self):
+    def _annotate_fusion(self):
         in_path = os.path.join(self.report_dir, constants.DATA_FUSIONS_ONCOKB)
         self.validator.validate_input_file(in_path)
         out_path = os.path.join(self.report_dir, oncokb_constants.DATA_FUSIONS_ONCOKB_ANNOTATED)
@@ -126,6 +214,9 @@ class oncokb_annotator(logger):
             total = len(in_file.readlines())
         if self.apply_cache:
             self.cache.annotate_fusion(in_path, out_path)
+        elif self.hybrid_cache:
+            run_script = self._get_script_runner('FusionAnnotator.py', 'fusion annotator')
+            self.cache.annotate_fusion(in_path, out_path, run_script)
         elif total == 0:
             # should never happen, but include for completeness
             msg = "Fusion input {0} cannot be empty -- header is expected".format(in_path)
@@ -139,59 +230,236 @@ class oncokb_annotator(logger):
         else:
             msg = "Read {0} lines of fusion input, running Fusion annotator".format(total)
             self.logger.debug(msg)
-            cmd = ['which', 'FusionAnnotator.py']
-            self.runner.run(cmd)
-            cmd = [
-                'FusionAnnotator.py',
-                '-i', in_path,
-                '-o', out_path,
-                '-c', self.info_path,
-                '-b', self.oncokb_token
-            ]
-            self._run_annotator_script(cmd, 'fusion annotator')
+            if self.client == None:
+                cmd = ['which', 'FusionAnnotator.py']
+                self.runner.run(cmd)
+            run_script = self._get_script_runner('FusionAnnotator.py', 'fusion annotator')
+            run_script(in_path, out_path)
             if self.update_cache:
                 self.cache.write_fusion_cache(out_path)
         return out_path
 
-    def annotate_maf(self, in_path):
-        # unlike the CNA and Fusion methods, MAF annotation takes an input path argument
+    def _annotate_maf(self, in_path):
         self.validator.validate_input_file(in_path)
         out_path = os.path.join(self.scratch_dir, oncokb_constants.ANNOTATED_MAF)
         if self.apply_cache:
             self.cache.annotate_maf(in_path, out_path)
+        elif self.hybrid_cache:
+            run_script = self._get_maf_runner(genomic_change=True)
+            self.cache.annotate_maf(in_path, out_path, run_script)
         else:
-            cmd = [
-                'MafAnnotator.py',
-                '-i', in_path,
-                '-o', out_path,
-                '-c', self.info_path,
-                '-q', 'Genomic_Change',
-                '-b', self.oncokb_token
-            ]
-            self._run_annotator_script(cmd, 'MAF annotator')
+            run_script = self._get_maf_runner(genomic_change=True)
+            run_script(in_path, out_path)
             if self.update_cache:
                 self.cache.write_maf_cache(out_path)
         return out_path
     
-    def annotate_biomarkers_maf(self, in_path, out_path):
-        """although it uses the same MafAnnotator script, 
-        other biomarkers needs to be seperate because 
-        it can't use 'Genomic_Change'"""
+    def _annotate_biomarkers_maf(self, in_path, out_path):
         self.validator.validate_input_file(in_path)
         if self.apply_cache:
             self.logger.debug("Applying cache for biomarker annotation")
             self.cache.annotate_maf(in_path, out_path)
+        elif self.hybrid_cache:
+            self.logger.debug("Applying cache for biomarker annotation, with online annotation of misses")
+            run_script = self._get_maf_runner(genomic_change=False)
+            self.cache.annotate_maf(in_path, out_path, run_script)
         else:
-            cmd = [
-                'MafAnnotator.py',
-                '-i', in_path,
-                '-o', out_path,
-                '-c', self.info_path,
-                '-b', self.oncokb_token
-            ]
-            self._run_annotator_script(cmd, 'MAF annotator')
+            run_script = self._get_maf_runner(genomic_change=False)
+            run_script(in_path, out_path)
             if self.update_cache:
                 self.logger.debug("Updating cache for biomarker annotation")
                 self.cache.write_maf_cache(out_path)
         return out_path
 
+    def _get_dedup_runner(self, run_annotator, key_columns):
+        """
+        Wrap a MAF annotation function, so only distinct variants are annotated
+        Rows have the same key if they have the same values in key_columns, and the same
+        tumour type; the tumour type is that of the clinical info file if the sample is
+        the tumour, and the OncoKB default otherwise
+        Annotations are copied to every row with the same key, in input order
+        Input is read twice, so only distinct rows are held in memory
+        """
+        def run_dedup(in_path, out_path):
+            with open(in_path) as in_file:
+                reader = csv.reader(in_file, delimiter="\t")
+                header = next(reader, None)
+                if header == None:
+                    msg = "MAF input {0} cannot be empty -- header is expected".format(in_path)
+                    self.logger.error(msg)
+                    raise RuntimeError(msg)
+                indices = [header.index(x) for x in key_columns if x in header]
+                if len(indices) == 0:
+                    msg = "None of the MAF key columns {0} found in header of {1}; ".format(
+                        key_columns, in_path
+                    )+"variants are distinct only if all columns are equal"
+                    self.logger.warning(msg)
+                    indices = list(range(len(header)))
+                if 'Tumor_Sample_Barcode' in header:
+                    barcode = header.index('Tumor_Sample_Barcode')
+                else:
+                    barcode = None
+                def get_key(row):
+                    key = tuple([row[i] for i in indices])
+                    if barcode != None:
+                        key = key + (row[barcode] == self.tumour_id,)
+                    return key
+                total = 0
+                distinct = {}
+                for row in reader:
+                    key = get_key(row)
+                    if key not in distinct:
+                        distinct[key] = row
+                    total += 1
+            msg = "Annotating {0} distinct variants from {1} MAF rows".format(len(distinct), total)
+            self.logger.debug(msg)
+            with tempfile.TemporaryDirectory(prefix='oncokb_dedup_', dir=self.scratch_dir) as tmp_dir:
+                tmp_in = os.path.join(tmp_dir, 'input.txt')
+                tmp_out = os.path.join(tmp_dir, 'annotated.txt')
+                with open(tmp_in, 'w') as tmp_file:
+                    for row in [header]+list(distinct.values()):
+                        print("\t".join(row), file=tmp_file)
+                run_annotator(tmp_in, tmp_out)
+                with open(tmp_out) as tmp_file:
+                    annotated = list(csv.reader(tmp_file, delimiter="\t"))
+            # annotator output has the input columns, followed by annotation columns
+            if len(annotated) != len(distinct)+1:
+                msg = "Expected {0} rows of annotator output, found {1}".format(
+                    len(distinct)+1, len(annotated)
+                )
+                self.logger.error(msg)
+                raise RuntimeError(msg)
+            boundary = len(header)
+            annotations = {
+                key: row[boundary:] for (key, row) in zip(distinct.keys(), annotated[1:])
+            }
+            with open(in_path) as in_file, open(out_path, 'w') as out_file:
+                reader = csv.reader(in_file, delimiter="\t")
+                next(reader)
+                print("\t".join(header+annotated[0][boundary:]), file=out_file)
+                for row in reader:
+                    print("\t".join(row+annotations[get_key(row)]), file=out_file)
+        return run_dedup
+
+    def _get_maf_runner(self, genomic_change):
+        """Function to annotate distinct variants in a MAF file, by genomic or protein change"""
+        if genomic_change:
+            run_script = self._get_script_runner(
+                'MafAnnotator.py', 'MAF annotator', ['-q', 'Genomic_Change']
+            )
+            key_columns = self.GENOMIC_CHANGE_COLUMNS
+        else:
+            run_script = self._get_script_runner('MafAnnotator.py', 'MAF annotator')
+            key_columns = self.PROTEIN_CHANGE_COLUMNS
+        return self._get_dedup_runner(run_script, key_columns)
+
+    def _get_script_runner(self, script, description, extra_args=[]):
+        """
+        Function to annotate given input/output paths: with the HTTP client if configured,
+        otherwise by running an annotator script
+        """
+        if script == 'CnaAnnotator.py':
+            key = self.CNA
+        elif script == 'FusionAnnotator.py':
+            key = self.FUSION
+        elif 'Genomic_Change' in extra_args:
+            key = self.MAF
+        else:
+            key = self.BIOMARKERS
+        if self.client != None:
+            if key == self.CNA:
+                run_annotator = self.client.annotate_cna
+            elif key == self.FUSION:
+                run_annotator = self.client.annotate_fusion
+            else:
+                genomic_change = key == self.MAF
+                run_annotator = lambda x, y: self.client.annotate_maf(x, y, genomic_change)
+        else:
+            def run_annotator(in_path, out_path):
+                cmd = [
+                    script,
+                    '-i', in_path,
+                    '-o', out_path,
+                    '-c', self.info_path,
+                ]
+                cmd.extend(extra_args)
+                cmd.extend(['-b', self.oncokb_token])
+                self._run_annotator_script(cmd, description)
+        def run_script(in_path, out_path):
+            with self.metrics.timer(key, metrics.SUBPROCESS_SECONDS):
+                run_annotator(in_path, out_path)
+            self.metrics.add(key, metrics.SUBPROCESS_CALLS)
+        return run_script
+
+    def _run_job(self, key, method, *args):
+        """Run an annotation method, timing it and writing metrics even if it fails"""
+        try:
+            with self.metrics.timer(key, metrics.ANNOTATION_SECONDS):
+                result = method(*args)
+        finally:
+            self.write_metrics()
+        return result
+
+    def _run_annotator_script(self, command, description):
+        """Redact the OncoKB token (-b argument) from logging"""
+        self.runner.run(command, description, ['-b',])
+        
+    def annotate_all(self, maf_path=None, biomarkers=None, cna=True, fusion=True,
+                     max_concurrent=None):
+        """
+        Start independent annotations concurrently, with at most max_concurrent at once
+        - maf_path: input for annotate_maf(), if any
+        - biomarkers: (input path, output path) for annotate_biomarkers_maf(), if any
+        - cna, fusion: if True, run annotate_cna() and annotate_fusion()
+        Returns a dictionary of futures, eg. {self.MAF: future}; the result of each future
+        is the output path, and result() raises any error from the annotation
+        """
+        if max_concurrent == None:
+            max_concurrent = self.max_concurrent
+        jobs = {}
+        if maf_path:
+            jobs[self.MAF] = (self.annotate_maf, [maf_path])
+        if biomarkers:
+            jobs[self.BIOMARKERS] = (self.annotate_biomarkers_maf, list(biomarkers))
+        if cna:
+            jobs[self.CNA] = (self.annotate_cna, [])
+        if fusion:
+            jobs[self.FUSION] = (self.annotate_fusion, [])
+        self.logger.debug("Starting OncoKB annotation of {0}".format(list(jobs.keys())))
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_concurrent, len(jobs))))
+        futures = {key: executor.submit(method, *args) for (key, (method, args)) in jobs.items()}
+        # jobs already submitted will run to completion
+        executor.shutdown(wait=False)
+        return futures
+
+    def annotate_cna(self, in_file_extension=''):
+        return self._run_job(self.CNA, self._annotate_cna, in_file_extension)
+
+    def annotate_fusion(self):
+        return self._run_job(self.FUSION, self._annotate_fusion)
+
+    def annotate_maf(self, in_path):
+        # unlike the CNA and Fusion methods, MAF annotation takes an input path argument
+        return self._run_job(self.MAF, self._annotate_maf, in_path)
+
+    def annotate_biomarkers_maf(self, in_path, out_path):
+        """although it uses the same MafAnnotator script, 
+        other biomarkers needs to be seperate because 
+        it can't use 'Genomic_Change'"""
+        return self._run_job(self.BIOMARKERS, self._annotate_biomarkers_maf, in_path, out_path)
+
+    def get_metrics(self):
+        """Cumulative counters for annotation jobs, and for the cache if any"""
+        results = {metrics.ANNOTATOR: self.metrics.get()}
+        if self.cache:
+            results[metrics.CACHE] = self.cache.metrics.get()
+        return results
+
+    def write_metrics(self):
+        """Add counts since the previous write to the metrics file in the report directory"""
+        with self.metrics_lock:
+            sections = {metrics.ANNOTATOR: self.metrics.get_new()}
+            if self.cache:
+                sections[metrics.CACHE] = self.cache.metrics.get_new()
+            update_metrics_file(self.metrics_path, sections)
+        self.logger.debug("Updated OncoKB metrics in {0}".format(self.metrics_path))
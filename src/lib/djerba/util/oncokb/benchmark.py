@@ -0,0 +1,122 @@
+"""
+Benchmark OncoKB cache backends for MAF annotation in apply-cache mode
+
+Run with the benchmark_oncokb_cache.py script. A synthetic MAF cache is written in the
+JSON format, and converted to each other backend; then the same input MAF is annotated
+from each backend, and outputs are checked for consistency.
+"""
+
+import filecmp
+import json
+import logging
+import os
+import time
+
+import djerba.util.oncokb.constants as oncokb_constants
+from djerba.util.logger import logger
+from djerba.util.oncokb.cache import oncokb_cache
+
+class oncokb_cache_benchmark(logger):
+
+    DEFAULT_ENTRIES = 100000
+    DEFAULT_ROWS = 1000
+    GENES = ['KRAS', 'TP53', 'CDKN2A', 'SMAD4', 'BRCA2', 'ATM', 'PIK3CA', 'EGFR']
+    MAF_COLUMNS = ['Hugo_Symbol', 'Chromosome', 'Start_Position', 'Reference_Allele',
+                   'Tumor_Seq_Allele2']
+
+    # keys for results
+    ANNOTATE_SECONDS = 'annotate_seconds'
+    BACKEND = 'backend'
+    CONVERT_SECONDS = 'convert_seconds'
+    ENTRIES = 'entries'
+    ROWS = 'rows'
+    SPEEDUP = 'speedup'
+
+    def __init__(self, log_level=logging.WARNING, log_path=None):
+        self.log_level = log_level
+        self.log_path = log_path
+        self.logger = self.get_logger(log_level, __name__, log_path)
+
+    def get_maf_row(self, i):
+        gene = self.GENES[i % len(self.GENES)]
+        return [gene, 'chr{0}'.format(i % 22 + 1), str(10000+i), 'C', 'T']
+
+    def get_annotations(self, i):
+        """Synthetic annotations, of similar size to real ones"""
+        annotations = ['' for x in oncokb_cache.ANNOTATION_HEADERS]
+        annotations[0:6] = ['True', 'True', 'True', 'Likely Loss-of-function',
+                            ';'.join([str(20000000+i+j) for j in range(5)]), 'Likely Oncogenic']
+        return annotations
+
+    def run(self, work_dir, entries=DEFAULT_ENTRIES, rows=DEFAULT_ROWS):
+        """
+        Write a cache with the given number of entries, and an input MAF with the given
+        number of rows, of which half are in the cache; time annotation with each backend
+        Returns a list of result dictionaries
+        """
+        cache_dir = os.path.join(work_dir, 'cache')
+        os.mkdir(cache_dir)
+        annotated_path = os.path.join(work_dir, 'annotated.maf')
+        input_path = os.path.join(work_dir, 'input.maf')
+        with open(annotated_path, 'w') as out_file:
+            print("\t".join(self.MAF_COLUMNS+oncokb_cache.ANNOTATION_HEADERS), file=out_file)
+            for i in range(entries):
+                print("\t".join(self.get_maf_row(i)+self.get_annotations(i)), file=out_file)
+        with open(input_path, 'w') as out_file:
+            print("\t".join(self.MAF_COLUMNS), file=out_file)
+            stride = max(1, entries // rows)
+            for i in range(rows):
+                # odd-numbered rows are cache misses
+                row = self.get_maf_row(i*stride if i % 2 == 0 else entries+i)
+                print("\t".join(row), file=out_file)
+        cache = oncokb_cache(cache_dir, log_level=self.log_level, log_path=self.log_path,
+                             backend=oncokb_constants.BACKEND_JSON)
+        cache.write_maf_cache(annotated_path)
+        self.logger.info("Wrote JSON cache with {0} entries".format(entries))
+        results = []
+        json_output = None
+        for backend in oncokb_constants.BACKENDS:
+            cache = oncokb_cache(cache_dir, log_level=self.log_level, log_path=self.log_path,
+                                 backend=backend)
+            start = time.time()
+            if backend != oncokb_constants.BACKEND_JSON:
+                cache.migrate(backend)
+            convert_seconds = time.time() - start
+            output_path = os.path.join(work_dir, 'output_{0}.maf'.format(backend))
+            start = time.time()
+            cache.annotate_maf(input_path, output_path)
+            annotate_seconds = time.time() - start
+            if json_output == None:
+                json_output = output_path
+            elif not filecmp.cmp(json_output, output_path, shallow=False):
+                msg = "Output from {0} backend differs from JSON output".format(backend)
+                self.logger.error(msg)
+                raise RuntimeError(msg)
+            result = {
+                self.BACKEND: backend,
+                self.ENTRIES: entries,
+                self.ROWS: rows,
+                self.CONVERT_SECONDS: round(convert_seconds, 4),
+                self.ANNOTATE_SECONDS: round(annotate_seconds, 4),
+                self.SPEEDUP: None
+            }
+            results.append(result)
+            self.logger.info("Annotated from {0} backend in {1:.4f}s".format(backend, annotate_seconds))
+        json_seconds = results[0][self.ANNOTATE_SECONDS]
+        for result in results:
+            if result[self.ANNOTATE_SECONDS] > 0:
+                result[self.SPEEDUP] = round(json_seconds / result[self.ANNOTATE_SECONDS], 2)
+        return results
+
+    def format_results(self, results):
+        """Format results as a TSV table, with columns in order of the first result"""
+        columns = list(results[0].keys()) if results else []
+        lines = ["\t".join(columns)]
+        for result in results:
+            lines.append("\t".join([str(result[x]) for x in columns]))
+        return "\n".join(lines)+"\n"
+
+    def write_results(self, results, out_path):
+        with open(out_path, 'w') as out_file:
+            out_file.write(json.dumps(results, indent=4))
+        self.logger.info("Wrote benchmark results to {0}".format(out_path))
@@ -11,35 +11,56 @@ import json
 import logging
 import os
 import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, ExitStack
+from djerba.util.locking import file_lock, atomic_write
 from djerba.util.logger import logger
+from djerba.util.oncokb.metrics import oncokb_metrics
+from djerba.util.oncokb.mmap_store import oncokb_mmap_store
+from djerba.util.oncokb.store import oncokb_sqlite_store
 from djerba.util.validator import path_validator
 import djerba.util.oncokb.constants as oncokb_constants
+import djerba.util.oncokb.metrics as metrics
 import djerba.util.constants as constants
 
 class oncokb_cache_params(logger):
     """Convenience class to contain parameters for caching operation"""
 
     def __init__(self, cache_dir=None, apply_cache=False, update_cache=False,
-                 log_level=logging.WARNING, log_path=None):
+                 log_level=logging.WARNING, log_path=None, hybrid_cache=False,
+                 data_version=None, ttl_days=None):
+        # hybrid_cache = apply the cache, annotate any misses online, and update the cache
+        # data_version = current OncoKB data version, recorded with new cache entries
+        # hybrid mode treats entries from other data versions, or older than ttl_days, as misses
         self.logger = self.get_logger(log_level, __name__, log_path)
         # Check cache inputs and configure cache (if any)
         err = None
         if apply_cache and update_cache:
             err = "Bad arguments; cannot do both apply_cache and update_cache for oncoKB caching"
-        elif (apply_cache or update_cache) and not cache_dir:
-            err = "Bad arguments; apply/update cache requested without cache_dir"
+        elif hybrid_cache and (apply_cache or update_cache):
+            err = "Bad arguments; hybrid_cache cannot be combined with apply_cache or update_cache"
+        elif (apply_cache or update_cache or hybrid_cache) and not cache_dir:
+            err = "Bad arguments; apply/update/hybrid cache requested without cache_dir"
         if err:
-            self.logger.error(msg)
-            raise RuntimeError(msg)
+            self.logger.error(err)
+            raise RuntimeError(err)
         self.cache_dir = cache_dir
         self.apply_cache = apply_cache
         self.update_cache = update_cache
+        self.hybrid_cache = hybrid_cache
+        self.data_version = data_version
+        self.ttl_days = ttl_days
 
     def __str__(self):
         params = {
             'cache_dir': self.cache_dir,
             'apply_cache': self.apply_cache,
-            'update_cache': self.update_cache
+            'update_cache': self.update_cache,
+            'hybrid_cache': self.hybrid_cache,
+            'data_version': self.data_version,
+            'ttl_days': self.ttl_days
         }
         return str(params)
 
@@ -49,12 +70,21 @@ class oncokb_cache_params(logger):
     def get_cache_dir(self):
         return self.cache_dir
 
+    def get_data_version(self):
+        return self.data_version
+
     def get_apply_cache(self):
         return self.apply_cache
 
     def get_update_cache(self):
         return self.update_cache
 
+    def get_hybrid_cache(self):
+        return self.hybrid_cache
+
+    def get_ttl_days(self):
+        return self.ttl_days
+
 
 class oncokb_cache(logger):
 
@@ -66,7 +96,21 @@ class oncokb_cache(logger):
     # headers for extra annotation columns
     ANNOTATION_HEADERS = ["ANNOTATED", "GENE_IN_ONCOKB", "VARIANT_IN_ONCOKB", "MUTATION_EFFECT", "MUTATION_EFFECT_CITATIONS", "ONCOGENIC", "LEVEL_1", "LEVEL_2", "LEVEL_3A", "LEVEL_3B", "LEVEL_4", "LEVEL_R1", "LEVEL_R2", "HIGHEST_LEVEL", "HIGHEST_SENSITIVE_LEVEL", "HIGHEST_RESISTANCE_LEVEL", "TX_CITATIONS", "LEVEL_Dx1", "LEVEL_Dx2", "LEVEL_Dx3", "HIGHEST_DX_LEVEL", "DX_CITATIONS", "LEVEL_Px1", "LEVEL_Px2", "LEVEL_Px3", "HIGHEST_PX_LEVEL", "PX_CITATIONS"]
 
-    def __init__(self, cache_base, oncotree_code=None, log_level=logging.WARNING, log_path=None):
+    # each cache entry has the annotations, followed by metadata: the OncoKB data version
+    # (empty if unknown) and the time of insertion, in seconds since the epoch
+    # entries written by earlier versions of Djerba have no metadata
+    METADATA_SIZE = 2
+    SECONDS_PER_DAY = 86400
+
+    # rows per batch for cache lookup; memory use is bounded by batch size, not input size
+    BATCH_SIZE = 10000
+
+    def __init__(self, cache_base, oncotree_code=None, log_level=logging.WARNING, log_path=None,
+                 backend=None, data_version=None, ttl_days=None):
+        # backend is JSON files, a SQLite store, or memory-mapped binary files
+        # if None, use SQLite if the store exists, otherwise binary files if they exist
+        self.log_level = log_level
+        self.log_path = log_path
         self.logger = self.get_logger(log_level, __name__, log_path)
         self.validator = path_validator(log_level, log_path)
         self.validator.validate_output_dir(cache_base)
@@ -86,6 +130,162 @@ class oncokb_cache(logger):
         self.maf_cache = os.path.join(self.cache_dir, oncokb_constants.CACHE_MAF)
         self.cna_cache = os.path.join(self.cache_dir, oncokb_constants.CACHE_CNA)
         self.fusion_cache = os.path.join(self.cache_dir, oncokb_constants.CACHE_FUSION)
+        self.json_paths = {
+            oncokb_constants.CNA: self.cna_cache,
+            oncokb_constants.FUSION: self.fusion_cache,
+            oncokb_constants.MAF: self.maf_cache
+        }
+        self.store = oncokb_sqlite_store(self.cache_dir, log_level, log_path)
+        self.mmap_store = oncokb_mmap_store(self.cache_dir, log_level, log_path)
+        if backend == None:
+            if self.store.exists():
+                backend = oncokb_constants.BACKEND_SQLITE
+            elif self.mmap_store.exists():
+                backend = oncokb_constants.BACKEND_MMAP
+            else:
+                backend = oncokb_constants.BACKEND_JSON
+        elif backend not in oncokb_constants.BACKENDS:
+            msg = "Unknown OncoKB cache backend '{0}'".format(backend)
+            self.logger.error(msg)
+            raise RuntimeError(msg)
+        self.backend = backend
+        self.logger.debug("Using {0} backend for OncoKB cache".format(self.backend))
+        # for metadata of new entries, and to find stale entries; see is_stale()
+        self.data_version = data_version
+        self.ttl_days = ttl_days
+        # updates may come from concurrent annotations, eg. MAF and biomarkers
+        self.update_lock = threading.Lock()
+        # counters by cache type, eg. hits and timings; see djerba.util.oncokb.metrics
+        self.metrics = oncokb_metrics()
+
+    def _add_totals(self, cache_type, total, hits, start):
+        """Add totals for one annotation from the cache, starting at the given time"""
+        self.metrics.add(cache_type, metrics.LOOKUPS, total)
+        self.metrics.add(cache_type, metrics.HITS, hits)
+        self.metrics.add(cache_type, metrics.MISSES, total - hits)
+        self.metrics.add(cache_type, metrics.ANNOTATION_SECONDS, time.time() - start)
+
+    def _add_metadata(self, annotations):
+        """New dictionary of annotations, with metadata for the current version and time"""
+        metadata = [self.data_version if self.data_version else '', str(int(time.time()))]
+        size = len(self.ANNOTATION_HEADERS)
+        return {key: value[0:size]+metadata for (key, value) in annotations.items()}
+
+    def _compact_json(self, cache_type, json_path):
+        """Remove stale entries from a JSON cache file; return [entries kept, entries removed]"""
+        kept = 0
+        removed = 0
+        with file_lock(json_path):
+            cache = self._initialize_cache(json_path)
+            if cache_type == oncokb_constants.CNA:
+                groups = list(cache.values())
+            else:
+                groups = [cache]
+            for group in groups:
+                for key in list(group.keys()):
+                    if self.is_stale(group[key]):
+                        del group[key]
+                        removed += 1
+                    else:
+                        kept += 1
+            if cache_type == oncokb_constants.CNA:
+                cache = {x: y for (x, y) in cache.items() if len(y) > 0}
+            self._write_cache(cache, json_path)
+        return [kept, removed]
+
+    def _find_misses(self, keyed_rows, lookup):
+        """
+        First pass of hybrid annotation: find rows whose keys are not in the cache
+        keyed_rows is an iterator of (row, key) pairs
+        Returns a dictionary of distinct keys and rows
+        """
+        misses = {}
+        for batch in self._read_batches(keyed_rows):
+            found = lookup([key for (row, key) in batch])
+            for (row, key) in batch:
+                if key not in found and key not in misses:
+                    misses[key] = row
+        return misses
+
+    @contextmanager
+    def _open_lookup(self, cache_type, exclude_stale=False, allow_missing=False):
+        """
+        Context manager for a function to look up annotations for a list of keys, returning
+        a dictionary of keys found in the cache, without metadata; CNA keys are
+        (hugo symbol, alteration). Cache files opened for lookups are closed on exit.
+        If exclude_stale is True, stale entries are omitted, ie. treated as misses
+        If allow_missing is True and the cache has not been written, every key is a miss
+        """
+        with ExitStack() as stack:
+            if allow_missing and not os.path.exists(self._get_cache_path(cache_type)):
+                self.logger.debug("No {0} cache found, all keys are misses".format(cache_type))
+                lookup_entries = lambda keys: {}
+            else:
+                with self.metrics.timer(cache_type, metrics.LOAD_SECONDS):
+                    lookup_entries = stack.enter_context(self._open_entry_lookup(cache_type))
+            size = len(self.ANNOTATION_HEADERS)
+            def lookup(keys):
+                start = time.time()
+                found = {}
+                stale = 0
+                for (key, value) in lookup_entries(keys).items():
+                    if exclude_stale and self.is_stale(value):
+                        stale += 1
+                    else:
+                        found[key] = value[0:size]
+                self.metrics.add(cache_type, metrics.STALE, stale)
+                self.metrics.add(cache_type, metrics.LOOKUP_SECONDS, time.time() - start)
+                return found
+            yield lookup
+
+    def _get_cache_path(self, cache_type):
+        """Path of the file read for the given cache type, with the current backend"""
+        if self.backend == oncokb_constants.BACKEND_SQLITE:
+            return self.store.path
+        elif self.backend == oncokb_constants.BACKEND_MMAP:
+            return self.mmap_store.paths[cache_type]
+        else:
+            return self.json_paths[cache_type]
+
+    @contextmanager
+    def _open_entry_lookup(self, cache_type):
+        """
+        Context manager for a function to look up cache entries for a list of keys
+        The SQLite and binary backends read only the given keys; for the JSON backend, the cache
+        file is read once, on entry. A binary cache file is memory-mapped until exit.
+        Bytes loaded are the size of the JSON file, or the stored size of each value read
+        """
+        if self.backend == oncokb_constants.BACKEND_SQLITE:
+            self.validator.validate_input_file(self.store.path)
+            yield lambda keys: self._get_sized(cache_type, self.store, keys)
+        elif self.backend == oncokb_constants.BACKEND_MMAP:
+            self.validator.validate_input_file(self.mmap_store.paths[cache_type])
+            with self.mmap_store.open(cache_type) as table:
+                yield lambda keys: self._get_sized(cache_type, table, keys)
+        else:
+            cache_path = self.json_paths[cache_type]
+            self.validator.validate_input_file(cache_path)
+            with open(cache_path) as cache_file:
+                cache = json.loads(cache_file.read())
+            self.metrics.add(cache_type, metrics.BYTES_LOADED, os.path.getsize(cache_path))
+            def lookup(keys):
+                found = {}
+                for key in keys:
+                    if cache_type == oncokb_constants.CNA:
+                        value = cache.get(key[0], {}).get(key[1])
+                    else:
+                        value = cache.get(key)
+                    if value != None:
+                        found[key] = value
+                return found
+            yield lookup
+
+    def _get_sized(self, cache_type, store, keys):
+        """Get entries from a SQLite store or binary table, counting the bytes loaded"""
+        sizes = []
+        found = store.get(cache_type, keys, sizes)
+        self.metrics.add(cache_type, metrics.BYTES_LOADED, sum(sizes))
+        return found
 
     def _initialize_cache(self, cache_input):
         if cache_input:
@@ -98,15 +298,105 @@ class oncokb_cache(logger):
             self.logger.debug("No cache input given")
         return cache
 
+    def _annotate_misses(self, cache_type, header, rows, run_annotator, work_dir):
+        """
+        Annotate rows which were not found in the cache, and add the results to the cache
+        - header and rows are in the input format for the annotator script
+        - run_annotator is a function taking input and output paths, which runs the script
+        Returns a dictionary of cache keys and annotations
+        """
+        annotations = self._annotate_rows(cache_type, header, rows, run_annotator, work_dir)
+        # all results are cached, including those not in OncoKB, so they are not queried again
+        self._update_cache(cache_type, annotations)
+        return annotations
+
+    def _annotate_rows(self, cache_type, header, rows, run_annotator, work_dir):
+        """
+        Annotate rows with run_annotator, as for _annotate_misses(), without caching
+        Returns a dictionary of cache keys and annotations
+        """
+        with tempfile.TemporaryDirectory(prefix='oncokb_cache_misses_', dir=work_dir) as tmp_dir:
+            in_path = os.path.join(tmp_dir, 'input.txt')
+            out_path = os.path.join(tmp_dir, 'annotated.txt')
+            with open(in_path, 'w') as in_file:
+                for row in [header]+rows:
+                    print("\t".join(row), file=in_file)
+            self.logger.debug("Annotating {0} {1} cache misses".format(len(rows), cache_type))
+            with self.metrics.timer(cache_type, metrics.SUBPROCESS_SECONDS):
+                run_annotator(in_path, out_path)
+            self.metrics.add(cache_type, metrics.SUBPROCESS_CALLS)
+            with open(out_path) as out_file:
+                annotated = list(csv.reader(out_file, delimiter="\t"))
+        if len(annotated) == 0 or self.ANNOTATION_HEADERS[0] not in annotated[0]:
+            msg = "Cannot find annotation columns in annotator output for {0}".format(cache_type)
+            self.logger.error(msg)
+            raise RuntimeError(msg)
+        boundary = annotated[0].index(self.ANNOTATION_HEADERS[0])
+        annotations = {}
+        for row in annotated[1:]:
+            if cache_type == oncokb_constants.MAF:
+                key = self._make_maf_key(row, boundary)
+            elif cache_type == oncokb_constants.FUSION:
+                key = row[1]
+            else:
+                key = (row[2], row[3])
+            annotations[key] = row[boundary:]
+        self.metrics.add(cache_type, metrics.ANNOTATED, len(annotations))
+        return annotations
+
     def _make_maf_key(self, row, boundary):
         base = re.sub("[\r\n]", "", "\t".join(row[0:boundary]))
         return hashlib.sha256(base.encode(constants.TEXT_ENCODING)).hexdigest()
 
-    def _open_maybe_gzip(self, input_path):
-        if re.search('\.gz$', input_path):
-            return gzip.open(input_path, 'rt')
+    def _open_maybe_gzip(self, path, mode='r'):
+        """Open a text file for reading or writing, with gzip compression if the name ends in .gz"""
+        if re.search(r'\.gz$', path):
+            return gzip.open(path, mode+'t')
         else:
-            return open(input_path)
+            return open(path, mode)
+
+    def _read_batches(self, items):
+        """Yield lists of up to BATCH_SIZE items from an iterator"""
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) == self.BATCH_SIZE:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def _read_cna_rows(self, reader):
+        """Yield (row, key) for CNA input rows with amplification or deletion"""
+        for row in reader:
+            if int(row[1]) == 2:
+                yield (row, (row[0], 'Amplification'))
+            elif int(row[1]) == -2:
+                yield (row, (row[0], 'Deletion'))
+
+    def _read_keyed_rows(self, cache_type, input_path):
+        """
+        Yield (header, row, key) for annotator input rows of a MAF, CNA or fusion file
+        Annotation columns of MAF inputs, if any, are removed
+        """
+        with self._open_maybe_gzip(input_path) as input_file:
+            reader = csv.reader(input_file, delimiter="\t")
+            header = next(reader, None)
+            if header == None:
+                return
+            if cache_type == oncokb_constants.MAF and self.ANNOTATION_HEADERS[0] in header:
+                boundary = header.index(self.ANNOTATION_HEADERS[0])
+            else:
+                boundary = len(header)
+            header = tuple(header[0:boundary])
+            if cache_type == oncokb_constants.CNA:
+                keyed_rows = self._read_cna_rows(reader)
+            elif cache_type == oncokb_constants.FUSION:
+                keyed_rows = ((row, row[1]) for row in reader)
+            else:
+                keyed_rows = ((row[0:boundary], self._make_maf_key(row, boundary)) for row in reader)
+            for (row, key) in keyed_rows:
+                yield (header, row, key)
 
     def _read_oncokb_info(self, info_path):
         rows = 0
@@ -122,116 +412,311 @@ class oncokb_cache(logger):
             raise RuntimeError("Could not parse sample or oncotree code from {0}".format(info_path))
         return [sample, oncotree_code]
 
+    def _update_cache(self, cache_type, annotations, cache_output=None, cache_input=None):
+        """
+        Update the cache with a dictionary of annotations
+        If cache_output is given, or the backend is JSON, update a JSON cache file:
+        cache_output and cache_input may be the same file
+        Otherwise, upsert annotations into the SQLite store or binary files
+        Returns the path of the updated cache
+        """
+        with self.update_lock:
+            return self._update_cache_unlocked(cache_type, annotations, cache_output, cache_input)
+
+    def _update_cache_unlocked(self, cache_type, annotations, cache_output, cache_input):
+        annotations = self._add_metadata(annotations)
+        if cache_output == None and self.backend == oncokb_constants.BACKEND_SQLITE:
+            self.store.update(cache_type, annotations)
+            return self.store.path
+        elif cache_output == None and self.backend == oncokb_constants.BACKEND_MMAP:
+            self.mmap_store.update(cache_type, annotations)
+            return self.mmap_store.paths[cache_type]
+        if not cache_output:
+            cache_output = self.json_paths[cache_type]
+        # other processes may update the same file, eg. reports with the same OncoTree code
+        # so read the current version under an exclusive lock, merge our annotations, and
+        # replace the file atomically; readers do not need the lock
+        with file_lock(cache_output):
+            if cache_input==None and os.path.exists(cache_output):
+                cache_input = cache_output
+            cache = self._initialize_cache(cache_input)
+            if cache_type == oncokb_constants.CNA:
+                for ((hugo_symbol, alteration), value) in annotations.items():
+                    if not hugo_symbol in cache:
+                        cache[hugo_symbol] = {}
+                    cache[hugo_symbol][alteration] = value
+            else:
+                cache.update(annotations)
+            self._write_cache(cache, cache_output)
+        return cache_output
+
     def _write_cache(self, cache, cache_output):
-        with open(cache_output, 'w') as cache_file:
+        with atomic_write(cache_output) as cache_file:
             cache_file.write(json.dumps(cache))
         msg = "Wrote {0} annotations to cache file {1}".format(len(cache), cache_output)
         self.logger.debug(msg)
 
-    def annotate_cna(self, input_cna, output_cna, oncokb_info):
+    def annotate_cna(self, input_cna, output_cna, oncokb_info, run_annotator=None):
         """
         Annotate a CNA file from the cache
         No defaults supported; all hugo_symbol/alteration pairs must be in the cache
         This is consistent with our practice of only annotating CNAs found in OncoKB
+        If run_annotator is given, pairs not in the cache are annotated and cached instead;
+        see _annotate_misses()
+        Rows are read, annotated and written in batches, so memory use does not depend on
+        input size; output is gzipped if its name ends in .gz
         """
-        self.validator.validate_input_file(self.cna_cache)
         msg = "Annotating CNA from cache: "+\
               "Input {0}, output {1}, metadata {2}".format(input_cna, output_cna, oncokb_info)
         self.logger.debug(msg)
-        with open(self.cna_cache) as cache_file:
-            cache = json.loads(cache_file.read())
-        cna_keys = []
-        with open(input_cna) as input_file:
-            reader = csv.reader(input_file, delimiter="\t")
-            first = True
-            for row in reader:
-                hugo_symbol = row[0]
-                if first:
-                    keys = ['HUGO_SYMBOL', 'ALTERATION']
-                    first = False
-                elif int(row[1]) == 2:
-                    keys = [hugo_symbol, 'Amplification']
-                elif int(row[1]) == -2:
-                    keys = [hugo_symbol, 'Deletion']
-                else:
-                    keys = None
-                if keys:
-                    cna_keys.append(keys)
-        [sample, oncotree_code] = self._read_oncokb_info(oncokb_info)
-        with open(output_cna, 'w') as output_file:
-            first = True
-            for keys in cna_keys:
-                [hugo_symbol, alteration] = keys
-                if first:
+        start = time.time()
+        # in hybrid mode, stale entries are annotated again, and the cache need not exist
+        hybrid = run_annotator != None
+        with self._open_lookup(oncokb_constants.CNA, hybrid, hybrid) as lookup:
+            annotated = {}
+            if run_annotator != None:
+                with self._open_maybe_gzip(input_cna) as input_file:
+                    reader = csv.reader(input_file, delimiter="\t")
+                    input_header = next(reader, None)
+                    misses = self._find_misses(self._read_cna_rows(reader), lookup)
+                if len(misses) > 0:
+                    work_dir = os.path.dirname(os.path.abspath(output_cna))
+                    annotated = self._annotate_misses(
+                        oncokb_constants.CNA, input_header, list(misses.values()),
+                        run_annotator, work_dir
+                    )
+            [sample, oncotree_code] = self._read_oncokb_info(oncokb_info)
+            total = 0
+            reads_from_cache = 0
+            with self._open_maybe_gzip(input_cna) as input_file, \
+                 self._open_maybe_gzip(output_cna, 'w') as output_file:
+                reader = csv.reader(input_file, delimiter="\t")
+                if next(reader, None) != None:
                     row = ['SAMPLE_ID', 'CANCER_TYPE', 'HUGO_SYMBOL', 'ALTERATION']
                     row.extend(self.ANNOTATION_HEADERS)
-                    first = False
-                else:
-                    row = [sample, oncotree_code, hugo_symbol, alteration]
-                    try:
-                        row.extend(cache[hugo_symbol][alteration])
-                    except KeyError as err:
-                        msg = "No CNA cache value found for [{0}][{1}]".format(hugo_symbol, alteration)
-                        self.logger.error(msg)
-                        raise RuntimeError(msg) from err
-                print("\t".join(row), file=output_file)
-            self.logger.debug("Wrote {0} annotated CNA rows".format(len(keys)))
+                    print("\t".join(row), file=output_file)
+                for batch in self._read_batches(self._read_cna_rows(reader)):
+                    found = lookup([key for (input_row, key) in batch])
+                    for (input_row, (hugo_symbol, alteration)) in batch:
+                        # misses are in the cache after the first pass; count them as annotated
+                        anno = annotated.get((hugo_symbol, alteration))
+                        if anno == None:
+                            anno = found.get((hugo_symbol, alteration))
+                            if anno != None:
+                                reads_from_cache += 1
+                        if anno == None:
+                            msg = "No CNA cache value found for [{0}][{1}]".format(
+                                hugo_symbol, alteration
+                            )
+                            self.logger.error(msg)
+                            raise RuntimeError(msg)
+                        row = [sample, oncotree_code, hugo_symbol, alteration]
+                        row.extend(anno)
+                        print("\t".join(row), file=output_file)
+                        total += 1
+        self._add_totals(oncokb_constants.CNA, total, reads_from_cache, start)
+        msg = "Found annotation for {0} of {1} CNAs in cache".format(reads_from_cache, total)
+        self.logger.debug(msg)
+        self.logger.debug("Wrote {0} annotated CNA rows".format(total))
         self.logger.debug("CNA cache annotation done.")
 
-    def annotate_fusion(self, input_fusion, output_fusion):
+    def annotate_fusion(self, input_fusion, output_fusion, run_annotator=None):
         """
         Annotate a fusion file from the cache
         Cache key is the fusion ID (column 1, zero-indexed)
         """
-        cache_path = self.fusion_cache
         self.logger.debug("Annotating fusion from cache: Input {0}, output {1}".format(input_fusion, output_fusion))
         self.annotate_maf_or_fusion(
-            cache_path, input_fusion, output_fusion, lambda x,i:x[1], self.DEFAULT_FUSION_ANNOTATIONS
+            oncokb_constants.FUSION, input_fusion, output_fusion, lambda x,i:x[1],
+            self.DEFAULT_FUSION_ANNOTATIONS, run_annotator
         )
         self.logger.debug("Fusion annotation done.")
 
-    def annotate_maf(self, input_maf, output_maf):
+    def annotate_maf(self, input_maf, output_maf, run_annotator=None):
         """Annotate a MAF file from the cache"""
-        cache_path = self.maf_cache
         self.logger.debug("Annotating MAF from cache: Input {0}, output {1}".format(input_maf, output_maf))
         self.annotate_maf_or_fusion(
-            cache_path, input_maf, output_maf, self._make_maf_key, self.DEFAULT_MAF_ANNOTATIONS
+            oncokb_constants.MAF, input_maf, output_maf, self._make_maf_key,
+            self.DEFAULT_MAF_ANNOTATIONS, run_annotator
         )
         self.logger.debug("MAF cache annotation done.")
 
-    def annotate_maf_or_fusion(self, cache_path, input_path, output_path, key_func, defaults):
+    def annotate_maf_or_fusion(self, cache_type, input_path, output_path, key_func, defaults,
+                               run_annotator=None):
         """
         Annotate a MAF or Fusion file from the cache; methods differ only by cache keys and defaults
+        Rows are read, annotated and written in batches, with one cache query per batch,
+        so memory use does not depend on input size; input and output may be gzipped
+        If run_annotator is given, rows not in the cache are annotated and cached, instead
+        of having default values; see _annotate_misses()
         """
-        self.validator.validate_input_file(cache_path)
-        with open(cache_path) as cache_file:
-            cache = json.loads(cache_file.read())
-        reads_from_cache = 0
-        total_reads = 0
-        annotated_rows = []
-        boundary = None # 0-indexed column of first annotation row; needed for MAF annotation
-        with self._open_maybe_gzip(input_path) as input_file:
-            reader = csv.reader(input_file, delimiter="\t")
-            for row in reader:
-                if not boundary:
-                    boundary = len(row)
-                    row.extend(self.ANNOTATION_HEADERS)
-                else:
-                    key = key_func(row, boundary)
-                    anno = cache.get(key)
-                    total_reads += 1
-                    if anno:
+        start = time.time()
+        # in hybrid mode, stale entries are annotated again, and the cache need not exist
+        hybrid = run_annotator != None
+        with self._open_lookup(cache_type, hybrid, hybrid) as lookup:
+            annotated = {}
+            if run_annotator != None:
+                with self._open_maybe_gzip(input_path) as input_file:
+                    reader = csv.reader(input_file, delimiter="\t")
+                    header = next(reader, None)
+                    boundary = 0 if header == None else len(header)
+                    keyed_rows = ((row, key_func(row, boundary)) for row in reader)
+                    misses = self._find_misses(keyed_rows, lookup)
+                if len(misses) > 0:
+                    work_dir = os.path.dirname(os.path.abspath(output_path))
+                    annotated = self._annotate_misses(
+                        cache_type, header, list(misses.values()), run_annotator, work_dir
+                    )
+                    unresolved = len([x for x in misses if x not in annotated])
+                    if unresolved > 0:
+                        msg = "{0} of {1} {2} cache misses ".format(
+                            unresolved, len(misses), cache_type
+                        )+\
+                            "not found in annotator output; using default annotations"
+                        self.logger.warning(msg)
+            reads_from_cache = 0
+            reads_from_annotator = 0
+            total_reads = 0
+            with self._open_maybe_gzip(input_path) as input_file, \
+                 self._open_maybe_gzip(output_path, 'w') as output_file:
+                reader = csv.reader(input_file, delimiter="\t")
+                header = next(reader, None)
+                if header != None:
+                    # 0-indexed column of first annotation row; needed for MAF annotation
+                    boundary = len(header)
+                    # not using csv.writer because it appends extra carriage returns
+                    print("\t".join(header+self.ANNOTATION_HEADERS), file=output_file)
+                for batch in self._read_batches(reader):
+                    keys = [key_func(row, boundary) for row in batch]
+                    found = lookup(keys)
+                    for (row, key) in zip(batch, keys):
+                        total_reads += 1
+                        # misses are in the cache after the first pass; count them as annotated
+                        anno = annotated.get(key)
+                        if anno:
+                            reads_from_annotator += 1
+                        else:
+                            anno = found.get(key)
+                            if anno:
+                                reads_from_cache += 1
+                            else:
+                                anno = defaults
                         row.extend(anno)
-                        reads_from_cache += 1
-                    else:
-                        row.extend(defaults)
-                annotated_rows.append(row)
-        self.logger.debug("Found annotation for "+\
-                          "{0} of {1} variants".format(reads_from_cache, total_reads))
-        with open(output_path, 'w') as output_file:
-            # not using csv.writer because it appends extra carriage returns
-            for row in annotated_rows:
-                print("\t".join(row), file=output_file)
+                        print("\t".join(row), file=output_file)
+        self._add_totals(cache_type, total_reads, reads_from_cache, start)
+        msg = "Found annotation for {0} of {1} variants in cache".format(reads_from_cache, total_reads)
+        if run_annotator != None:
+            msg += ", {0} from annotator".format(reads_from_annotator)
+        self.logger.debug(msg)
+
+    def compact(self):
+        """
+        Remove stale entries, as defined by is_stale(), from all JSON, SQLite and binary
+        cache files in the cache directory
+        Returns a dictionary of cache file paths and [entries kept, entries removed]
+        """
+        if not (self.data_version or self.ttl_days != None):
+            msg = "Cannot compact OncoKB cache: data version or TTL is required"
+            self.logger.error(msg)
+            raise RuntimeError(msg)
+        results = {}
+        for cache_type in oncokb_constants.CACHE_TYPES:
+            json_path = self.json_paths[cache_type]
+            if os.path.exists(json_path):
+                results[json_path] = self._compact_json(cache_type, json_path)
+            mmap_path = self.mmap_store.paths[cache_type]
+            if os.path.exists(mmap_path):
+                results[mmap_path] = self.mmap_store.compact(cache_type, self.is_stale)
+        if self.store.exists():
+            kept = 0
+            removed = 0
+            for cache_type in oncokb_constants.CACHE_TYPES:
+                [type_kept, type_removed] = self.store.compact(cache_type, self.is_stale)
+                kept += type_kept
+                removed += type_removed
+            self.store.vacuum()
+            results[self.store.path] = [kept, removed]
+        for (path, [kept, removed]) in results.items():
+            self.logger.info("Kept {0} and removed {1} entries in {2}".format(kept, removed, path))
+        return results
+
+    def is_stale(self, value, now=None):
+        """
+        Check if a cache entry is stale: from an OncoKB data version other than the
+        current one, or older than the TTL; entries without metadata are stale if a
+        data version or TTL is set
+        """
+        if len(value) == len(self.ANNOTATION_HEADERS) + self.METADATA_SIZE:
+            [version, timestamp] = value[-self.METADATA_SIZE:]
+        else:
+            [version, timestamp] = [None, None]
+        if self.data_version and version != self.data_version:
+            return True
+        if self.ttl_days != None:
+            if timestamp == None:
+                return True
+            now = time.time() if now == None else now
+            return now - int(timestamp) > self.ttl_days*self.SECONDS_PER_DAY
+        return False
+
+    def prewarm(self, inputs, run_annotators, work_dir):
+        """
+        Annotate distinct keys from many input files which are not in the cache, or are
+        stale, and add them to the cache in one update; for SQLite, in one transaction
+        - inputs is a dictionary of cache types and lists of input paths, in the input format
+          for annotate_cna(), annotate_fusion() or annotate_maf(); annotation columns of MAF
+          inputs are ignored, so annotated MAFs from earlier reports may be used
+        - run_annotators is a dictionary of cache types and functions taking input and
+          output paths, as for _annotate_misses()
+        Misses are annotated in one batch for each cache type, or for MAF, each distinct header
+        Returns a dictionary of cache types and [distinct keys, keys annotated]
+        """
+        updates = {}
+        totals = {}
+        for (cache_type, input_paths) in inputs.items():
+            start = time.time()
+            with self._open_lookup(cache_type, exclude_stale=True, allow_missing=True) as lookup:
+                seen = set()
+                # MAF keys depend on all input columns, so misses are grouped by header
+                # CNA and fusion annotators only use fixed columns; use the first header
+                headers = {}
+                misses = {}
+                for input_path in input_paths:
+                    self.logger.debug("Reading {0} keys from {1}".format(cache_type, input_path))
+                    rows = self._read_keyed_rows(cache_type, input_path)
+                    for batch in self._read_batches(rows):
+                        new = {}
+                        for (header, row, key) in batch:
+                            if key not in seen:
+                                seen.add(key)
+                                new[key] = (header, row)
+                        found = lookup(list(new.keys()))
+                        for (key, (header, row)) in new.items():
+                            if key not in found:
+                                group = header if cache_type == oncokb_constants.MAF else None
+                                headers.setdefault(group, header)
+                                misses.setdefault(group, {})[key] = row
+            annotations = {}
+            for (group, rows) in misses.items():
+                annotations.update(self._annotate_rows(
+                    cache_type, list(headers[group]), list(rows.values()),
+                    run_annotators[cache_type], work_dir
+                ))
+            total_misses = sum([len(x) for x in misses.values()])
+            self._add_totals(cache_type, len(seen), len(seen)-total_misses, start)
+            msg = "Found {0} distinct {1} keys, {2} not in cache, ".format(
+                len(seen), cache_type, total_misses
+            )+"{0} annotated".format(len(annotations))
+            self.logger.info(msg)
+            updates[cache_type] = annotations
+            totals[cache_type] = [len(seen), len(annotations)]
+        with self.update_lock:
+            if self.backend == oncokb_constants.BACKEND_SQLITE:
+                self.store.update_many({x: self._add_metadata(y) for (x, y) in updates.items()})
+            else:
+                for (cache_type, annotations) in updates.items():
+                    self._update_cache_unlocked(cache_type, annotations, None, None)
+        return totals
 
     def update_cache_files(self, report_dir):
         """
@@ -245,26 +730,16 @@ class oncokb_cache(logger):
             cna: os.path.join(report_dir, oncokb_constants.DATA_CNA_ONCOKB_GENES_NON_DIPLOID_ANNOTATED),
             fusion: os.path.join(report_dir, oncokb_constants.DATA_FUSIONS_ONCOKB_ANNOTATED)
         }
-        outputs = {
-            maf: self.maf_cache,
-            cna: self.cna_cache,
-            fusion: self.fusion_cache
-        }
         for input_path in inputs.values():
             if not os.path.exists(input_path):
                 msg = "Input file {0} does not exist; ".format(input_path)+\
                       "need to generate report with --no-cleanup option?"
                 self.logger.error(msg)
                 raise RuntimeError(msg)
-        existing = {} # existing cache files, if any
-        for key in outputs.keys():
-            if os.path.exists(outputs[key]):
-                existing[key] = outputs[key]
-            else:
-                existing[key] = None
-        self.write_cna_cache(inputs[cna], outputs[cna], existing[cna])
-        self.write_fusion_cache(inputs[fusion], outputs[fusion], existing[fusion])
-        self.write_maf_cache(inputs[maf], outputs[maf], existing[maf])
+        # existing cache files, if any, are updated
+        self.write_cna_cache(inputs[cna])
+        self.write_fusion_cache(inputs[fusion])
+        self.write_maf_cache(inputs[maf])
 
     def write_cna_cache(self, annotated_cna, cache_output=None, cache_input=None):
         """
@@ -272,21 +747,14 @@ class oncokb_cache(logger):
         Do not cache these; do cache lookup by Hugo_Symbol and CNV status
         """
         self.logger.debug("Writing CNA cache")
-        if not cache_output:
-            cache_output = self.cna_cache
-        if cache_input==None and os.path.exists(cache_output):
-            cache_input = cache_output
-        cache = self._initialize_cache(cache_input)
+        annotations = {}
         with open(annotated_cna) as cna_file:
             reader = csv.reader(cna_file, delimiter="\t")
             for row in reader:
                 hugo_symbol = row[2]
                 alteration = row[3]
-                if not hugo_symbol in cache:
-                    cache[hugo_symbol] = {}
-                cache[hugo_symbol][alteration] = row[4:]
-        self._write_cache(cache, cache_output)
-        return cache_output
+                annotations[(hugo_symbol, alteration)] = row[4:]
+        return self._update_cache(oncokb_constants.CNA, annotations, cache_output, cache_input)
 
     def write_fusion_cache(self, annotated_fusion, cache_output=None, cache_input=None):
         """
@@ -296,20 +764,14 @@ class oncokb_cache(logger):
         Fusion ID has old-style "-" separator instead of "::" for consistency with OncoKB inputs
         """
         self.logger.debug("Writing Fusion cache")
-        if not cache_output:
-            cache_output = self.fusion_cache
-        if cache_input==None and os.path.exists(cache_output):
-            cache_input = cache_output
-        cache = self._initialize_cache(cache_input)
+        annotations = {}
         with open(annotated_fusion) as fusion_file:
             reader = csv.reader(fusion_file, delimiter="\t")
             for row in reader:
                 fusion = row[1]
-                annotations = row[2:]
-                if annotations!=self.DEFAULT_FUSION_ANNOTATIONS:
-                    cache[fusion] = annotations
-        self._write_cache(cache, cache_output)
-        return cache_output
+                if row[2:]!=self.DEFAULT_FUSION_ANNOTATIONS:
+                    annotations[fusion] = row[2:]
+        return self._update_cache(oncokb_constants.FUSION, annotations, cache_output, cache_input)
 
     def write_maf_cache(self, annotated_maf, cache_output=None, cache_input=None):
         """
@@ -317,11 +779,7 @@ class oncokb_cache(logger):
         cache_output and cache_input may be the same file
         """
         self.logger.debug("Updating MAF cache from annotated file {0}".format(annotated_maf))
-        if not cache_output:
-            cache_output = self.maf_cache
-        if cache_input==None and os.path.exists(cache_output):
-            cache_input = cache_output
-        cache = self._initialize_cache(cache_input)
+        annotations = {}
         boundary = None
         with self._open_maybe_gzip(annotated_maf) as maf_file:
             reader = csv.reader(maf_file, delimiter="\t")
@@ -338,8 +796,43 @@ class oncokb_cache(logger):
                         raise RuntimeError(msg)
                 else:
                     key = self._make_maf_key(row, boundary)
-                    annotations = row[boundary:]
-                    if annotations[1] == 'True':
-                        cache[key] = annotations
-        self._write_cache(cache, cache_output)
-        return cache_output
+                    if row[boundary+1] == 'True':
+                        annotations[key] = row[boundary:]
+        return self._update_cache(oncokb_constants.MAF, annotations, cache_output, cache_input)
+
+    def migrate(self, backend=oncokb_constants.BACKEND_SQLITE):
+        """
+        Copy annotations from the JSON cache files, if any, to the SQLite store or binary files
+        Existing entries for the same keys are replaced; JSON files are unchanged
+        Returns the number of annotations copied
+        """
+        if backend == oncokb_constants.BACKEND_SQLITE:
+            store = self.store
+            target = self.store.path
+        elif backend == oncokb_constants.BACKEND_MMAP:
+            store = self.mmap_store
+            target = 'binary files in {0}'.format(self.cache_dir)
+        else:
+            msg = "Cannot migrate OncoKB cache to backend '{0}'".format(backend)
+            self.logger.error(msg)
+            raise RuntimeError(msg)
+        total = 0
+        for cache_type in oncokb_constants.CACHE_TYPES:
+            json_path = self.json_paths[cache_type]
+            if not os.path.exists(json_path):
+                self.logger.debug("No JSON cache file {0}, omitting".format(json_path))
+                continue
+            cache = self._initialize_cache(json_path)
+            if cache_type == oncokb_constants.CNA:
+                annotations = {
+                    (hugo_symbol, alteration): value
+                    for (hugo_symbol, alterations) in cache.items()
+                    for (alteration, value) in alterations.items()
+                }
+            else:
+                annotations = cache
+            total += store.update(cache_type, annotations)
+        self.backend = backend
+        msg = "Migrated {0} annotations from JSON files to {1}".format(total, target)
+        self.logger.info(msg)
+        return total
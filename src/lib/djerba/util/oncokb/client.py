@@ -0,0 +1,325 @@
+"""
+Annotate MAF, CNA and fusion files with an in-process client for the OncoKB API
+
+An alternative to the scripts in oncokb-annotator: queries go to the batch POST
+endpoints of the annotation API, through a single requests.Session with a pool of
+persistent connections, instead of a new Python process and connections per script.
+Output has the same columns as the scripts, ie. input columns and ANNOTATION_HEADERS;
+CNA output has SAMPLE_ID, CANCER_TYPE, HUGO_SYMBOL and ALTERATION, as for the cache.
+"""
+
+import csv
+import logging
+import re
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import djerba.util.oncokb.constants as oncokb_constants
+from djerba.util.logger import logger
+from djerba.util.oncokb.cache import oncokb_cache
+
+class oncokb_client(logger):
+
+    DEFAULT_URL = 'https://www.oncokb.org/api/v1'
+    DEFAULT_REFERENCE_GENOME = 'GRCh38'
+    # queries per POST request
+    DEFAULT_BATCH_SIZE = 100
+    # maximum persistent connections; one per concurrent annotation is sufficient
+    DEFAULT_POOL_SIZE = 4
+    # retries for connection errors and server errors, with exponential backoff
+    DEFAULT_RETRIES = 3
+    BACKOFF_FACTOR = 1
+    RETRY_STATUS = [429, 500, 502, 503, 504]
+    # seconds to wait for connection and response
+    TIMEOUT = 60
+
+    # API endpoints, relative to the base URL
+    INFO = 'info'
+    GENOMIC_CHANGE = 'annotate/mutations/byGenomicChange'
+    PROTEIN_CHANGE = 'annotate/mutations/byProteinChange'
+    COPY_NUMBER = 'annotate/copyNumberAlterations'
+    STRUCTURAL_VARIANT = 'annotate/structuralVariants'
+
+    # highest treatment level is found in this order, as in oncokb-annotator
+    TX_LEVEL_ORDER = [
+        oncokb_constants.LEVEL_R1,
+        oncokb_constants.LEVEL_1,
+        oncokb_constants.LEVEL_2,
+        oncokb_constants.LEVEL_3A,
+        oncokb_constants.LEVEL_3B,
+        oncokb_constants.LEVEL_4,
+        oncokb_constants.LEVEL_R2
+    ]
+
+    def __init__(self, token, tumour_id, oncotree_code, base_url=None,
+                 reference_genome=DEFAULT_REFERENCE_GENOME, batch_size=DEFAULT_BATCH_SIZE,
+                 pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES, match_barcode=True,
+                 log_level=logging.WARNING, log_path=None):
+        # if match_barcode is False, all MAF and fusion rows have the OncoTree code
+        self.logger = self.get_logger(log_level, __name__, log_path)
+        self.tumour_id = tumour_id
+        self.match_barcode = match_barcode
+        self.oncotree_code = oncotree_code
+        self.base_url = (base_url if base_url else self.DEFAULT_URL).rstrip('/')
+        self.reference_genome = reference_genome
+        if batch_size < 1:
+            msg = "OncoKB query batch size must be at least 1, found {0}".format(batch_size)
+            self.logger.error(msg)
+            raise RuntimeError(msg)
+        self.batch_size = batch_size
+        retry = Retry(
+            total=retries,
+            backoff_factor=self.BACKOFF_FACTOR,
+            status_forcelist=self.RETRY_STATUS,
+            allowed_methods=['GET', 'POST'],
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Authorization': 'Bearer {0}'.format(token),
+            'Content-Type': 'application/json'
+        })
+        self.total_requests = 0
+
+    def _get_citations(self, items):
+        """Semicolon-separated PubMed IDs and abstract links, from a list of API objects"""
+        citations = []
+        for item in items:
+            citations.extend(item.get('pmids', []))
+            citations.extend([x.get('link', '') for x in item.get('abstracts', [])])
+        return ';'.join(dict.fromkeys([x for x in citations if x]))
+
+    def _get_implication_levels(self, implications, values):
+        """Add tumour types for diagnostic or prognostic implications, by level"""
+        levels = {}
+        for implication in implications:
+            level = implication.get('levelOfEvidence')
+            tumour_type = implication.get('tumorType') or {}
+            name = tumour_type.get('name') or tumour_type.get('mainType', {}).get('name', '')
+            if level in values and name:
+                levels.setdefault(level, []).append(name)
+        for (level, names) in levels.items():
+            values[level] = ','.join(dict.fromkeys(names))
+
+    def _get_allele(self, header, row):
+        """
+        Alternate allele for a MAF row; as for MafAnnotator.py, Tumor_Seq_Allele1 if it
+        differs from the reference, otherwise Tumor_Seq_Allele2
+        """
+        reference = row[header.index('Reference_Allele')]
+        allele_1 = row[header.index('Tumor_Seq_Allele1')] if 'Tumor_Seq_Allele1' in header else ''
+        allele_2 = row[header.index('Tumor_Seq_Allele2')] if 'Tumor_Seq_Allele2' in header else ''
+        if allele_1 and (allele_1 != reference or not allele_2):
+            return allele_1
+        else:
+            return allele_2
+
+    def _get_tumour_type(self, header, row):
+        """
+        OncoTree code for a MAF or fusion row, or None; as for the annotator scripts, the
+        clinical tumour type applies only to rows for the tumour sample, so other samples,
+        eg. the normal in a pooled MAF, are annotated without a tumour type
+        Input with no Tumor_Sample_Barcode column is taken to be from the tumour
+        """
+        if self.match_barcode and 'Tumor_Sample_Barcode' in header and \
+           row[header.index('Tumor_Sample_Barcode')] != self.tumour_id:
+            return None
+        return self.oncotree_code
+
+    def _make_query(self, query, tumour_type):
+        """Add the tumour type, if any, and reference genome to a query"""
+        if tumour_type != None:
+            query['tumorType'] = tumour_type
+        query['referenceGenome'] = self.reference_genome
+        return query
+
+    def _post(self, endpoint, queries):
+        """POST queries to the given endpoint in batches; return the list of responses"""
+        url = '{0}/{1}'.format(self.base_url, endpoint)
+        results = []
+        for i in range(0, len(queries), self.batch_size):
+            batch = queries[i:i+self.batch_size]
+            try:
+                response = self.session.post(url, json=batch, timeout=self.TIMEOUT)
+            except requests.exceptions.RequestException as err:
+                msg = "OncoKB request to {0} failed: {1}".format(url, err)
+                self.logger.error(msg)
+                raise RuntimeError(msg) from err
+            self.total_requests += 1
+            if response.status_code != 200:
+                # the token is in request headers, not the response; safe to log
+                msg = "OncoKB request to {0} failed with status {1}: {2}".format(
+                    url, response.status_code, response.text[0:500]
+                )
+                self.logger.error(msg)
+                raise RuntimeError(msg)
+            annotations = response.json()
+            if len(annotations) != len(batch):
+                msg = "Expected {0} annotations from {1}, found {2}".format(
+                    len(batch), url, len(annotations)
+                )
+                self.logger.error(msg)
+                raise RuntimeError(msg)
+            results.extend(annotations)
+        self.logger.debug("Annotated {0} queries from {1}".format(len(queries), url))
+        return results
+
+    def _read_tsv(self, in_path):
+        """Return the header and rows of a TSV file"""
+        with open(in_path) as in_file:
+            rows = list(csv.reader(in_file, delimiter="\t"))
+        if len(rows) == 0:
+            msg = "OncoKB annotation input {0} cannot be empty -- header is expected".format(in_path)
+            self.logger.error(msg)
+            raise RuntimeError(msg)
+        return (rows[0], rows[1:])
+
+    def _write_tsv(self, out_path, header, rows):
+        with open(out_path, 'w') as out_file:
+            # not using csv.writer because it appends extra carriage returns
+            for row in [header]+rows:
+                print("\t".join(row), file=out_file)
+        self.logger.debug("Wrote {0} annotated rows to {1}".format(len(rows), out_path))
+
+    def annotate_cna(self, in_path, out_path):
+        """
+        Annotate amplifications and deletions in a CNA file
+        Input has Hugo symbols in the first column, and values in the second
+        """
+        (header, rows) = self._read_tsv(in_path)
+        keys = []
+        for row in rows:
+            if int(row[1]) == 2:
+                keys.append((row[0], 'Amplification'))
+            elif int(row[1]) == -2:
+                keys.append((row[0], 'Deletion'))
+        queries = [
+            {
+                'gene': {'hugoSymbol': hugo_symbol},
+                'copyNameAlterationType': alteration.upper(),
+                'tumorType': self.oncotree_code,
+                'referenceGenome': self.reference_genome
+            } for (hugo_symbol, alteration) in keys
+        ]
+        annotations = self._post(self.COPY_NUMBER, queries)
+        out_header = ['SAMPLE_ID', 'CANCER_TYPE', 'HUGO_SYMBOL', 'ALTERATION']
+        out_rows = []
+        for ((hugo_symbol, alteration), annotation) in zip(keys, annotations):
+            row = [self.tumour_id, self.oncotree_code, hugo_symbol, alteration]
+            row.extend(self.get_annotation_values(annotation))
+            out_rows.append(row)
+        self._write_tsv(out_path, out_header+oncokb_cache.ANNOTATION_HEADERS, out_rows)
+
+    def annotate_fusion(self, in_path, out_path):
+        """
+        Annotate a fusion file; the Fusion column has gene names separated by '-'
+        """
+        (header, rows) = self._read_tsv(in_path)
+        index = header.index('Fusion')
+        queries = []
+        for row in rows:
+            # for an intragenic event with one gene, geneA and geneB are the same
+            genes = row[index].split('-')
+            query = {
+                'geneA': {'hugoSymbol': genes[0]},
+                'geneB': {'hugoSymbol': genes[-1]},
+                'structuralVariantType': 'FUSION',
+                'functionalFusion': True
+            }
+            queries.append(self._make_query(query, self._get_tumour_type(header, row)))
+        annotations = self._post(self.STRUCTURAL_VARIANT, queries)
+        for (row, annotation) in zip(rows, annotations):
+            row.extend(self.get_annotation_values(annotation))
+        self._write_tsv(out_path, header+oncokb_cache.ANNOTATION_HEADERS, rows)
+
+    def annotate_maf(self, in_path, out_path, genomic_change=True):
+        """
+        Annotate a MAF file, by genomic change; or if genomic_change is False, by
+        Hugo symbol and protein change (HGVSp_Short), eg. for biomarkers such as MSI-H
+        """
+        (header, rows) = self._read_tsv(in_path)
+        queries = []
+        if genomic_change:
+            chromosome = header.index('Chromosome')
+            start = header.index('Start_Position')
+            end = header.index('End_Position') if 'End_Position' in header else start
+            reference = header.index('Reference_Allele')
+            for row in rows:
+                location = [re.sub('^chr', '', row[chromosome]), row[start], row[end],
+                            row[reference], self._get_allele(header, row)]
+                query = {'genomicLocation': ','.join(location)}
+                queries.append(self._make_query(query, self._get_tumour_type(header, row)))
+            endpoint = self.GENOMIC_CHANGE
+        else:
+            hugo_symbol = header.index('Hugo_Symbol')
+            protein_change = header.index('HGVSp_Short')
+            for row in rows:
+                query = {
+                    'gene': {'hugoSymbol': row[hugo_symbol]},
+                    'alteration': re.sub('^p\\.', '', row[protein_change])
+                }
+                queries.append(self._make_query(query, self._get_tumour_type(header, row)))
+            endpoint = self.PROTEIN_CHANGE
+        annotations = self._post(endpoint, queries)
+        for (row, annotation) in zip(rows, annotations):
+            row.extend(self.get_annotation_values(annotation))
+        self._write_tsv(out_path, header+oncokb_cache.ANNOTATION_HEADERS, rows)
+
+    def close(self):
+        self.session.close()
+
+    def get_annotation_values(self, annotation):
+        """
+        Convert an API annotation to a list of strings, in the order of ANNOTATION_HEADERS
+        """
+        values = {x: '' for x in oncokb_cache.ANNOTATION_HEADERS}
+        values['ANNOTATED'] = 'True'
+        values['GENE_IN_ONCOKB'] = str(bool(annotation.get('geneExist')))
+        values['VARIANT_IN_ONCOKB'] = str(bool(annotation.get('variantExist')))
+        effect = annotation.get('mutationEffect') or {}
+        values['MUTATION_EFFECT'] = effect.get('knownEffect') or ''
+        # as for MafAnnotator.py, citations are in a nested object
+        values['MUTATION_EFFECT_CITATIONS'] = self._get_citations([effect.get('citations') or {}])
+        values['ONCOGENIC'] = annotation.get('oncogenic') or ''
+        treatments = annotation.get('treatments') or []
+        drugs = {}
+        for treatment in treatments:
+            level = treatment.get('level')
+            if level in self.TX_LEVEL_ORDER:
+                names = '+'.join([x['drugName'] for x in treatment.get('drugs', [])])
+                drugs.setdefault(level, []).append(names)
+        for (level, names) in drugs.items():
+            values[level] = ','.join(dict.fromkeys(names))
+        sensitive = annotation.get('highestSensitiveLevel') or ''
+        resistance = annotation.get('highestResistanceLevel') or ''
+        highest = [x for x in self.TX_LEVEL_ORDER if x in [sensitive, resistance]]
+        values['HIGHEST_LEVEL'] = highest[0] if len(highest) > 0 else ''
+        values['HIGHEST_SENSITIVE_LEVEL'] = sensitive
+        values['HIGHEST_RESISTANCE_LEVEL'] = resistance
+        values['TX_CITATIONS'] = self._get_citations(treatments)
+        diagnostic = annotation.get('diagnosticImplications') or []
+        self._get_implication_levels(diagnostic, values)
+        values['HIGHEST_DX_LEVEL'] = annotation.get('highestDiagnosticImplicationLevel') or ''
+        values['DX_CITATIONS'] = self._get_citations(diagnostic)
+        prognostic = annotation.get('prognosticImplications') or []
+        self._get_implication_levels(prognostic, values)
+        values['HIGHEST_PX_LEVEL'] = annotation.get('highestPrognosticImplicationLevel') or ''
+        values['PX_CITATIONS'] = self._get_citations(prognostic)
+        return [values[x] for x in oncokb_cache.ANNOTATION_HEADERS]
+
+    def get_data_version(self):
+        """Get the current OncoKB data version, eg. 'v4.20'"""
+        url = '{0}/{1}'.format(self.base_url, self.INFO)
+        try:
+            response = self.session.get(url, timeout=self.TIMEOUT)
+            response.raise_for_status()
+            version = response.json()['dataVersion']['version']
+        except (requests.exceptions.RequestException, KeyError, ValueError) as err:
+            msg = "Cannot get OncoKB data version from {0}: {1}".format(url, err)
+            self.logger.error(msg)
+            raise RuntimeError(msg) from err
+        self.logger.debug("OncoKB data version is {0}".format(version))
+        return version
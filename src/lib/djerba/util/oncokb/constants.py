@@ -6,11 +6,16 @@ ANNOTATED_MAF = 'annotated_maf.tsv'
 CACHE_CNA = 'cna_cache.json'
 CACHE_FUSION = 'fusion_cache.json'
 CACHE_MAF = 'maf_cache.json'
+CACHE_MMAP_CNA = 'cna_cache.bin'
+CACHE_MMAP_FUSION = 'fusion_cache.bin'
+CACHE_MMAP_MAF = 'maf_cache.bin'
+CACHE_SQLITE = 'oncokb_cache.sqlite'
 DATA_CNA_ONCOKB_GENES_NON_DIPLOID = 'data_CNA_oncoKBgenes_nonDiploid.txt'
 DATA_CNA_ONCOKB_GENES_NON_DIPLOID_ANNOTATED = 'data_CNA_oncoKBgenes_nonDiploid_annotated.txt'
 DATA_FUSIONS_ONCOKB = 'data_fusions_oncokb.txt'
 DATA_FUSIONS_ONCOKB_ANNOTATED = 'data_fusions_oncokb_annotated.txt'
 ONCOKB_CLINICAL_INFO = 'oncokb_clinical_info.txt'
+ONCOKB_METRICS = 'oncokb_metrics.json'
 
 ### OncoKB levels ###
 
@@ -57,8 +62,24 @@ ONCOTREE_CODE = 'oncotree code'
 ONCOKB_CACHE = 'oncokb cache'
 APPLY_CACHE = 'apply cache'
 UPDATE_CACHE = 'update cache'
+HYBRID_CACHE = 'hybrid cache'
+CONCURRENCY = 'oncokb concurrency'
+HTTP_CLIENT = 'oncokb http client'
+DATA_VERSION = 'oncokb data version'
+CACHE_TTL = 'cache ttl days'
 
 
+### cache types and backends ###
+
+CNA = 'cna'
+FUSION = 'fusion'
+MAF = 'maf'
+CACHE_TYPES = [CNA, FUSION, MAF]
+BACKEND_JSON = 'json'
+BACKEND_SQLITE = 'sqlite'
+BACKEND_MMAP = 'mmap'
+BACKENDS = [BACKEND_JSON, BACKEND_SQLITE, BACKEND_MMAP]
+
 ### miscellaneous ###
 
 ALL_CURATED_GENES = '20240315-allCuratedGenes.tsv'
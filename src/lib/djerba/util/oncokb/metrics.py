@@ -0,0 +1,109 @@
+"""
+Counters for OncoKB annotation and caching, eg. cache hits, misses and timings
+
+Counters are kept by key, eg. cache type or annotation job, and are safe to update from
+concurrent annotation threads. Totals are cumulative for each object; new counts since
+the previous write are added to a metrics JSON file, which is reset at the start of a run
+so counts from an earlier run in the same directory are not included. Writes from
+concurrent threads are serialized by the caller, so no lock file is left in the output.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from djerba.util.locking import atomic_write
+
+# counter names
+LOOKUPS = 'lookups'
+HITS = 'hits'
+MISSES = 'misses'
+STALE = 'stale'
+ANNOTATED = 'annotated'
+BYTES_LOADED = 'bytes_loaded'
+LOAD_SECONDS = 'load_seconds'
+LOOKUP_SECONDS = 'lookup_seconds'
+ANNOTATION_SECONDS = 'annotation_seconds'
+# time running annotator scripts, or HTTP client queries
+SUBPROCESS_SECONDS = 'subprocess_seconds'
+SUBPROCESS_CALLS = 'subprocess_calls'
+# derived from counters when written
+HIT_RATE = 'hit_rate'
+
+# sections of the metrics file
+ANNOTATOR = 'annotator'
+CACHE = 'cache'
+
+DECIMAL_PLACES = 4
+
+
+class oncokb_metrics:
+    """Thread-safe counters, by key and name"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.reported = {}
+
+    def add(self, key, name, value=1):
+        with self.lock:
+            counters = self.counters.setdefault(key, {})
+            counters[name] = counters.get(name, 0) + value
+
+    def get(self):
+        """Cumulative totals for each key"""
+        with self.lock:
+            return {key: dict(counters) for (key, counters) in self.counters.items()}
+
+    def get_new(self):
+        """Counts added since the previous call, for each key"""
+        new = {}
+        with self.lock:
+            for (key, counters) in self.counters.items():
+                reported = self.reported.setdefault(key, {})
+                for (name, value) in counters.items():
+                    if value != reported.get(name, 0):
+                        new.setdefault(key, {})[name] = value - reported.get(name, 0)
+                        reported[name] = value
+        return new
+
+    @contextmanager
+    def timer(self, key, name):
+        """Add the elapsed time of a with statement to a counter"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(key, name, time.time() - start)
+
+
+def reset_metrics_file(path):
+    """Remove a metrics JSON file, if it exists"""
+    if os.path.exists(path):
+        os.remove(path)
+
+def update_metrics_file(path, sections):
+    """
+    Add counts to a metrics JSON file, creating it if necessary
+    sections is a dictionary of section names and counters by key, eg. from get_new()
+    Hit rates are recalculated for each key which has lookups
+    Not safe for concurrent calls on the same path; the caller must serialize them
+    """
+    if os.path.exists(path):
+        with open(path) as in_file:
+            metrics = json.loads(in_file.read())
+    else:
+        metrics = {}
+    for (section, new) in sections.items():
+        section_metrics = metrics.setdefault(section, {})
+        for (key, counters) in new.items():
+            key_metrics = section_metrics.setdefault(key, {})
+            for (name, value) in counters.items():
+                key_metrics[name] = round(key_metrics.get(name, 0) + value, DECIMAL_PLACES)
+            if key_metrics.get(LOOKUPS):
+                hit_rate = key_metrics.get(HITS, 0) / key_metrics[LOOKUPS]
+                key_metrics[HIT_RATE] = round(hit_rate, DECIMAL_PLACES)
+    with atomic_write(path) as out_file:
+        out_file.write(json.dumps(metrics, indent=4, sort_keys=True))
+    return metrics
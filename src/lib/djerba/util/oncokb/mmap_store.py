@@ -0,0 +1,200 @@
+"""
+Binary, memory-mapped backend for the OncoKB annotation cache
+
+There is one file per cache type (MAF, CNA or fusion), with:
+- A header: magic string and number of entries
+- A key table: SHA-256 digests of cache keys, 32 bytes each, in sorted order
+- An offset index: start of each annotation in the blob, and end of the last one
+- A blob: annotations, as tab-separated UTF-8 strings
+
+Files are opened with mmap, and keys found by binary search of the key table, so a
+lookup reads only the pages it needs; nothing is parsed until a key is found. MAF keys
+are already SHA-256 hex digests; CNA and fusion keys are hashed.
+
+Files are written in full, to a temporary file which is renamed; updates merge with
+the current file under an exclusive lock, as for the JSON cache files.
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import djerba.util.constants as constants
+import djerba.util.oncokb.constants as oncokb_constants
+from djerba.util.locking import file_lock, atomic_write
+from djerba.util.logger import logger
+
+MAGIC = b'DJOKBC01'
+HEADER = struct.Struct('<8sQ')
+OFFSET = struct.Struct('<Q')
+KEY_WIDTH = 32
+SEPARATOR = "\t"
+
+
+class oncokb_mmap_store(logger):
+
+    def __init__(self, cache_dir, log_level=logging.WARNING, log_path=None):
+        self.logger = self.get_logger(log_level, __name__, log_path)
+        self.paths = {
+            oncokb_constants.CNA: os.path.join(cache_dir, oncokb_constants.CACHE_MMAP_CNA),
+            oncokb_constants.FUSION: os.path.join(cache_dir, oncokb_constants.CACHE_MMAP_FUSION),
+            oncokb_constants.MAF: os.path.join(cache_dir, oncokb_constants.CACHE_MMAP_MAF)
+        }
+
+    def _read_entries(self, cache_type):
+        """Read all entries of an existing file, as a dictionary of digests and encoded values"""
+        path = self.paths[cache_type]
+        if not os.path.exists(path):
+            return {}
+        with mmap_table(path) as table:
+            entries = {table.get_digest(i): table.get_value_bytes(i) for i in range(table.count)}
+        return entries
+
+    def _write_entries(self, cache_type, entries):
+        """Write a dictionary of digests and encoded values to a new file"""
+        path = self.paths[cache_type]
+        digests = sorted(entries.keys())
+        with atomic_write(path, 'wb') as out_file:
+            out_file.write(HEADER.pack(MAGIC, len(digests)))
+            for digest in digests:
+                out_file.write(digest)
+            offset = 0
+            for digest in digests:
+                out_file.write(OFFSET.pack(offset))
+                offset += len(entries[digest])
+            out_file.write(OFFSET.pack(offset))
+            for digest in digests:
+                out_file.write(entries[digest])
+        msg = "Wrote {0} {1} annotations to {2}".format(len(digests), cache_type, path)
+        self.logger.debug(msg)
+
+    def compact(self, cache_type, is_stale):
+        """
+        Remove entries for which is_stale(value) is True; return [entries kept, entries removed]
+        """
+        path = self.paths[cache_type]
+        with file_lock(path):
+            entries = self._read_entries(cache_type)
+            kept = {x: y for (x, y) in entries.items() if not is_stale(decode_value(y))}
+            self._write_entries(cache_type, kept)
+        return [len(kept), len(entries)-len(kept)]
+
+    def count(self, cache_type):
+        with mmap_table(self.paths[cache_type]) as table:
+            total = table.count
+        return total
+
+    def exists(self):
+        return any([os.path.isfile(x) for x in self.paths.values()])
+
+    def get(self, cache_type, keys):
+        """
+        Look up annotations for the given keys; CNA keys are (hugo symbol, alteration)
+        Returns a dictionary of keys found in the store
+        """
+        with mmap_table(self.paths[cache_type]) as table:
+            results = table.get(cache_type, keys)
+        return results
+
+    def open(self, cache_type):
+        """Open a table for repeated lookups; the caller should close it"""
+        return mmap_table(self.paths[cache_type])
+
+    def update(self, cache_type, annotations):
+        """Insert or replace annotations, from a dictionary of keys and annotation lists"""
+        path = self.paths[cache_type]
+        with file_lock(path):
+            entries = self._read_entries(cache_type)
+            for (key, value) in annotations.items():
+                entries[get_digest(cache_type, key)] = encode_value(value)
+            self._write_entries(cache_type, entries)
+        return len(annotations)
+
+
+class mmap_table:
+    """Read-only view of one memory-mapped cache file; usable as a context manager"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as in_file:
+            self.mm = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.count) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.mm.close()
+            msg = "{0} is not an OncoKB mmap cache file".format(path)
+            raise OncokbMmapStoreError(msg)
+        self.offset_start = HEADER.size + KEY_WIDTH*self.count
+        self.blob_start = self.offset_start + OFFSET.size*(self.count+1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.mm.close()
+
+    def find(self, digest):
+        """Binary search for a digest; return its index, or None if not found"""
+        low = 0
+        high = self.count
+        while low < high:
+            mid = (low + high) // 2
+            start = HEADER.size + KEY_WIDTH*mid
+            current = self.mm[start:start+KEY_WIDTH]
+            if current < digest:
+                low = mid + 1
+            elif current > digest:
+                high = mid
+            else:
+                return mid
+        return None
+
+    def get(self, cache_type, keys, sizes=None):
+        """
+        Dictionary of keys found, and their annotation lists
+        If sizes is a list, the size in bytes of each value read is appended to it
+        """
+        results = {}
+        for key in keys:
+            index = self.find(get_digest(cache_type, key))
+            if index != None:
+                value_bytes = self.get_value_bytes(index)
+                results[key] = decode_value(value_bytes)
+                if sizes != None:
+                    sizes.append(len(value_bytes))
+        return results
+
+    def get_digest(self, index):
+        start = HEADER.size + KEY_WIDTH*index
+        return self.mm[start:start+KEY_WIDTH]
+
+    def get_value_bytes(self, index):
+        (start, end) = struct.unpack_from(
+            '<2Q', self.mm, self.offset_start + OFFSET.size*index
+        )
+        return self.mm[self.blob_start+start:self.blob_start+end]
+
+
+def get_digest(cache_type, key):
+    """SHA-256 digest of a cache key; MAF keys are already hex digests"""
+    if cache_type == oncokb_constants.MAF:
+        return bytes.fromhex(key)
+    elif cache_type == oncokb_constants.CNA:
+        key = SEPARATOR.join(key)
+    return hashlib.sha256(key.encode(constants.TEXT_ENCODING)).digest()
+
+def encode_value(value):
+    # annotations are read from TSV files, so cannot contain tabs
+    return SEPARATOR.join(value).encode(constants.TEXT_ENCODING)
+
+def decode_value(value_bytes):
+    if len(value_bytes) == 0:
+        return []
+    return value_bytes.decode(constants.TEXT_ENCODING).split(SEPARATOR)
+
+
+class OncokbMmapStoreError(Exception):
+    pass
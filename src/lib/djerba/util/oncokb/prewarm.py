@@ -0,0 +1,158 @@
+"""
+Pre-warm the OncoKB cache for a cohort of samples
+
+Run with the prewarm subcommand of update_oncokb_cache.py. Inputs are MAF, CNA and fusion
+files grouped by OncoTree code, from the command line or from directory trees of earlier
+Djerba reports. For each OncoTree code, distinct keys are gathered across all inputs;
+keys not in the cache are annotated in large batches with the OncoKB HTTP client, and
+written to the cache subdirectory for the OncoTree code in one update.
+"""
+
+import csv
+import logging
+import os
+import tempfile
+
+import djerba.util.constants as constants
+import djerba.util.oncokb.constants as oncokb_constants
+from djerba.util.logger import logger
+from djerba.util.oncokb.cache import oncokb_cache
+from djerba.util.oncokb.client import oncokb_client
+
+class oncokb_cache_prewarmer(logger):
+
+    # larger than the client default, as there are many more queries than for one report
+    DEFAULT_BATCH_SIZE = 1000
+    # sample ID for client output; it is not cached
+    # inputs are from many tumours, so the client does not match it to MAF or fusion rows
+    SAMPLE_ID = 'cohort'
+
+    # keys for results
+    ANNOTATED = 'annotated'
+    CACHE_TYPE = 'cache_type'
+    KEYS = 'keys'
+    ONCOTREE_CODE = 'oncotree_code'
+
+    def __init__(self, cache_base, token, base_url=None, batch_size=DEFAULT_BATCH_SIZE,
+                 backend=None, data_version=None, ttl_days=None,
+                 log_level=logging.WARNING, log_path=None):
+        # if data_version is None, the current version is found from the OncoKB API
+        self.log_level = log_level
+        self.log_path = log_path
+        self.logger = self.get_logger(log_level, __name__, log_path)
+        self.cache_base = cache_base
+        self.token = token
+        self.base_url = base_url
+        self.batch_size = batch_size
+        self.backend = backend
+        self.data_version = data_version
+        self.ttl_days = ttl_days
+        # dictionary of OncoTree codes, cache types and lists of input paths
+        self.inputs = {}
+
+    def _read_oncotree_code(self, info_path):
+        with open(info_path) as info_file:
+            rows = list(csv.DictReader(info_file, delimiter="\t"))
+        if len(rows) != 1 or not rows[0].get('ONCOTREE_CODE'):
+            msg = "Could not parse a single OncoTree code from {0}".format(info_path)
+            self.logger.error(msg)
+            raise RuntimeError(msg)
+        return rows[0]['ONCOTREE_CODE']
+
+    def add_input(self, oncotree_code, cache_type, input_path):
+        """Add an input file for the given OncoTree code and cache type"""
+        if cache_type not in oncokb_constants.CACHE_TYPES:
+            msg = "Unknown OncoKB cache type '{0}'".format(cache_type)
+            self.logger.error(msg)
+            raise RuntimeError(msg)
+        paths = self.inputs.setdefault(oncotree_code, {}).setdefault(cache_type, [])
+        paths.append(input_path)
+
+    def add_report_tree(self, base_dir):
+        """
+        Add inputs from each report directory in a directory tree; a report directory has
+        the OncoKB clinical info file, which gives its OncoTree code
+        The annotated MAF is used, as the input MAF is not kept; CNA and fusion inputs are used
+        Returns the number of report directories found
+        """
+        total = 0
+        for (dir_path, dir_names, file_names) in os.walk(base_dir):
+            dir_names.sort()
+            if oncokb_constants.ONCOKB_CLINICAL_INFO not in file_names:
+                continue
+            info_path = os.path.join(dir_path, oncokb_constants.ONCOKB_CLINICAL_INFO)
+            oncotree_code = self._read_oncotree_code(info_path)
+            candidates = [
+                (oncokb_constants.MAF, os.path.join(dir_path, oncokb_constants.ANNOTATED_MAF)),
+                (oncokb_constants.MAF, os.path.join(dir_path, 'tmp', oncokb_constants.ANNOTATED_MAF)),
+                (oncokb_constants.CNA, os.path.join(dir_path, oncokb_constants.DATA_CNA_ONCOKB_GENES_NON_DIPLOID)),
+                (oncokb_constants.FUSION, os.path.join(dir_path, constants.DATA_FUSIONS_ONCOKB))
+            ]
+            for (cache_type, input_path) in candidates:
+                if os.path.isfile(input_path):
+                    self.add_input(oncotree_code, cache_type, input_path)
+            self.logger.debug("Found {0} report in {1}".format(oncotree_code, dir_path))
+            total += 1
+        self.logger.info("Found {0} report directories in {1}".format(total, base_dir))
+        return total
+
+    def run(self):
+        """
+        Annotate cache misses for each OncoTree code, and update the cache
+        Returns a list of result dictionaries, one for each OncoTree code and cache type
+        """
+        results = []
+        for oncotree_code in sorted(self.inputs.keys()):
+            client = oncokb_client(
+                self.token,
+                self.SAMPLE_ID,
+                oncotree_code,
+                self.base_url,
+                batch_size=self.batch_size,
+                match_barcode=False,
+                log_level=self.log_level,
+                log_path=self.log_path
+            )
+            try:
+                data_version = self.data_version
+                if data_version == None:
+                    data_version = client.get_data_version()
+                cache = oncokb_cache(
+                    self.cache_base,
+                    oncotree_code,
+                    self.log_level,
+                    self.log_path,
+                    backend=self.backend,
+                    data_version=data_version,
+                    ttl_days=self.ttl_days
+                )
+                run_annotators = {
+                    oncokb_constants.CNA: client.annotate_cna,
+                    oncokb_constants.FUSION: client.annotate_fusion,
+                    oncokb_constants.MAF: client.annotate_maf
+                }
+                with tempfile.TemporaryDirectory(prefix='djerba_prewarm_oncokb_') as tmp_dir:
+                    totals = cache.prewarm(self.inputs[oncotree_code], run_annotators, tmp_dir)
+            finally:
+                client.close()
+            for cache_type in sorted(totals.keys()):
+                [keys, annotated] = totals[cache_type]
+                results.append({
+                    self.ONCOTREE_CODE: oncotree_code,
+                    self.CACHE_TYPE: cache_type,
+                    self.KEYS: keys,
+                    self.ANNOTATED: annotated
+                })
+            msg = "Pre-warmed cache for {0} with {1} OncoKB requests".format(
+                oncotree_code, client.total_requests
+            )
+            self.logger.info(msg)
+        return results
+
+    def format_results(self, results):
+        """Format results as a TSV table"""
+        columns = [self.ONCOTREE_CODE, self.CACHE_TYPE, self.KEYS, self.ANNOTATED]
+        lines = ["\t".join(columns)]
+        for result in results:
+            lines.append("\t".join([str(result[x]) for x in columns]))
+        return "\n".join(lines)+"\n"
@@ -0,0 +1,175 @@
+"""
+SQLite backend for the OncoKB annotation cache
+
+The JSON cache files must be read in full to look up any variant, and rewritten in full
+for any update. The SQLite store has a single table keyed by cache type (MAF, CNA or
+fusion) and variant key, so lookups read only the keys needed, and updates are
+incremental upserts in a single transaction.
+
+As for the JSON files, there is one store per cache directory, ie. per OncoTree code.
+Annotations are stored as JSON lists, in the same order as ANNOTATION_HEADERS.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from djerba.util.logger import logger
+import djerba.util.oncokb.constants as oncokb_constants
+
+class oncokb_sqlite_store(logger):
+
+    SCHEMA_VERSION = 1
+    TABLE = 'annotations'
+    META_TABLE = 'meta'
+    # maximum number of keys in a single query; SQLite allows at least 999 parameters
+    QUERY_BATCH_SIZE = 500
+    # seconds to wait for a lock held by another process
+    TIMEOUT = 60
+    # separator for CNA keys of the form (hugo symbol, alteration)
+    CNA_KEY_SEPARATOR = "\t"
+
+    def __init__(self, cache_dir, log_level=logging.WARNING, log_path=None):
+        self.logger = self.get_logger(log_level, __name__, log_path)
+        self.path = os.path.join(cache_dir, oncokb_constants.CACHE_SQLITE)
+
+    def _connect(self, write=False):
+        """
+        Open a connection; read-only for lookups, so they do not need write access or take
+        the write lock. Writers create the schema if needed.
+        """
+        if not write:
+            uri = 'file:{0}?mode=ro'.format(self.path)
+            return sqlite3.connect(uri, uri=True, timeout=self.TIMEOUT)
+        connection = sqlite3.connect(self.path, timeout=self.TIMEOUT)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS {0} '.format(self.TABLE)+\
+            '(cache_type TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '+\
+            'PRIMARY KEY (cache_type, key)) WITHOUT ROWID'
+        )
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS {0} (key TEXT PRIMARY KEY, value TEXT)'.format(self.META_TABLE)
+        )
+        sql = 'INSERT OR IGNORE INTO {0} VALUES (?, ?)'.format(self.META_TABLE)
+        connection.execute(sql, ('schema_version', str(self.SCHEMA_VERSION)))
+        connection.commit()
+        return connection
+
+    def _to_store_key(self, cache_type, key):
+        if cache_type == oncokb_constants.CNA:
+            key = self.CNA_KEY_SEPARATOR.join(key)
+        return key
+
+    def _from_store_key(self, cache_type, key):
+        if cache_type == oncokb_constants.CNA:
+            key = tuple(key.split(self.CNA_KEY_SEPARATOR))
+        return key
+
+    def compact(self, cache_type, is_stale):
+        """
+        Remove entries for which is_stale(value) is True; return [entries kept, entries removed]
+        """
+        stale = []
+        kept = 0
+        connection = self._connect(write=True)
+        try:
+            sql = 'SELECT key, value FROM {0} WHERE cache_type = ?'.format(self.TABLE)
+            for (key, value) in connection.execute(sql, (cache_type,)):
+                if is_stale(json.loads(value)):
+                    stale.append((cache_type, key))
+                else:
+                    kept += 1
+            sql = 'DELETE FROM {0} WHERE cache_type = ? AND key = ?'.format(self.TABLE)
+            with connection:
+                connection.executemany(sql, stale)
+        finally:
+            connection.close()
+        msg = "Removed {0} stale {1} entries from {2}".format(len(stale), cache_type, self.path)
+        self.logger.debug(msg)
+        return [kept, len(stale)]
+
+    def count(self, cache_type):
+        connection = self._connect()
+        try:
+            sql = 'SELECT COUNT(*) FROM {0} WHERE cache_type = ?'.format(self.TABLE)
+            total = connection.execute(sql, (cache_type,)).fetchone()[0]
+        finally:
+            connection.close()
+        return total
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def get(self, cache_type, keys, sizes=None):
+        """
+        Look up annotations for the given keys; CNA keys are (hugo symbol, alteration)
+        If sizes is a list, the size in bytes of each value read is appended to it
+        Returns a dictionary of keys found in the store
+        """
+        store_keys = list(dict.fromkeys([self._to_store_key(cache_type, x) for x in keys]))
+        results = {}
+        connection = self._connect()
+        try:
+            for i in range(0, len(store_keys), self.QUERY_BATCH_SIZE):
+                batch = store_keys[i:i+self.QUERY_BATCH_SIZE]
+                # length of a text value cast to a blob is its size in bytes
+                sql = 'SELECT key, value, length(CAST(value AS BLOB)) FROM {0} '.format(self.TABLE)+\
+                    'WHERE cache_type = ? AND key IN ({0})'.format(', '.join(['?']*len(batch)))
+                for (key, value, size) in connection.execute(sql, [cache_type]+batch):
+                    results[self._from_store_key(cache_type, key)] = json.loads(value)
+                    if sizes != None:
+                        sizes.append(size)
+        finally:
+            connection.close()
+        msg = "Found {0} of {1} {2} keys in {3}".format(
+            len(results), len(store_keys), cache_type, self.path
+        )
+        self.logger.debug(msg)
+        return results
+
+    def get_all(self, cache_type):
+        """Get all annotations of the given type, as a dictionary"""
+        connection = self._connect()
+        try:
+            sql = 'SELECT key, value FROM {0} WHERE cache_type = ?'.format(self.TABLE)
+            results = {
+                self._from_store_key(cache_type, key): json.loads(value)
+                for (key, value) in connection.execute(sql, (cache_type,))
+            }
+        finally:
+            connection.close()
+        return results
+
+    def update(self, cache_type, annotations):
+        """Insert or replace annotations, from a dictionary of keys and annotation lists"""
+        return self.update_many({cache_type: annotations})
+
+    def update_many(self, updates):
+        """
+        Insert or replace annotations for one or more cache types, in a single transaction
+        updates is a dictionary of cache types and annotation dictionaries, as for update()
+        Returns the total number of annotations written
+        """
+        sql = 'INSERT OR REPLACE INTO {0} VALUES (?, ?, ?)'.format(self.TABLE)
+        values = [
+            (cache_type, self._to_store_key(cache_type, key), json.dumps(value))
+            for (cache_type, annotations) in updates.items()
+            for (key, value) in annotations.items()
+        ]
+        connection = self._connect(write=True)
+        try:
+            with connection:
+                connection.executemany(sql, values)
+        finally:
+            connection.close()
+        msg = "Wrote {0} {1} annotations to {2}".format(len(values), list(updates.keys()), self.path)
+        self.logger.debug(msg)
+        return len(values)
+
+    def vacuum(self):
+        """Rebuild the database file, to reclaim space after entries are removed"""
+        connection = self._connect(write=True)
+        try:
+            connection.execute('VACUUM')
+        finally:
+            connection.close()
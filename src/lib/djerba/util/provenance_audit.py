@@ -0,0 +1,195 @@
+"""
+Readiness audit of file provenance for a cohort of donors
+
+Reads the file provenance report (FPR) once, for one or more studies, and checks each
+donor as the provenance reader does for a single report:
+- Recommended WGS workflows, and WTS workflows if any, have provenance records
+- Sample names are consistent, with WG normal/tumour and optional WT samples
+- Tumour, normal and patient IDs can be found
+
+Memory use is bounded by the number of donors, not the number of rows: for each donor,
+only one row is kept for each distinct (workflow, sample, attributes, platform), which
+is sufficient for the checks above.
+"""
+
+import csv
+import json
+import logging
+
+import djerba.util.ini_fields as ini
+import djerba.util.provenance_index as index
+from djerba.util.decompression import decompressor, AUTO
+from djerba.util.logger import logger
+from djerba.util.provenance_filter import provenance_filter
+from djerba.util.provenance_reader import provenance_reader, sample_name_container, \
+    InsufficientSampleNamesError, UnknownTumorNormalIDError
+from djerba.util.provenance_row import provenance_row
+
+class provenance_audit(logger):
+
+    # donor status
+    READY = 'ready'
+    INCOMPLETE = 'incomplete'
+    INVALID = 'invalid'
+    NOT_FOUND = 'not_found'
+
+    # keys for results, in output column order
+    STUDY = 'study'
+    DONOR = 'donor'
+    STATUS = 'status'
+    TOTAL_ROWS = 'total_rows'
+    WGS_COMPLETE = 'wgs_complete'
+    WTS_PRESENT = 'wts_present'
+    WTS_COMPLETE = 'wts_complete'
+    MISSING_WORKFLOWS = 'missing_workflows'
+    ERROR = 'error'
+    COLUMNS = [
+        STUDY,
+        DONOR,
+        STATUS,
+        TOTAL_ROWS,
+        WGS_COMPLETE,
+        WTS_PRESENT,
+        WTS_COMPLETE,
+        MISSING_WORKFLOWS,
+        ini.SAMPLE_NAME_WG_N,
+        ini.SAMPLE_NAME_WG_T,
+        ini.SAMPLE_NAME_WT_T,
+        ini.PATIENT_ID,
+        ini.TUMOUR_ID,
+        ini.NORMAL_ID,
+        ERROR
+    ]
+
+    # readers are created for each donor; problems are reported in the results instead
+    READER_LOG_LEVEL = logging.CRITICAL
+
+    def __init__(self, log_level=logging.WARNING, log_path=None):
+        self.log_level = log_level
+        self.log_path = log_path
+        self.logger = self.get_logger(log_level, __name__, log_path)
+
+    def _get_wts_workflows(self):
+        return set([x for wf_list in provenance_reader.WTS_WORKFLOW_CHECKS for x in wf_list])
+
+    def audit(self, provenance_path, studies, donors=None, decompression=AUTO, threads=0):
+        """
+        Audit donors in the given studies, with a single read of the FPR
+        If donors is None, audit all donors in each study; otherwise, audit only the given
+        donors, and report any without provenance records as not found
+        Returns a list of result dictionaries, sorted by study and donor
+        """
+        if donors == None:
+            keys = [(x, None) for x in studies]
+        else:
+            keys = [(x, y) for x in studies for y in donors]
+        summaries = self.read_summaries(provenance_path, keys, decompression, threads)
+        if donors != None:
+            for key in keys:
+                if key not in summaries:
+                    self.logger.info("No provenance records for {0}/{1}".format(*key))
+        results = []
+        donor_keys = set(summaries.keys()).union([x for x in keys if x[1] != None])
+        for (study, donor) in sorted(donor_keys):
+            if (study, donor) in summaries:
+                (total, rows) = summaries[(study, donor)]
+                result = self.check_donor(provenance_path, study, donor, total, rows)
+            else:
+                result = self.get_empty_result(study, donor, self.NOT_FOUND)
+            results.append(result)
+        self.logger.info("Audited {0} donors".format(len(results)))
+        return results
+
+    def check_donor(self, provenance_path, study, donor, total_rows, rows):
+        """Run provenance reader checks for one donor, and return a result dictionary"""
+        result = self.get_empty_result(study, donor, self.INVALID)
+        result[self.TOTAL_ROWS] = total_rows
+        try:
+            reader = provenance_reader(
+                provenance_path,
+                study,
+                donor,
+                sample_name_container(),
+                log_level=self.READER_LOG_LEVEL,
+                log_path=self.log_path,
+                rows=rows
+            )
+        except (InsufficientSampleNamesError, UnknownTumorNormalIDError,
+                RuntimeError, ValueError) as err:
+            result[self.ERROR] = "{0}: {1}".format(type(err).__name__, err)
+            self.logger.debug("Audit of {0}/{1} failed: {2}".format(study, donor, err))
+            return result
+        if len(reader.provenance)==0:
+            result[self.ERROR] = "No usable provenance records, eg. MiSeq only"
+            return result
+        result.update(reader.get_sample_names())
+        result.update(reader.get_identifiers())
+        missing = reader.missing_workflows
+        wgs_missing = [x for x in missing if x in provenance_reader.WGS_WORKFLOW_CHECKS]
+        wts_missing = [x for x in missing if x in provenance_reader.WTS_WORKFLOW_CHECKS]
+        wts_workflows = self._get_wts_workflows()
+        wts_present = any([row[index.WORKFLOW_NAME] in wts_workflows for row in reader.provenance])
+        result[self.WGS_COMPLETE] = len(wgs_missing)==0
+        result[self.WTS_PRESENT] = wts_present
+        result[self.WTS_COMPLETE] = wts_present and len(wts_missing)==0
+        # report the current (Vidarr) name for each missing workflow
+        result[self.MISSING_WORKFLOWS] = ','.join([x[0] for x in missing])
+        # WTS is optional, eg. for a WGS-only report
+        result[self.STATUS] = self.READY if len(missing)==0 else self.INCOMPLETE
+        return result
+
+    def get_empty_result(self, study, donor, status):
+        result = {x: None for x in self.COLUMNS}
+        result[self.STUDY] = study
+        result[self.DONOR] = donor
+        result[self.STATUS] = status
+        result[self.TOTAL_ROWS] = 0
+        result[self.WGS_COMPLETE] = False
+        result[self.WTS_PRESENT] = False
+        result[self.WTS_COMPLETE] = False
+        result[self.MISSING_WORKFLOWS] = ''
+        return result
+
+    def read_summaries(self, provenance_path, keys, decompression=AUTO, threads=0):
+        """
+        Read the FPR once, and summarize rows for each (study, donor)
+        keys are (study, donor) pairs; if donor is None, all donors in the study are read
+        Returns a dictionary: (study, donor) -> (total rows, list of representative rows)
+        """
+        self.logger.info("Reading file provenance from {0}".format(provenance_path))
+        totals = {}
+        distinct = {}
+        reader = decompressor(decompression, threads, self.log_level, self.log_path)
+        row_filter = provenance_filter(keys)
+        with reader.open_binary(provenance_path) as in_file:
+            for row in row_filter.filter_rows(in_file):
+                key = (row[index.STUDY_TITLE], row[index.ROOT_SAMPLE_NAME])
+                totals[key] = totals.get(key, 0) + 1
+                row_key = (
+                    row[index.WORKFLOW_NAME],
+                    row[index.SAMPLE_NAME],
+                    row[index.PARENT_SAMPLE_ATTRIBUTES],
+                    row[index.SEQUENCER_RUN_PLATFORM_ID]
+                )
+                donor_rows = distinct.setdefault(key, {})
+                if row_key not in donor_rows:
+                    donor_rows[row_key] = provenance_row.from_full_row(row)
+        msg = "Found {0} rows for {1} donors; skipped {2} of {3} chunks".format(
+            sum(totals.values()), len(totals), row_filter.skipped_chunks, row_filter.total_chunks
+        )
+        self.logger.info(msg)
+        return {x: (totals[x], list(distinct[x].values())) for x in totals.keys()}
+
+    def write_json(self, results, out_path):
+        with open(out_path, 'w') as out_file:
+            out_file.write(json.dumps(results, indent=4))
+        self.logger.info("Wrote audit results for {0} donors to {1}".format(len(results), out_path))
+
+    def write_tsv(self, results, out_path):
+        with open(out_path, 'w') as out_file:
+            writer = csv.writer(out_file, delimiter="\t", lineterminator="\n")
+            writer.writerow(self.COLUMNS)
+            for result in results:
+                values = ['' if result[x] == None else result[x] for x in self.COLUMNS]
+                writer.writerow(values)
+        self.logger.info("Wrote audit results for {0} donors to {1}".format(len(results), out_path))
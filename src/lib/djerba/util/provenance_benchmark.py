@@ -0,0 +1,271 @@
+"""
+Benchmarks for reading the file provenance report (FPR)
+
+Run with the benchmark_provenance.py script, on a real FPR or a synthetic one from
+djerba.util.testing.provenance_generator.
+
+The benchmark suite times each phase of finding workflow outputs for a donor, as done
+by the provenance helper and plugins; results may be compared with a stored baseline,
+eg. from a previous release, to find regressions.
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import djerba.util.constants as constants
+import djerba.util.decompression as decompression
+import djerba.util.provenance_index as index
+from djerba.helpers.provenance_helper.helper import provenance_subset_writer
+from djerba.util.bgzf import is_bgzf
+from djerba.util.decompression import decompressor
+from djerba.util.logger import logger
+from djerba.util.provenance_filter import provenance_filter
+from djerba.util.provenance_reader import provenance_reader, sample_name_container
+
+class provenance_benchmark(logger):
+
+    CHUNK_SIZE = 1024*1024
+    # benchmark modes
+    READ = 'read'
+    PARSE = 'parse'
+    CSV = 'csv'
+    PREFILTER = 'prefilter'
+
+    # phases of the benchmark suite; each parse_*_path method of the reader is also a phase
+    SCAN = 'scan'
+    SUBSET = 'subset'
+    READER = 'reader'
+    RESOLVE = 'resolve_output_paths'
+    # slowdown relative to baseline which is reported as a regression
+    DEFAULT_TOLERANCE = 1.25
+    # phases faster than this in both results and baseline are not compared, as timing noise dominates
+    MIN_COMPARISON_SECONDS = 0.01
+
+    # keys for results
+    BACKEND = 'backend'
+    BASELINE_SECONDS = 'baseline_seconds'
+    INPUT = 'input'
+    KEYS = 'keys'
+    MODE = 'mode'
+    PEAK_RSS_MB = 'peak_rss_mb'
+    PHASE = 'phase'
+    RATIO = 'ratio'
+    REGRESSION = 'regression'
+    ROWS = 'rows'
+    ROWS_PER_SECOND = 'rows_per_second'
+    SECONDS = 'seconds'
+    THREADS = 'threads'
+    UNCOMPRESSED_MB_PER_SECOND = 'uncompressed_mb_per_second'
+
+    def __init__(self, log_level=logging.WARNING, log_path=None):
+        self.log_level = log_level
+        self.log_path = log_path
+        self.logger = self.get_logger(log_level, __name__, log_path)
+
+    def get_backends(self, path):
+        """Backends which can be benchmarked for the given file"""
+        backends = [decompression.GZIP]
+        if shutil.which(decompressor.PIGZ_COMMAND):
+            backends.append(decompression.PIGZ)
+        else:
+            self.logger.warning("pigz not found on PATH, omitting from benchmark")
+        if is_bgzf(path):
+            backends.append(decompression.BGZF)
+        return backends
+
+    def run_decompression(self, paths, threads=0):
+        """
+        Time a scan of each FPR path with each available decompression backend
+        - 'read' mode decompresses the text only, to measure the backend itself
+        - 'parse' mode also parses rows with csv.reader, as in the provenance helper
+        Returns a list of result dictionaries
+        """
+        results = []
+        for path in paths:
+            for backend in self.get_backends(path):
+                for mode in [self.READ, self.PARSE]:
+                    reader = decompressor(backend, threads, self.log_level, self.log_path)
+                    start = time.perf_counter()
+                    rows = 0
+                    chars = 0
+                    with reader.open_text(path) as in_file:
+                        if mode == self.READ:
+                            for chunk in iter(lambda: in_file.read(self.CHUNK_SIZE), ''):
+                                rows += chunk.count("\n")
+                                chars += len(chunk)
+                        else:
+                            for row in csv.reader(in_file, delimiter="\t"):
+                                rows += 1
+                                chars += sum([len(x) for x in row]) + len(row)
+                    seconds = time.perf_counter() - start
+                    result = {
+                        self.INPUT: os.path.abspath(path),
+                        self.BACKEND: backend,
+                        self.MODE: mode,
+                        self.THREADS: reader.threads,
+                        self.ROWS: rows,
+                        self.SECONDS: round(seconds, 3),
+                        self.ROWS_PER_SECOND: round(rows/seconds),
+                        self.UNCOMPRESSED_MB_PER_SECOND: round(chars/seconds/1024**2, 1)
+                    }
+                    self.logger.info("Decompression benchmark result: {0}".format(result))
+                    results.append(result)
+        return results
+
+    def run_filter(self, path, keys, threads=0):
+        """
+        Time a search of the FPR for the given (study, donor) keys:
+        - 'csv' mode parses every row with csv.reader, then checks study and donor
+        - 'prefilter' mode uses provenance_filter
+        Both use the gzip backend, so times differ only by the search method
+        Returns a list of result dictionaries; ROWS is the number of rows found
+        """
+        results = []
+        reader = decompressor(decompression.GZIP, threads, self.log_level, self.log_path)
+        keys = set(keys)
+        for mode in [self.CSV, self.PREFILTER]:
+            start = time.perf_counter()
+            with reader.open_binary(path) as in_file:
+                if mode == self.CSV:
+                    text = io.TextIOWrapper(in_file, encoding=constants.TEXT_ENCODING, newline='')
+                    rows = 0
+                    for row in csv.reader(text, delimiter="\t"):
+                        if (row[index.STUDY_TITLE], row[index.ROOT_SAMPLE_NAME]) in keys:
+                            rows += 1
+                    text.detach()
+                else:
+                    rows = sum([1 for row in provenance_filter(keys).filter_rows(in_file)])
+            seconds = time.perf_counter() - start
+            result = {
+                self.INPUT: os.path.abspath(path),
+                self.MODE: mode,
+                self.KEYS: len(keys),
+                self.ROWS: rows,
+                self.SECONDS: round(seconds, 3)
+            }
+            self.logger.info("Filter benchmark result: {0}".format(result))
+            results.append(result)
+        return results
+
+    def get_parse_methods(self):
+        """Names of the parse_*_path methods of the provenance reader"""
+        names = [x for x in dir(provenance_reader) if x.startswith('parse_') and x.endswith('_path')]
+        return sorted([x for x in names if x != 'parse_output_path'])
+
+    def get_peak_rss_mb(self):
+        """Peak resident set size of this process so far; ru_maxrss is in kB on Linux"""
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, 1)
+
+    def get_phase_result(self, phase, rows, seconds):
+        result = {
+            self.PHASE: phase,
+            self.ROWS: rows,
+            self.SECONDS: round(seconds, 6),
+            self.ROWS_PER_SECOND: round(rows/seconds) if seconds > 0 else None,
+            self.PEAK_RSS_MB: self.get_peak_rss_mb()
+        }
+        self.logger.info("Benchmark suite result: {0}".format(result))
+        return result
+
+    def run_suite(self, path, study, donor, threads=0):
+        """
+        Time each phase of finding workflow outputs for one donor:
+        - 'scan': decompress and count rows of the FPR
+        - 'subset': write the provenance subset for the donor, with a full FPR scan
+        - 'reader': construct a provenance reader from the subset
+        - 'resolve_output_paths': find all outputs for the path info JSON
+        - each parse_*_path method of the reader
+        ROWS is the number of rows read in each phase. Peak RSS is for the process up
+        to the end of the phase, so phases are run in order of increasing memory use.
+        Returns a list of result dictionaries
+        """
+        results = []
+        reader = decompressor(decompression.GZIP, threads, self.log_level, self.log_path)
+        start = time.perf_counter()
+        total_rows = 0
+        with reader.open_binary(path) as in_file:
+            for chunk in iter(lambda: in_file.read(self.CHUNK_SIZE), b''):
+                total_rows += chunk.count(b"\n")
+        results.append(self.get_phase_result(self.SCAN, total_rows, time.perf_counter()-start))
+        with tempfile.TemporaryDirectory(prefix='djerba_benchmark_') as tmp_dir:
+            # empty index directory, so the subset writer does not use a snapshot or store
+            subset_path = os.path.join(tmp_dir, 'provenance_subset.tsv.gz')
+            writer = provenance_subset_writer(
+                path, tmp_dir, self.log_level, self.log_path, decompression.GZIP, threads
+            )
+            start = time.perf_counter()
+            writer.write([(study, donor, subset_path)])
+            results.append(self.get_phase_result(self.SUBSET, total_rows, time.perf_counter()-start))
+            start = time.perf_counter()
+            reader = provenance_reader(
+                subset_path,
+                study,
+                donor,
+                sample_name_container(),
+                log_level=self.log_level,
+                log_path=self.log_path
+            )
+            subset_rows = len(reader.provenance)
+            results.append(self.get_phase_result(self.READER, subset_rows, time.perf_counter()-start))
+        start = time.perf_counter()
+        reader.resolve_output_paths()
+        results.append(self.get_phase_result(self.RESOLVE, subset_rows, time.perf_counter()-start))
+        for name in self.get_parse_methods():
+            start = time.perf_counter()
+            getattr(reader, name)()
+            results.append(self.get_phase_result(name, subset_rows, time.perf_counter()-start))
+        return results
+
+    def compare_results(self, results, baseline, tolerance=DEFAULT_TOLERANCE):
+        """
+        Compare suite results with baseline results for the same phases
+        Returns a copy of the results, with baseline time, ratio of time to baseline, and
+        a flag for regressions: time greater than tolerance*baseline
+        """
+        baseline_seconds = {x[self.PHASE]: x[self.SECONDS] for x in baseline}
+        compared = []
+        for result in results:
+            result = result.copy()
+            previous = baseline_seconds.get(result[self.PHASE])
+            result[self.BASELINE_SECONDS] = previous
+            if previous == None:
+                self.logger.warning("No baseline result for phase {0}".format(result[self.PHASE]))
+                result[self.RATIO] = None
+                result[self.REGRESSION] = False
+            else:
+                seconds = result[self.SECONDS]
+                result[self.RATIO] = round(seconds/previous, 3) if previous > 0 else None
+                result[self.REGRESSION] = seconds > tolerance*previous and \
+                    max(seconds, previous) >= self.MIN_COMPARISON_SECONDS
+                if result[self.REGRESSION]:
+                    msg = "Regression in phase {0}: {1}s, baseline {2}s".format(
+                        result[self.PHASE], seconds, previous
+                    )
+                    self.logger.warning(msg)
+            compared.append(result)
+        return compared
+
+    def read_results(self, in_path):
+        with open(in_path) as in_file:
+            results = json.loads(in_file.read())
+        return results
+
+    def format_results(self, results):
+        """Format results as a TSV table, with columns in order of the first result"""
+        columns = list(results[0].keys()) if results else []
+        lines = ["\t".join(columns)]
+        for result in results:
+            lines.append("\t".join([str(result[x]) for x in columns]))
+        return "\n".join(lines)+"\n"
+
+    def write_results(self, results, out_path):
+        with open(out_path, 'w') as out_file:
+            out_file.write(json.dumps(results, indent=4))
+        self.logger.info("Wrote benchmark results to {0}".format(out_path))
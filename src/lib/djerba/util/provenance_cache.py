@@ -0,0 +1,142 @@
+"""
+Shared on-disk cache of provenance subsets, for reuse across workspaces
+
+Entries are keyed by the identity of the file provenance report (FPR) -- its path,
+size and modification time -- together with study and donor. A new FPR therefore
+gives new keys, and entries for the old one expire by eviction.
+
+Eviction is least-recently-used: entries unused for longer than the maximum age are
+removed, then the least recently used entries are removed until the cache is under
+the maximum size. The access time of an entry is set explicitly when it is used.
+
+The cache is safe for concurrent use by multiple processes, eg. cluster jobs:
+- Entries are written to a temporary file and renamed, so are never seen incomplete
+- Eviction holds an exclusive lock on the cache directory; a process which cannot
+  take the lock skips eviction, as another process is already doing it
+- An entry removed while being copied remains readable until the copy is done
+"""
+
+import hashlib
+import logging
+import os
+import time
+
+import djerba.util.constants as constants
+from djerba.util.locking import file_lock, atomic_copy, is_temporary_path
+from djerba.util.logger import logger
+
+class provenance_cache(logger):
+
+    ENTRY_SUFFIX = '.provenance_subset.tsv.gz'
+    LOCK_NAME = 'provenance_cache'
+    # temporary files older than this are left over from failed processes
+    STALE_TEMPORARY_SECONDS = 24*60*60
+
+    def __init__(self, cache_dir, max_size, max_age,
+                 log_level=logging.WARNING, log_path=None):
+        """
+        cache_dir: path to an existing directory
+        max_size: maximum total size of entries, in bytes
+        max_age: maximum time since an entry was last used, in seconds
+        """
+        self.logger = self.get_logger(log_level, __name__, log_path)
+        if not os.path.isdir(cache_dir):
+            msg = "Provenance cache directory {0} does not exist".format(cache_dir)
+            self.logger.error(msg)
+            raise ProvenanceCacheError(msg)
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def get_entry_path(self, provenance_path, study, donor):
+        """Cache entry path for the current FPR, study and donor"""
+        provenance_path = os.path.abspath(provenance_path)
+        stat = os.stat(provenance_path)
+        identity = [provenance_path, stat.st_size, stat.st_mtime_ns, study, donor]
+        text = "\t".join([str(x) for x in identity])
+        key = hashlib.sha256(text.encode(constants.TEXT_ENCODING)).hexdigest()
+        return os.path.join(self.cache_dir, key+self.ENTRY_SUFFIX)
+
+    def get(self, provenance_path, study, donor, out_path):
+        """
+        If a cache entry exists, copy it to out_path and return True; otherwise return False
+        """
+        entry_path = self.get_entry_path(provenance_path, study, donor)
+        try:
+            atomic_copy(entry_path, out_path)
+        except FileNotFoundError:
+            self.logger.debug("Provenance cache miss for {0}/{1}".format(study, donor))
+            return False
+        self._touch(entry_path)
+        self.logger.info("Provenance cache hit for {0}/{1}: {2}".format(study, donor, entry_path))
+        return True
+
+    def put(self, provenance_path, study, donor, subset_path, entry_path=None):
+        """
+        Add a provenance subset to the cache, and evict old entries if necessary
+        entry_path is the value of get_entry_path() when the subset was started; if
+        the FPR has changed since then, the subset is not cached, as it may be out of date
+        """
+        current_path = self.get_entry_path(provenance_path, study, donor)
+        if entry_path != None and entry_path != current_path:
+            msg = "File provenance {0} changed while writing subset ".format(provenance_path)+\
+                "for {0}/{1}; not adding to cache".format(study, donor)
+            self.logger.warning(msg)
+            return None
+        atomic_copy(subset_path, current_path)
+        self.logger.debug("Added provenance cache entry {0}".format(current_path))
+        self.evict()
+        return current_path
+
+    def evict(self):
+        """Remove expired and least recently used entries; returns the number removed"""
+        lock_path = os.path.join(self.cache_dir, self.LOCK_NAME)
+        with file_lock(lock_path, blocking=False) as lock:
+            if not lock.locked:
+                self.logger.debug("Provenance cache eviction already in progress, skipping")
+                return 0
+            now = time.time()
+            entries = []
+            removed = 0
+            for entry in os.scandir(self.cache_dir):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if is_temporary_path(entry.path):
+                    if now - stat.st_mtime > self.STALE_TEMPORARY_SECONDS:
+                        removed += self._remove(entry.path)
+                elif entry.name.endswith(self.ENTRY_SUFFIX):
+                    if now - stat.st_atime > self.max_age:
+                        removed += self._remove(entry.path)
+                    else:
+                        entries.append((stat.st_atime, stat.st_size, entry.path))
+            total_size = sum([x[1] for x in entries])
+            for (atime, size, path) in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                removed += self._remove(path)
+                total_size -= size
+        if removed > 0:
+            self.logger.info("Evicted {0} file(s) from provenance cache".format(removed))
+        return removed
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            self.logger.debug("Removed provenance cache file {0}".format(path))
+            return 1
+        except FileNotFoundError:
+            return 0
+
+    def _touch(self, path):
+        # record last use as the access time; modification time is unchanged
+        try:
+            stat = os.stat(path)
+            os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        except FileNotFoundError:
+            self.logger.debug("Provenance cache entry {0} was evicted during use".format(path))
+
+
+class ProvenanceCacheError(Exception):
+    pass
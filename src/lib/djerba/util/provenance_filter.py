@@ -0,0 +1,142 @@
+"""
+Fast filter for rows of the file provenance report (FPR), by study and donor
+
+Parsing every FPR row with csv.reader is the main cost of a full scan, but almost all
+rows are for other studies and donors. This filter reads the decompressed FPR as bytes,
+in large chunks, and parses only candidate rows:
+- A chunk is skipped entirely if it contains none of the donor (or study) names, and no quotes
+- Lines without quotes or carriage returns are split on tabs, and checked directly
+- Other lines are parsed with csv.reader, reading further lines as needed, eg. for a
+  quoted field with an embedded newline
+
+Rows found are exactly the rows which csv.reader would find in the same file, with
+the same values; the filter only avoids parsing rows which cannot match.
+"""
+
+import csv
+import io
+from collections import deque
+
+import djerba.util.constants as constants
+import djerba.util.provenance_index as index
+
+CHUNK_SIZE = 4*1024*1024
+# above this number of donors, skip the test for donor names in each chunk
+MAX_CHUNK_NEEDLES = 32
+# number of tab-separated fields needed to check study and donor
+MIN_FIELDS = max(index.STUDY_TITLE, index.ROOT_SAMPLE_NAME) + 1
+
+
+class provenance_filter:
+
+    def __init__(self, keys, chunk_size=CHUNK_SIZE):
+        """
+        keys is an iterable of (study, donor) pairs
+        If donor is None, rows for all donors in the study are kept
+        """
+        keys = set(keys)
+        self.keys = set([x for x in keys if x[1] != None])
+        self.studies = set([x for (x, y) in keys if y == None])
+        self.byte_keys = set([
+            (x.encode(constants.TEXT_ENCODING), y.encode(constants.TEXT_ENCODING))
+            for (x, y) in self.keys
+        ])
+        self.byte_studies = set([x.encode(constants.TEXT_ENCODING) for x in self.studies])
+        # a chunk may contain matching rows only if it contains a donor or study-wide name
+        needles = set([y for (x, y) in self.byte_keys]).union(self.byte_studies)
+        self.needles = needles if len(needles) <= MAX_CHUNK_NEEDLES else None
+        self.chunk_size = chunk_size
+        self.contiguous = False
+        # statistics, eg. for logging
+        self.total_chunks = 0
+        self.skipped_chunks = 0
+        self.parsed_lines = 0
+
+    def _is_candidate_chunk(self, data):
+        if self.contiguous or self.needles == None or b'"' in data:
+            return True
+        for needle in self.needles:
+            if needle in data:
+                return True
+        return False
+
+    def _read_lines(self, in_file, initial):
+        # yield physical lines, including terminal newline if any, from chunks of input
+        # while self.contiguous is True, all lines are returned; otherwise, lines in
+        # chunks which cannot contain a matching row are skipped
+        remainder = initial
+        while True:
+            chunk = in_file.read(self.chunk_size)
+            if not chunk:
+                break
+            data = remainder + chunk
+            end = data.rfind(b'\n') + 1
+            remainder = data[end:]
+            data = data[0:end]
+            if len(data) == 0:
+                continue
+            self.total_chunks += 1
+            if not self._is_candidate_chunk(data):
+                self.skipped_chunks += 1
+                continue
+            start = 0
+            while start < end:
+                newline = data.index(b'\n', start) + 1
+                yield data[start:newline]
+                start = newline
+        if remainder:
+            yield remainder
+
+    def _split_text(self, line):
+        # decode a line; split on carriage returns, as a text stream would for csv.reader
+        text = line.decode(constants.TEXT_ENCODING)
+        if '\r' in text:
+            return list(io.StringIO(text, newline=''))
+        else:
+            return [text]
+
+    def _text_source(self, pending, lines):
+        # yield pending text, then decoded lines as needed
+        while True:
+            if pending:
+                yield pending.popleft()
+            else:
+                line = next(lines, None)
+                if line == None:
+                    return
+                pending.extend(self._split_text(line))
+
+    def filter_rows(self, in_file, initial=b''):
+        """
+        Yield rows matching the (study, donor) keys, as lists of strings
+        in_file is a binary stream, eg. from djerba.util.decompression.decompressor
+        initial is data already read from the start of the stream, if any
+        """
+        lines = self._read_lines(in_file, initial)
+        for line in lines:
+            if b'"' in line or b'\r' in line:
+                fields = None
+            else:
+                fields = line.split(b'\t', MIN_FIELDS)
+            if fields != None and len(fields) > MIN_FIELDS:
+                # no quotes, and study/donor are not in the last field; split directly
+                key = (fields[index.STUDY_TITLE], fields[index.ROOT_SAMPLE_NAME])
+                if key in self.byte_keys or key[0] in self.byte_studies:
+                    self.parsed_lines += 1
+                    text = line.decode(constants.TEXT_ENCODING)
+                    yield text[0:-1].split('\t') if text.endswith('\n') else text.split('\t')
+            else:
+                # parse with csv.reader, which may read more lines, eg. for a quoted newline
+                # continue until the last row ends with the last line read
+                self.contiguous = True
+                pending = deque(self._split_text(line))
+                reader = csv.reader(self._text_source(pending, lines), delimiter="\t")
+                while pending:
+                    row = next(reader, None)
+                    if row == None:
+                        break
+                    self.parsed_lines += 1
+                    if (row[index.STUDY_TITLE], row[index.ROOT_SAMPLE_NAME]) in self.keys or \
+                       row[index.STUDY_TITLE] in self.studies:
+                        yield row
+                self.contiguous = False
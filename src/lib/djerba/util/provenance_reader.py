@@ -1,13 +1,64 @@
 """Class to read and parse the file provenance report (FPR)"""
 
-import csv
-import gzip
+import functools
 import logging
 import re
 
 import djerba.util.provenance_index as index
 import djerba.util.ini_fields as ini
+from djerba.util.decompression import decompressor, AUTO
 from djerba.util.logger import logger
+from djerba.util.provenance_row import provenance_row, read_provenance_file
+from djerba.util.provenance_snapshot import provenance_snapshot
+from djerba.util.provenance_store import provenance_store
+
+# cache for parsed parent sample attributes, shared by all readers in a process
+ATTRIBUTE_CACHE_SIZE = 16384
+
+
+@functools.lru_cache(maxsize=ATTRIBUTE_CACHE_SIZE)
+def parse_sample_attributes(attributes):
+    """
+    Parse a PARENT_SAMPLE_ATTRIBUTES string of the form KEY1=VALUE1;KEY2=VALUE2;...
+    Returns a tuple of (key, value) pairs; raises ValueError if a pair is malformed
+    Results are memoized, as many rows and readers share the same attribute strings
+    """
+    pairs = []
+    for entry in attributes.split(';'):
+        pair = entry.split('=')
+        if len(pair)!=2:
+            msg = "Expected attribute of the form KEY=VALUE, found '{0}'".format(entry)
+            raise ValueError(msg)
+        pairs.append((pair[0], pair[1]))
+    return tuple(pairs)
+
+
+class provenance_output:
+    """
+    Declarative specification of a workflow output to find in file provenance
+    - keys: path of keys for the output in the path info structure, eg. [workflow, 'bam']
+    - workflows: workflow names to search, in order of preference; the first name with
+      any matching output is used (eg. for current and legacy names of a workflow)
+    - metatype: regular expression for the file metatype
+    - suffix: regular expression for the file path; may include ROOT_SAMPLE_PLACEHOLDER
+    - sample_role: INI key for the sample name, eg. ini.SAMPLE_NAME_WG_T
+    """
+
+    ROOT_SAMPLE_PLACEHOLDER = '__ROOT_SAMPLE_NAME__'
+
+    def __init__(self, keys, workflows, metatype, suffix, sample_role):
+        self.keys = keys
+        self.workflows = workflows
+        self.metatype = metatype
+        self.suffix = suffix
+        self.sample_role = sample_role
+
+    def __repr__(self):
+        return "provenance_output({0})".format(self.keys)
+
+    def get_suffix(self, root_sample_name):
+        return self.suffix.replace(self.ROOT_SAMPLE_PLACEHOLDER, root_sample_name)
+
 
 class provenance_reader(logger):
 
@@ -65,9 +116,141 @@ class provenance_reader(logger):
     MT_BAM = 'application/bam$'
     MT_BAM_INDEX = 'application/bam-index$'
 
+    # recommended workflows; provenance should have records for at least one name in
+    # each list, ie. Vidarr or Niassa; WTS workflows are checked only if any are present
+    WGS_WORKFLOW_CHECKS = [
+        [WF_BMPP, WF_BMPP_20231113, NIASSA_WF_BMPP],
+        [WF_SEQUENZA, NIASSA_WF_SEQUENZA],
+        [WF_VEP, WF_VEP_20231113, NIASSA_WF_VEP],
+        [WF_VIRUS],
+        [WF_IMMUNE]
+    ]
+    WTS_WORKFLOW_CHECKS = [
+        [WF_ARRIBA],
+        [WF_DELLY, WF_DELLY_20231113, NIASSA_WF_DELLY],
+        [WF_RSEM],
+        [WF_STAR, NIASSA_WF_STAR],
+        [WF_STARFUSION, NIASSA_WF_STARFUSION],
+        [WF_MAVIS]
+    ]
+
     # placeholder
     WT_SAMPLE_NAME_PLACEHOLDER = 'whole_transcriptome_placeholder'
 
+    # identifiers for bam/bai files
+    WG_N_BAM = 'whole genome normal bam'
+    WG_N_IDX = 'whole genome normal bam index'
+    WG_T_BAM = 'whole genome tumour bam'
+    WG_T_IDX = 'whole genome tumour bam index'
+    WT_T_BAM = 'whole transcriptome tumour bam'
+    WT_T_IDX = 'whole transcriptome tumour bam index'
+
+    # Workflow outputs, in the order they appear in path info
+    # If workflow names differ, try Vidarr first, then Niassa
+    BMPP_WORKFLOWS = [WF_BMPP, WF_BMPP_20231113, NIASSA_WF_BMPP]
+    BMPP_BAM_SUFFIX = r'\.filter\.deduped\.realigned\.recalibrated\.bam$'
+    BMPP_BAI_SUFFIX = r'\.filter\.deduped\.realigned\.recalibrated\.bai$'
+    # matches *Aligned.sortedByCoord.out.bam if *not* preceded by an index of the form ACGTACGT
+    STAR_SUFFIX = '('+provenance_output.ROOT_SAMPLE_PLACEHOLDER+\
+        r'.+)((?<![ACGT]{8})\.Aligned)\.sortedByCoord\.out\.'
+    OUTPUT_ARRIBA = provenance_output(
+        [WF_ARRIBA], [WF_ARRIBA], MT_OCTET_STREAM, r'\.fusions\.tsv$', ini.SAMPLE_NAME_WT_T
+    )
+    OUTPUT_WG_BAM = provenance_output(
+        [WF_BMPP, WG_T_BAM], BMPP_WORKFLOWS, MT_BAM, BMPP_BAM_SUFFIX, ini.SAMPLE_NAME_WG_T
+    )
+    OUTPUT_WG_INDEX = provenance_output(
+        [WF_BMPP, WG_T_IDX], BMPP_WORKFLOWS, MT_BAM_INDEX, BMPP_BAI_SUFFIX, ini.SAMPLE_NAME_WG_T
+    )
+    OUTPUT_WG_BAM_REF = provenance_output(
+        [WF_BMPP, WG_N_BAM], BMPP_WORKFLOWS, MT_BAM, BMPP_BAM_SUFFIX, ini.SAMPLE_NAME_WG_N
+    )
+    OUTPUT_WG_INDEX_REF = provenance_output(
+        [WF_BMPP, WG_N_IDX], BMPP_WORKFLOWS, MT_BAM_INDEX, BMPP_BAI_SUFFIX, ini.SAMPLE_NAME_WG_N
+    )
+    OUTPUT_DELLY = provenance_output(
+        [WF_DELLY], [WF_DELLY, WF_DELLY_20231113, NIASSA_WF_DELLY], MT_VCF_GZ,
+        r'\.somatic_filtered\.delly\.merged\.vcf\.gz$', ini.SAMPLE_NAME_WG_T
+    )
+    OUTPUT_GRIDSS = provenance_output(
+        [WF_GRIDSS], [WF_GRIDSS], MT_TXT_VCF, r'\.allocated\.vcf$', ini.SAMPLE_NAME_WG_T
+    )
+    OUTPUT_HRDETECT = provenance_output(
+        [WF_HRDETECT], [WF_HRDETECT], MT_JSON_TEXT, r'\.signatures\.json$', ini.SAMPLE_NAME_WG_T
+    )
+    OUTPUT_MAVIS = provenance_output(
+        [WF_MAVIS], [WF_MAVIS], MT_OCTET_STREAM, r'mavis_summary\.tab$', ini.SAMPLE_NAME_WT_T
+    )
+    OUTPUT_MRDETECT = provenance_output(
+        [WF_MRDETECT], [WF_MRDETECT], MT_PLAIN_TEXT, r'SNP\.count\.txt$', ini.SAMPLE_NAME_WG_T
+    )
+    OUTPUT_MSI = provenance_output(
+        [WF_MSISENSOR], [WF_MSISENSOR], MT_OCTET_STREAM, r'recalibrated\.msi\.booted$',
+        ini.SAMPLE_NAME_WG_T
+    )
+    OUTPUT_MUTECT = provenance_output(
+        [WF_MUTECT], [WF_MUTECT], MT_VCF_GZ, r'\.mutect2\.filtered\.vcf\.gz$', ini.SAMPLE_NAME_WG_T
+    )
+    OUTPUT_PURPLE = provenance_output(
+        [WF_PURPLE], [WF_PURPLE], MT_ZIP, r'purple\.zip$', ini.SAMPLE_NAME_WG_T
+    )
+    OUTPUT_GEP = provenance_output(
+        [WF_RSEM], [WF_RSEM], MT_OCTET_STREAM, r'\.genes\.results$', ini.SAMPLE_NAME_WT_T
+    )
+    OUTPUT_SEQUENZA = provenance_output(
+        [WF_SEQUENZA], [WF_SEQUENZA, NIASSA_WF_SEQUENZA], MT_ZIP, r'_results(\.sequenza)?\.zip$',
+        ini.SAMPLE_NAME_WG_T
+    )
+    OUTPUT_WT_BAM = provenance_output(
+        [WF_STAR, WT_T_BAM], [WF_STAR, NIASSA_WF_STAR], MT_BAM, STAR_SUFFIX+'bam$',
+        ini.SAMPLE_NAME_WT_T
+    )
+    OUTPUT_WT_INDEX = provenance_output(
+        [WF_STAR, WT_T_IDX], [WF_STAR, NIASSA_WF_STAR], MT_BAM_INDEX, STAR_SUFFIX+'bai$',
+        ini.SAMPLE_NAME_WT_T
+    )
+    OUTPUT_STARFUSION = provenance_output(
+        [WF_STARFUSION], [WF_STARFUSION, NIASSA_WF_STARFUSION], MT_OCTET_STREAM,
+        r'star-fusion\.fusion_predictions\.tsv$', ini.SAMPLE_NAME_WT_T
+    )
+    OUTPUT_MAF = provenance_output(
+        [WF_VEP], [WF_VEP, WF_VEP_20231113, NIASSA_WF_VEP], MT_TXT_GZ,
+        r'\.mutect2\.filtered\.maf\.gz$', ini.SAMPLE_NAME_WG_T
+    )
+    OUTPUT_VIRUS = provenance_output(
+        [WF_VIRUS], [WF_VIRUS], MT_OCTET_STREAM, r'virusbreakend\.vcf\.summary\.tsv$',
+        ini.SAMPLE_NAME_WG_T
+    )
+    OUTPUT_IMMUNE = provenance_output(
+        [WF_IMMUNE], [WF_IMMUNE], MT_OCTET_STREAM, r'immunedeconv_CIBERSORT-Percentiles\.csv$',
+        ini.SAMPLE_NAME_WT_T
+    )
+    OUTPUTS = [
+        OUTPUT_ARRIBA,
+        OUTPUT_WG_BAM,
+        OUTPUT_WG_INDEX,
+        OUTPUT_WG_BAM_REF,
+        OUTPUT_WG_INDEX_REF,
+        OUTPUT_DELLY,
+        OUTPUT_GRIDSS,
+        OUTPUT_HRDETECT,
+        OUTPUT_MAVIS,
+        OUTPUT_MRDETECT,
+        OUTPUT_MSI,
+        OUTPUT_MUTECT,
+        OUTPUT_PURPLE,
+        OUTPUT_GEP,
+        OUTPUT_SEQUENZA,
+        OUTPUT_WT_BAM,
+        OUTPUT_WT_INDEX,
+        OUTPUT_STARFUSION,
+        OUTPUT_MAF,
+        OUTPUT_VIRUS,
+        OUTPUT_IMMUNE
+    ]
+    # additional outputs registered by plugins, eg. from other DJERBA_PACKAGES
+    REGISTERED_OUTPUTS = []
+
     # Includes a concept of 'sample name' (not just 'root sample name')
     # allow user to specify sample names for WG/T, WG/N, WT
     # use to disambiguate multiple samples from the same donor (eg. at different times)
@@ -80,7 +263,16 @@ class provenance_reader(logger):
     # if conflicting sample names (eg. for different tumour/normal IDs), should fail as it cannot find a unique tumour ID
 
     def __init__(self, provenance_path, project, donor, samples,
-                 log_level=logging.WARNING, log_path=None):
+                 log_level=logging.WARNING, log_path=None, index_dir=None,
+                 decompression=AUTO, threads=0, store=None, rows=None):
+        # index_dir is the location of the provenance snapshot index, if any
+        # decompression and threads set the backend to read a gzipped FPR or subset
+        # store is a provenance_store; if given, rows are queried from the store
+        # rows is an iterable of provenance rows; if given, rows are not read from any file
+        self.log_level = log_level
+        self.log_path = log_path
+        self.store = store
+        self.decompressor = decompressor(decompression, threads, log_level, log_path)
         self.logger = self.get_logger(log_level, __name__, log_path)
         # set some constants for convenience
         self.wg_n = ini.SAMPLE_NAME_WG_N
@@ -97,14 +289,15 @@ class provenance_reader(logger):
             raise RuntimeError(msg)
         self.provenance = []
         # find provenance rows with the required project, root sample, and (if given) sample names
-        with gzip.open(provenance_path, 'rt') as infile:
-            reader = csv.reader(infile, delimiter="\t")
-            for row in reader:
-                if row[index.STUDY_TITLE] == project and \
-                   row[index.ROOT_SAMPLE_NAME] == self.root_sample_name and \
-                   (samples.name_ok(row[index.SAMPLE_NAME])) and \
-                   row[index.SEQUENCER_RUN_PLATFORM_ID] != 'Illumina_MiSeq':
-                    self.provenance.append(row)
+        if rows == None:
+            rows = self._read_provenance_rows(provenance_path, project, index_dir)
+        for row in rows:
+            if row[index.STUDY_TITLE] == project and \
+               row[index.ROOT_SAMPLE_NAME] == self.root_sample_name and \
+               (samples.name_ok(row[index.SAMPLE_NAME])) and \
+               row[index.SEQUENCER_RUN_PLATFORM_ID] != 'Illumina_MiSeq':
+                self.provenance.append(row)
+        self._build_row_index()
         if len(self.provenance)==0:
             # continue with empty provenance results, eg. for GSICAPBENCH testing
             msg = "No provenance records found for project '%s' and donor '%s' " % (project, donor) +\
@@ -113,7 +306,7 @@ class provenance_reader(logger):
             self._set_empty_provenance()
         else:
             self.logger.info("Found %d provenance records" % len(self.provenance))
-            self._check_workflows()
+            self.missing_workflows = self._check_workflows()
             distinct_records = set()
             for row in self.provenance:
                 columns = (
@@ -123,29 +316,41 @@ class provenance_reader(logger):
                 distinct_records.add(columns)
             # parse the 'parent sample attributes' value and get a list of dictionaries
             self.attributes = [self._parse_row_attributes(row) for row in distinct_records]
+            self._build_attribute_table()
             self._validate_and_set_sample_names(samples)
             self.patient_id = self._id_patient()
             self.tumour_id = self._id_tumour()
             self.normal_id = self._id_normal()
 
+    def _build_row_index(self):
+        # index rows by (workflow, sample name), so path lookups need not scan all rows
+        # also initialize a cache of compiled regular expressions for metatypes/paths
+        self.row_index = {}
+        for row in self.provenance:
+            key = (row[index.WORKFLOW_NAME], row[index.SAMPLE_NAME])
+            self.row_index.setdefault(key, []).append(row)
+        self.patterns = {}
+        self.logger.debug("Indexed provenance rows by {0} workflow/sample pairs".format(len(self.row_index)))
+
+    def _build_attribute_table(self):
+        # one pass over the distinct records: attribute key -> non-empty values, grouped
+        # by whether the record is a reference (ie. normal) with tissue type 'R'
+        self.attribute_table = {}
+        for row in self.attributes:
+            reference = row.get(self.GEO_TISSUE_TYPE_ID)=='R'
+            for key, value in row.items():
+                if value:
+                    values = self.attribute_table.setdefault(key, {True: set(), False: set()})
+                    values[reference].add(value)
+        self.logger.debug("Indexed values of {0} sample attributes".format(len(self.attribute_table)))
+
     def _check_workflows(self):
         # check that provenance has all recommended workflows (Niassa or Vidarr); warn if not
         # this only checks if output exists, *not* if it is correct
-        wgs_to_check = [
-            [self.WF_BMPP, self.WF_BMPP_20231113, self.NIASSA_WF_BMPP],
-            [self.WF_SEQUENZA, self.NIASSA_WF_SEQUENZA],
-            [self.WF_VEP, self.WF_VEP_20231113, self.NIASSA_WF_VEP],
-            [self.WF_VIRUS],
-            [self.WF_IMMUNE]
-        ]
-        wts_to_check = [
-            [self.WF_ARRIBA],
-            [self.WF_DELLY, self.WF_DELLY_20231113, self.NIASSA_WF_DELLY],
-            [self.WF_RSEM],
-            [self.WF_STAR, self.NIASSA_WF_STAR],
-            [self.WF_STARFUSION, self.NIASSA_WF_STARFUSION],
-            [self.WF_MAVIS]
-        ]
+        # returns a list of workflow lists with no records
+        wgs_to_check = self.WGS_WORKFLOW_CHECKS
+        wts_to_check = self.WTS_WORKFLOW_CHECKS
+        missing = []
         counts = {}
         for group in [wgs_to_check, wts_to_check]:
             for wf_list in group:
@@ -160,6 +365,7 @@ class provenance_reader(logger):
             total = sum([counts[x] for x in wf_list])
             if total==0:
                 self.logger.warning("No file provenance records for workflows {0}".format(wf_list))
+                missing.append(wf_list)
             else:
                 msg = "Found {0} file provenance records for workflows {1}".format(total, wf_list)
                 self.logger.debug(msg)
@@ -175,10 +381,12 @@ class provenance_reader(logger):
                 total = sum([counts[x] for x in wf_list])
                 if sum([counts[x] for x in wf_list])==0:
                     self.logger.warning("No file provenance records for workflows {0}".format(wf_list))
+                    missing.append(wf_list)
                 else:
                     msg = "Found {0} file provenance records for workflows {1}".format(total, wf_list)
                     self.logger.debug(msg)
         self.logger.debug("Finished check on workflows in file provenance")
+        return missing
 
     def _filter_rows(self, index, value, rows=None):
         # find matching provenance rows from a list
@@ -187,11 +395,13 @@ class provenance_reader(logger):
 
     def _filter_metatype(self, pattern, rows=None):
         if rows == None: rows = self.provenance
-        return filter(lambda x: re.search(pattern, x[index.FILE_META_TYPE]), rows)
+        regex = self._get_pattern(pattern)
+        return filter(lambda x: regex.search(x[index.FILE_META_TYPE]), rows)
 
     def _filter_file_path(self, pattern, rows=None):
         if rows == None: rows = self.provenance
-        return filter(lambda x: re.search(pattern, x[index.FILE_PATH]), rows)
+        regex = self._get_pattern(pattern)
+        return filter(lambda x: regex.search(x[index.FILE_PATH]), rows)
 
     def _filter_sample_name(self, sample_name, rows=None):
         return self._filter_rows(index.SAMPLE_NAME, sample_name, rows)
@@ -209,11 +419,20 @@ class provenance_reader(logger):
             self.logger.debug(msg)
             raise MissingProvenanceError(msg)
         else:
-            return sorted(rows, key=lambda row: row[index.LAST_MODIFIED], reverse=True)[0]
+            # max() returns the first of any tied rows, as does a stable reverse sort
+            return max(rows, key=lambda row: row[index.LAST_MODIFIED])
+
+    def _get_pattern(self, pattern):
+        # compile each regular expression once, and reuse for all subsequent lookups
+        regex = self.patterns.get(pattern)
+        if regex == None:
+            regex = re.compile(pattern)
+            self.patterns[pattern] = regex
+        return regex
 
     def _get_unique_value(self, key, check, reference=False):
         """
-        Get unique value (if any) of key from self.attributes
+        Get unique value (if any) of key from the attribute table of self.attributes
         Attributes is a list of dictionaries, each corresponding to one or more provenance rows
         If check==True, check the tissue type ID to determine if the row refers to a reference (ie. normal)
         If check==False, require a unique value across both tumour and normal (eg. to find the patient ID)
@@ -222,18 +441,14 @@ class provenance_reader(logger):
         - If key does not exist for any member, return None
         - If values for key are inconsistent, return None (additional error checking is done downstream)
         """
-        value_set = set()
-        for row in self.attributes:
-            if check:
-                if reference and row.get(self.GEO_TISSUE_TYPE_ID)!='R':
-                    continue
-                elif not reference and row.get(self.GEO_TISSUE_TYPE_ID)=='R':
-                    continue
-            value = row.get(key)
-            if value:
-                value_set.add(value)
-            else:
-                self.logger.debug("No value found for {0} in {1}".format(key, row))
+        # values are looked up in the table from _build_attribute_table()
+        values = self.attribute_table.get(key)
+        if values == None:
+            value_set = set()
+        elif check:
+            value_set = values[reference]
+        else:
+            value_set = values[True].union(values[False])
         self.logger.debug("Candidate value set for key '{0}': {1}".format(key, value_set))
         if len(value_set)==0:
             self.logger.debug("No value found for {0}, reference = {1}".format(key, reference))
@@ -313,11 +528,11 @@ class provenance_reader(logger):
 
     def _parse_file_path(self, workflow, meta_pattern, file_pattern, sample_name):
         # get most recent file of given workflow, metatype, file path pattern, and sample name
+        # workflow and sample name are looked up in the row index
         # self._filter_* functions return an iterator
-        iterrows = self._filter_workflow(workflow)
+        iterrows = self.row_index.get((workflow, sample_name), [])
         iterrows = self._filter_metatype(meta_pattern, iterrows)
         iterrows = self._filter_file_path(file_pattern, iterrows)
-        iterrows = self._filter_sample_name(sample_name, iterrows)
         try:
             row = self._get_most_recent_row(iterrows)
             path = row[index.FILE_PATH]
@@ -335,21 +550,39 @@ class provenance_reader(logger):
         """
         attrs = {}
         attrs[self.SAMPLE_NAME_KEY] = row[0]
-        for entry in re.split(';', row[1]):
-            pair = re.split('=', entry)
-            if len(pair)!=2:
-                msg = "Expected attribute of the form KEY=VALUE, found '{0}'".format(entry)
-                self.logger.error(msg)
-                raise ValueError(msg)
-            attrs[pair[0]] = pair[1]
+        try:
+            attrs.update(parse_sample_attributes(row[1]))
+        except ValueError as err:
+            self.logger.error(str(err))
+            raise
         self.logger.debug("Found row attributes: {0}".format(attrs))
         return attrs
 
+    def _read_provenance_rows(self, provenance_path, project, index_dir):
+        # query the provenance store, if any
+        # otherwise, read from the provenance snapshot if it is current, or the whole file
+        if self.store != None:
+            self.logger.debug("Reading rows from provenance store {0}".format(self.store.store_path))
+            yield from self.store.read_rows(project, self.root_sample_name)
+            return
+        snapshot = provenance_snapshot(provenance_path, index_dir, self.log_level, self.log_path)
+        # input may be a full FPR, or a projected subset; output is provenance_row objects
+        if snapshot.is_current():
+            self.logger.debug("Reading rows from provenance snapshot")
+            for row in snapshot.read_rows(project, self.root_sample_name):
+                yield provenance_row.from_full_row(row)
+        else:
+            yield from read_provenance_file(
+                provenance_path, project, self.root_sample_name, self.decompressor
+            )
+
     def _set_empty_provenance(self):
         # special case for empty file provenance result
         # - all reader attributes are null/empty
         # - can proceed if and only if a fully-specified config is input
         self.attributes = []
+        self.attribute_table = {}
+        self.missing_workflows = []
         self.patient_id = None
         self.tumour_id = None
         self.normal_id = None
@@ -433,140 +666,161 @@ class provenance_reader(logger):
         self.logger.debug("Got sample names: {0}".format(names))
         return names
 
+    @classmethod
+    def from_store(cls, store_path, project, donor, samples,
+                   log_level=logging.WARNING, log_path=None):
+        """Construct a reader which queries a provenance_store, instead of reading a file"""
+        store = provenance_store(store_path, log_level, log_path)
+        return cls(store_path, project, donor, samples, log_level, log_path, store=store)
+
+    @classmethod
+    def get_outputs(cls):
+        """Get the default workflow output specifications, and any registered by plugins"""
+        return cls.OUTPUTS + cls.REGISTERED_OUTPUTS
+
+    @classmethod
+    def register_output(cls, output):
+        """
+        Register an additional provenance_output, to be found by resolve_output_paths()
+        A registered output with the same keys as an existing one will replace it
+        """
+        registered = [x for x in cls.REGISTERED_OUTPUTS if x.keys != output.keys]
+        registered.append(output)
+        cls.REGISTERED_OUTPUTS = registered
+
+    def get_sample_name(self, sample_role):
+        """Get the sample name for a role, eg. ini.SAMPLE_NAME_WG_T"""
+        names = {
+            self.wg_n: self.sample_name_wg_n,
+            self.wg_t: self.sample_name_wg_t,
+            self.wt_t: self.sample_name_wt_t
+        }
+        return names[sample_role]
+
+    def parse_output_path(self, output):
+        """Get the path of the most recent file for a provenance_output, if any"""
+        sample_name = self.get_sample_name(output.sample_role)
+        suffix = output.get_suffix(self.root_sample_name)
+        return self._parse_multiple_workflows(output.workflows, output.metatype, suffix, sample_name)
+
+    def resolve_output_paths(self, outputs=None):
+        """
+        Find paths for a list of provenance_output objects, in a single pass over provenance
+        Default is all outputs from get_outputs()
+        Returns a nested dictionary, with structure given by the output keys; paths may be None
+        """
+        if outputs == None:
+            outputs = self.get_outputs()
+        candidates = {} # workflow name -> list of (output number, workflow rank)
+        patterns = []
+        sample_names = []
+        for i in range(len(outputs)):
+            output = outputs[i]
+            for rank in range(len(output.workflows)):
+                candidates.setdefault(output.workflows[rank], []).append((i, rank))
+            metatype = self._get_pattern(output.metatype)
+            suffix = self._get_pattern(output.get_suffix(self.root_sample_name))
+            patterns.append((metatype, suffix))
+            sample_names.append(self.get_sample_name(output.sample_role))
+        # find the most recent row for each output and workflow name
+        # ties are resolved in favour of the first row, as in _get_most_recent_row()
+        most_recent = {}
+        for row in self.provenance:
+            for (i, rank) in candidates.get(row[index.WORKFLOW_NAME], []):
+                (metatype, suffix) = patterns[i]
+                if row[index.SAMPLE_NAME] == sample_names[i] and \
+                   metatype.search(row[index.FILE_META_TYPE]) and \
+                   suffix.search(row[index.FILE_PATH]):
+                    current = most_recent.get((i, rank))
+                    if current == None or row[index.LAST_MODIFIED] > current[index.LAST_MODIFIED]:
+                        most_recent[(i, rank)] = row
+        # use the first workflow name in order of preference with a matching row
+        path_info = {}
+        for i in range(len(outputs)):
+            output = outputs[i]
+            path = None
+            for rank in range(len(output.workflows)):
+                row = most_recent.get((i, rank))
+                if row != None and row[index.FILE_PATH]:
+                    path = row[index.FILE_PATH]
+                    break
+            if path == None:
+                msg = "No provenance records found for output {0}".format(output.keys)
+                self.logger.debug(msg)
+            parent = path_info
+            for key in output.keys[:-1]:
+                parent = parent.setdefault(key, {})
+            parent[output.keys[-1]] = path
+        return path_info
+
     # Methods to parse file paths for particular workflows
-    # If workflow names differ, try Vidarr first, then Niassa
 
     def parse_arriba_path(self):
-        workflow = self.WF_ARRIBA
-        mt = self.MT_OCTET_STREAM
-        suffix = r'\.fusions\.tsv$'
-        return self._parse_file_path(workflow, mt, suffix, self.sample_name_wt_t)
+        return self.parse_output_path(self.OUTPUT_ARRIBA)
 
     def parse_delly_path(self):
-        workflows = [self.WF_DELLY, self.WF_DELLY_20231113, self.NIASSA_WF_DELLY]
-        mt = self.MT_VCF_GZ
-        suffix = r'\.somatic_filtered\.delly\.merged\.vcf\.gz$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wg_t)
+        return self.parse_output_path(self.OUTPUT_DELLY)
 
     def parse_gep_path(self):
-        workflow = self.WF_RSEM
-        mt = self.MT_OCTET_STREAM
-        suffix = r'\.genes\.results$'
-        return self._parse_file_path(workflow, mt, suffix, self.sample_name_wt_t)
+        return self.parse_output_path(self.OUTPUT_GEP)
 
     def parse_gridss_path(self):
-        workflows = [self.WF_GRIDSS]
-        mt = self.MT_TXT_VCF
-        suffix = r'\.allocated\.vcf$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wg_t)
+        return self.parse_output_path(self.OUTPUT_GRIDSS)
 
     def parse_hrdetect_path(self):
-        workflows = [self.WF_HRDETECT]
-        mt = self.MT_JSON_TEXT
-        suffix = r'\.signatures\.json$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wg_t)
+        return self.parse_output_path(self.OUTPUT_HRDETECT)
 
     def parse_immune_path(self):
-        workflow = self.WF_IMMUNE
-        mt = self.MT_OCTET_STREAM
-        suffix = r'immunedeconv_CIBERSORT-Percentiles\.csv$'
-        return self._parse_file_path(workflow, mt, suffix, self.sample_name_wt_t)
+        return self.parse_output_path(self.OUTPUT_IMMUNE)
 
     def parse_maf_path(self):
-        workflows = [self.WF_VEP, self.WF_VEP_20231113, self.NIASSA_WF_VEP]
-        mt = self.MT_TXT_GZ
-        suffix = r'\.mutect2\.filtered\.maf\.gz$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wg_t)
+        return self.parse_output_path(self.OUTPUT_MAF)
 
     def parse_mavis_path(self):
-        workflow = self.WF_MAVIS
-        mt = self.MT_OCTET_STREAM
-        suffix = r'mavis_summary\.tab$'
-        return self._parse_file_path(workflow, mt, suffix, self.sample_name_wt_t)
+        return self.parse_output_path(self.OUTPUT_MAVIS)
 
     def parse_sequenza_path(self):
-        workflows = [self.WF_SEQUENZA, self.NIASSA_WF_SEQUENZA]
-        mt = self.MT_ZIP
-        suffix = r'_results(\.sequenza)?\.zip$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wg_t)
+        return self.parse_output_path(self.OUTPUT_SEQUENZA)
 
     def parse_msi_path(self):
-        workflows = [self.WF_MSISENSOR]
-        mt = self.MT_OCTET_STREAM
-        suffix = r'recalibrated\.msi\.booted$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wg_t)
+        return self.parse_output_path(self.OUTPUT_MSI)
 
     def parse_mrdetect_path(self):
-        workflows = [self.WF_MRDETECT]
-        mt = self.MT_PLAIN_TEXT
-        suffix = r'SNP\.count\.txt$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wg_t)
-    
+        return self.parse_output_path(self.OUTPUT_MRDETECT)
+
     def parse_mutect_path(self):
-        workflows = [self.WF_MUTECT]
-        mt = self.MT_VCF_GZ
-        suffix = r'\.mutect2\.filtered\.vcf\.gz$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wg_t)
+        return self.parse_output_path(self.OUTPUT_MUTECT)
 
     def parse_purple_zip_path(self):
-        workflow = self.WF_PURPLE
-        mt = self.MT_ZIP
-        suffix = r'purple\.zip$'
-        return self._parse_file_path(workflow, mt, suffix, self.sample_name_wg_t)
+        return self.parse_output_path(self.OUTPUT_PURPLE)
 
     def parse_starfusion_predictions_path(self):
-        workflows = [self.WF_STARFUSION, self.NIASSA_WF_STARFUSION]
-        mt = self.MT_OCTET_STREAM
-        suffix = r'star-fusion\.fusion_predictions\.tsv$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wt_t)
-    
+        return self.parse_output_path(self.OUTPUT_STARFUSION)
+
     def parse_virus_path(self):
-        workflow = self.WF_VIRUS
-        mt = self.MT_OCTET_STREAM
-        suffix = r'virusbreakend\.vcf\.summary\.tsv$'
-        return self._parse_file_path(workflow, mt, suffix, self.sample_name_wg_t)
-    
+        return self.parse_output_path(self.OUTPUT_VIRUS)
+
     def parse_wg_bam_path(self):
-        workflows = [self.WF_BMPP, self.WF_BMPP_20231113, self.NIASSA_WF_BMPP]
-        mt = self.MT_BAM
-        suffix = r'\.filter\.deduped\.realigned\.recalibrated\.bam$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wg_t)
+        return self.parse_output_path(self.OUTPUT_WG_BAM)
 
     def parse_wg_bam_ref_path(self):
         # find the reference (normal) BAM
-        workflows = [self.WF_BMPP, self.WF_BMPP_20231113, self.NIASSA_WF_BMPP]
-        mt = self.MT_BAM
-        suffix = r'\.filter\.deduped\.realigned\.recalibrated\.bam$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wg_n)
+        return self.parse_output_path(self.OUTPUT_WG_BAM_REF)
 
     def parse_wg_index_path(self):
-        workflows = [self.WF_BMPP, self.WF_BMPP_20231113, self.NIASSA_WF_BMPP]
-        mt = self.MT_BAM_INDEX
-        suffix = r'\.filter\.deduped\.realigned\.recalibrated\.bai$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wg_t)
+        return self.parse_output_path(self.OUTPUT_WG_INDEX)
 
     def parse_wg_index_ref_path(self):
         # find the reference (normal) BAM index
-        workflows = [self.WF_BMPP, self.WF_BMPP_20231113, self.NIASSA_WF_BMPP]
-        mt = self.MT_BAM_INDEX
-        suffix = r'\.filter\.deduped\.realigned\.recalibrated\.bai$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wg_n)
+        return self.parse_output_path(self.OUTPUT_WG_INDEX_REF)
 
     ### WT assay produces only 1 bam file; no need to consider tumour vs. reference
 
     def parse_wt_bam_path(self):
-        # matches *Aligned.sortedByCoord.out.bam if *not* preceded by an index of the form ACGTACGT
-        workflows = [self.WF_STAR, self.NIASSA_WF_STAR]
-        mt = self.MT_BAM
-        suffix = '('+self.root_sample_name+r'.+)((?<![ACGT]{8})\.Aligned)\.sortedByCoord\.out\.bam$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wt_t)
+        return self.parse_output_path(self.OUTPUT_WT_BAM)
 
     def parse_wt_index_path(self):
-        # matches *Aligned.sortedByCoord.out.bam if *not* preceded by an index of the form ACGTACGT
-        workflows = [self.WF_STAR, self.NIASSA_WF_STAR]
-        mt = self.MT_BAM_INDEX
-        suffix = '('+self.root_sample_name+r'.+)((?<![ACGT]{8})\.Aligned)\.sortedByCoord\.out\.bai$'
-        return self._parse_multiple_workflows(workflows, mt, suffix, self.sample_name_wt_t)
+        return self.parse_output_path(self.OUTPUT_WT_INDEX)
 
 class sample_name_container:
     """
@@ -0,0 +1,170 @@
+"""
+Compact record of the file provenance columns used by Djerba
+
+A full FPR row has about 60 columns, of which Djerba uses only a few. A provenance_row
+keeps only those columns, in slots; repeated values such as study, donor, sample and
+workflow names are interned, so they are stored once however many rows share them.
+
+Items are accessed by the full column index from provenance_index, as for a full row;
+so code written for full rows, eg. row[index.FILE_PATH], works unchanged.
+
+A projected subset file is a gzipped TSV with one column per field of provenance_row,
+and a header line starting with '#'. Full FPR files and projected subsets can both be
+read with read_provenance_rows().
+"""
+
+import csv
+import io
+import itertools
+import sys
+
+import djerba.util.constants as constants
+import djerba.util.provenance_index as index
+from djerba.util.decompression import decompressor
+from djerba.util.provenance_filter import provenance_filter
+
+# column indices of the fields kept, in projected file order
+PROJECTED_COLUMNS = [
+    index.LAST_MODIFIED,
+    index.STUDY_TITLE,
+    index.ROOT_SAMPLE_NAME,
+    index.PARENT_SAMPLE_ATTRIBUTES,
+    index.SAMPLE_NAME,
+    index.SEQUENCER_RUN_PLATFORM_ID,
+    index.WORKFLOW_NAME,
+    index.FILE_META_TYPE,
+    index.FILE_PATH
+]
+PROJECTED_HEADER = [
+    '#LAST_MODIFIED',
+    'STUDY_TITLE',
+    'ROOT_SAMPLE_NAME',
+    'PARENT_SAMPLE_ATTRIBUTES',
+    'SAMPLE_NAME',
+    'SEQUENCER_RUN_PLATFORM_ID',
+    'WORKFLOW_NAME',
+    'FILE_META_TYPE',
+    'FILE_PATH'
+]
+# fields with few distinct values, which are interned
+INTERNED_COLUMNS = [
+    index.STUDY_TITLE,
+    index.ROOT_SAMPLE_NAME,
+    index.PARENT_SAMPLE_ATTRIBUTES,
+    index.SAMPLE_NAME,
+    index.SEQUENCER_RUN_PLATFORM_ID,
+    index.WORKFLOW_NAME,
+    index.FILE_META_TYPE
+]
+
+
+class provenance_row:
+
+    __slots__ = [
+        'last_modified',
+        'study_title',
+        'root_sample_name',
+        'parent_sample_attributes',
+        'sample_name',
+        'sequencer_run_platform_id',
+        'workflow_name',
+        'file_meta_type',
+        'file_path'
+    ]
+    # full column index -> slot name
+    SLOTS = dict(zip(PROJECTED_COLUMNS, __slots__))
+    # (slot name, interned) for each projected column
+    FIELDS = [(x, y in INTERNED_COLUMNS) for (x, y) in zip(__slots__, PROJECTED_COLUMNS)]
+
+    def __init__(self, values):
+        """Input is a list of values in projected column order"""
+        if len(values) != len(self.__slots__):
+            msg = "Expected {0} projected provenance values, found {1}: {2}".format(
+                len(self.__slots__), len(values), values
+            )
+            raise ProvenanceRowError(msg)
+        for ((name, interned), value) in zip(self.FIELDS, values):
+            setattr(self, name, sys.intern(value) if interned else value)
+
+    @classmethod
+    def from_full_row(cls, row):
+        """Project a full FPR row, ie. a list of values indexed by provenance_index"""
+        return cls([row[x] for x in PROJECTED_COLUMNS])
+
+    def __getitem__(self, column):
+        try:
+            name = self.SLOTS[column]
+        except KeyError:
+            msg = "Column {0} is not kept in a projected provenance row".format(column)
+            raise ProvenanceRowError(msg) from None
+        return getattr(self, name)
+
+    def __eq__(self, other):
+        return isinstance(other, provenance_row) and self.to_list() == other.to_list()
+
+    def __hash__(self):
+        return hash(tuple(self.to_list()))
+
+    def __repr__(self):
+        return "provenance_row({0})".format(self.to_list())
+
+    def to_list(self):
+        """Values in projected column order, eg. for output with csv.writer"""
+        return [getattr(self, x) for x in self.__slots__]
+
+
+def is_projected_header(row):
+    return len(row) > 0 and row[0].startswith('#')
+
+
+def read_provenance_rows(in_file, study=None, donor=None):
+    """
+    Read full or projected provenance rows from a TSV file handle
+    If study and donor are given, only rows which match them are projected and returned
+    Yields provenance_row objects
+    """
+    reader = csv.reader(in_file, delimiter="\t")
+    first = next(reader, None)
+    if first == None:
+        return
+    elif is_projected_header(first):
+        if first != PROJECTED_HEADER:
+            msg = "Unexpected header for projected provenance: {0}".format(first)
+            raise ProvenanceRowError(msg)
+        study_col = PROJECTED_COLUMNS.index(index.STUDY_TITLE)
+        donor_col = PROJECTED_COLUMNS.index(index.ROOT_SAMPLE_NAME)
+        for row in reader:
+            if study == None or (row[study_col] == study and row[donor_col] == donor):
+                yield provenance_row(row)
+    else:
+        for row in itertools.chain([first], reader):
+            if study == None or (row[index.STUDY_TITLE] == study and \
+                                 row[index.ROOT_SAMPLE_NAME] == donor):
+                yield provenance_row.from_full_row(row)
+
+
+def read_provenance_file(path, study=None, donor=None, reader=None):
+    """
+    Read full or projected provenance rows from a gzipped TSV file
+    reader is a djerba.util.decompression.decompressor; if None, use the default backend
+    Rows of a full FPR for a given study and donor are found with provenance_filter
+    """
+    if reader == None:
+        reader = decompressor()
+    with reader.open_binary(path) as in_file:
+        if study == None or in_file.peek(1)[0:1] == b'#':
+            text = io.TextIOWrapper(in_file, encoding=constants.TEXT_ENCODING, newline='')
+            yield from read_provenance_rows(text, study, donor)
+            text.detach()
+        else:
+            for row in provenance_filter([(study, donor)]).filter_rows(in_file):
+                yield provenance_row.from_full_row(row)
+
+
+def write_projected_header(writer):
+    """Write the projected file header with a csv.writer"""
+    writer.writerow(PROJECTED_HEADER)
+
+
+class ProvenanceRowError(Exception):
+    pass
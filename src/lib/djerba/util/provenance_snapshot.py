@@ -0,0 +1,167 @@
+"""
+Indexed snapshot of the file provenance report (FPR)
+
+Building the snapshot writes two sidecar files for a given FPR:
+- A BGZF-compressed copy of the FPR; still a valid gzip file
+- A JSON index of (STUDY_TITLE, ROOT_SAMPLE_NAME) -> BGZF block offsets
+
+While the snapshot is current -- ie. the FPR has not changed since the snapshot was
+built -- rows for a given study and donor can be read by decompressing only the
+blocks which contain them, instead of parsing the entire FPR.
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+
+import djerba.util.constants as constants
+import djerba.util.provenance_index as index
+from djerba.util.bgzf import bgzf_reader, bgzf_writer
+from djerba.util.decompression import decompressor, AUTO
+from djerba.util.logger import logger
+from djerba.util.provenance_filter import provenance_filter
+
+class provenance_snapshot(logger):
+
+    BGZF_SUFFIX = '.djerba.bgz'
+    INDEX_SUFFIX = '.djerba_index.json'
+    INDEX_VERSION = 1
+
+    # keys for the index JSON
+    VERSION = 'version'
+    SOURCE = 'source'
+    PATH = 'path'
+    SIZE = 'size'
+    MTIME = 'mtime_ns'
+    TOTAL_ROWS = 'total_rows'
+    BLOCKS = 'blocks'
+
+    def __init__(self, provenance_path, index_dir=None,
+                 log_level=logging.WARNING, log_path=None):
+        self.log_level = log_level
+        self.log_path = log_path
+        self.logger = self.get_logger(log_level, __name__, log_path)
+        self.provenance_path = os.path.abspath(provenance_path)
+        if index_dir == None:
+            index_dir = os.path.dirname(self.provenance_path)
+        name = os.path.basename(self.provenance_path)
+        self.bgzf_path = os.path.join(index_dir, name+self.BGZF_SUFFIX)
+        self.index_path = os.path.join(index_dir, name+self.INDEX_SUFFIX)
+        self.index = None
+
+    @staticmethod
+    def make_key(study, donor):
+        return "{0}\t{1}".format(study, donor)
+
+    def _get_source_info(self):
+        stat = os.stat(self.provenance_path)
+        source = {
+            self.PATH: self.provenance_path,
+            self.SIZE: stat.st_size,
+            self.MTIME: stat.st_mtime_ns
+        }
+        return source
+
+    def _read_index(self):
+        if self.index == None:
+            with open(self.index_path) as index_file:
+                self.index = json.loads(index_file.read())
+        return self.index
+
+    def build(self, decompression=AUTO, threads=0):
+        """
+        Recompress the FPR as BGZF and write the block offset index
+        Outputs are written to temporary files and then renamed, so a concurrent
+        reader sees either the previous snapshot or the new one
+        decompression and threads set the backend to read the FPR; see djerba.util.decompression
+        """
+        self.logger.info("Building provenance snapshot for {0}".format(self.provenance_path))
+        source = self._get_source_info()
+        bgzf_tmp = self.bgzf_path+'.tmp.{0}'.format(os.getpid())
+        index_tmp = self.index_path+'.tmp.{0}'.format(os.getpid())
+        blocks = {}
+        total = 0
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter="\t", lineterminator="\n")
+        reader = decompressor(decompression, threads, self.log_level, self.log_path)
+        with reader.open_text(self.provenance_path) as in_file, \
+             bgzf_writer(bgzf_tmp) as out_file:
+            for row in csv.reader(in_file, delimiter="\t"):
+                total += 1
+                if total % 1000000 == 0:
+                    self.logger.debug("Indexed {0} input rows".format(total))
+                writer.writerow(row)
+                record = buffer.getvalue().encode(constants.TEXT_ENCODING)
+                buffer.seek(0)
+                buffer.truncate(0)
+                offsets = out_file.write_record(record)
+                key = self.make_key(row[index.STUDY_TITLE], row[index.ROOT_SAMPLE_NAME])
+                key_blocks = blocks.setdefault(key, [])
+                for offset in offsets:
+                    # rows are written in order, so offsets are non-decreasing
+                    if len(key_blocks)==0 or key_blocks[-1] != offset:
+                        key_blocks.append(offset)
+        index_data = {
+            self.VERSION: self.INDEX_VERSION,
+            self.SOURCE: source,
+            self.TOTAL_ROWS: total,
+            self.BLOCKS: blocks
+        }
+        with open(index_tmp, 'w') as index_file:
+            index_file.write(json.dumps(index_data))
+        if source != self._get_source_info():
+            os.remove(bgzf_tmp)
+            os.remove(index_tmp)
+            msg = "File provenance {0} changed ".format(self.provenance_path)+\
+                "while building snapshot; snapshot not written"
+            self.logger.error(msg)
+            raise ProvenanceSnapshotError(msg)
+        os.replace(bgzf_tmp, self.bgzf_path)
+        os.replace(index_tmp, self.index_path)
+        self.index = index_data
+        msg = "Wrote provenance snapshot for {0} rows and {1} ".format(total, len(blocks))+\
+            "study/donor pairs to {0}".format(self.index_path)
+        self.logger.info(msg)
+        return self.index_path
+
+    def is_current(self):
+        """
+        Check if the snapshot exists and matches the current FPR
+        FPR path, size and modification time must all be unchanged
+        """
+        if not (os.path.isfile(self.index_path) and os.path.isfile(self.bgzf_path)):
+            self.logger.debug("No provenance snapshot found at {0}".format(self.index_path))
+            return False
+        try:
+            if os.path.getmtime(self.index_path) < os.path.getmtime(self.provenance_path):
+                self.logger.debug("Provenance snapshot is older than the FPR")
+                return False
+            data = self._read_index()
+        except (OSError, ValueError) as err:
+            self.logger.warning("Cannot read provenance snapshot index: {0}".format(err))
+            return False
+        if data.get(self.VERSION) != self.INDEX_VERSION:
+            self.logger.debug("Provenance snapshot index has an unsupported version")
+            current = False
+        elif data.get(self.SOURCE) != self._get_source_info():
+            self.logger.debug("Provenance snapshot does not match the current FPR")
+            current = False
+        else:
+            current = True
+        return current
+
+    def read_rows(self, study, donor):
+        """Yield FPR rows for the given study and donor, reading only the indexed blocks"""
+        offsets = self._read_index()[self.BLOCKS].get(self.make_key(study, donor), [])
+        self.logger.debug("Reading {0} snapshot blocks for {1}/{2}".format(len(offsets), study, donor))
+        row_filter = provenance_filter([(study, donor)])
+        with bgzf_reader(self.bgzf_path) as reader:
+            for data in reader.read_blocks(offsets):
+                # blocks may also contain rows for other donors
+                yield from row_filter.filter_rows(io.BytesIO(data))
+
+
+class ProvenanceSnapshotError(Exception):
+    pass
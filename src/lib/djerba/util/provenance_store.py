@@ -0,0 +1,224 @@
+"""
+SQLite store of the file provenance report (FPR), for indexed queries
+
+Loading the store reads the FPR once, and writes the columns used by Djerba (as in
+djerba.util.provenance_row) to a local SQLite database, with indexes on:
+- (STUDY_TITLE, ROOT_SAMPLE_NAME), for reports on a given study and donor
+- (SAMPLE_NAME, WORKFLOW_NAME), for lookup of workflow outputs
+- LAST_MODIFIED, eg. to find recent outputs
+
+The store need only be loaded when the FPR is refreshed; until then, any number of
+reports and other lookups can query it, with no server process. The database is
+written to a temporary file and renamed when complete, so a concurrent reader sees
+either the previous store or the new one.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+
+from djerba.util.decompression import decompressor, AUTO
+from djerba.util.locking import file_lock, temporary_path
+from djerba.util.logger import logger
+from djerba.util.provenance_row import provenance_row, read_provenance_file
+
+class provenance_store(logger):
+
+    STORE_SUFFIX = '.djerba.sqlite'
+    STORE_VERSION = 1
+    BATCH_SIZE = 10000
+    TABLE = 'provenance'
+    SOURCE_TABLE = 'source'
+    # columns of the provenance table, in projected column order
+    COLUMNS = provenance_row.__slots__
+    INDEXES = {
+        'provenance_study_donor': ['study_title', 'root_sample_name'],
+        'provenance_sample_workflow': ['sample_name', 'workflow_name'],
+        'provenance_last_modified': ['last_modified']
+    }
+
+    # keys for the source table
+    VERSION = 'version'
+    PATH = 'path'
+    SIZE = 'size'
+    MTIME = 'mtime_ns'
+    TOTAL_ROWS = 'total_rows'
+    LOADED = 'loaded'
+
+    def __init__(self, store_path, log_level=logging.WARNING, log_path=None):
+        self.log_level = log_level
+        self.log_path = log_path
+        self.logger = self.get_logger(log_level, __name__, log_path)
+        self.store_path = os.path.abspath(store_path)
+
+    @classmethod
+    def get_default_path(cls, provenance_path, index_dir=None):
+        """Default store path for an FPR, in the index directory as for a snapshot"""
+        provenance_path = os.path.abspath(provenance_path)
+        if index_dir == None:
+            index_dir = os.path.dirname(provenance_path)
+        return os.path.join(index_dir, os.path.basename(provenance_path)+cls.STORE_SUFFIX)
+
+    def _connect(self):
+        if not os.path.isfile(self.store_path):
+            msg = "Provenance store {0} does not exist".format(self.store_path)
+            self.logger.error(msg)
+            raise ProvenanceStoreError(msg)
+        uri = 'file:{0}?mode=ro'.format(self.store_path)
+        return sqlite3.connect(uri, uri=True)
+
+    def _get_source_info(self, provenance_path):
+        provenance_path = os.path.abspath(provenance_path)
+        stat = os.stat(provenance_path)
+        source = {
+            self.PATH: provenance_path,
+            self.SIZE: stat.st_size,
+            self.MTIME: stat.st_mtime_ns
+        }
+        return source
+
+    def _query_rows(self, where, params):
+        columns = ', '.join(self.COLUMNS)
+        sql = 'SELECT {0} FROM {1}'.format(columns, self.TABLE)
+        if where:
+            sql = sql + ' WHERE ' + ' AND '.join(where)
+        sql = sql + ' ORDER BY rowid'
+        connection = self._connect()
+        try:
+            for values in connection.execute(sql, params):
+                yield provenance_row(list(values))
+        finally:
+            connection.close()
+
+    def get_source(self):
+        """Get source information for the store, as a dictionary"""
+        connection = self._connect()
+        try:
+            sql = 'SELECT key, value FROM {0}'.format(self.SOURCE_TABLE)
+            source = {key: value for (key, value) in connection.execute(sql)}
+        except sqlite3.DatabaseError as err:
+            msg = "Cannot read source of provenance store {0}: {1}".format(self.store_path, err)
+            self.logger.error(msg)
+            raise ProvenanceStoreError(msg) from err
+        finally:
+            connection.close()
+        for key in [self.VERSION, self.SIZE, self.MTIME, self.TOTAL_ROWS]:
+            if key in source:
+                source[key] = int(source[key])
+        return source
+
+    def is_current(self, provenance_path):
+        """
+        Check if the store exists and matches the current FPR
+        FPR path, size and modification time must all be unchanged
+        """
+        if not os.path.isfile(self.store_path):
+            self.logger.debug("No provenance store found at {0}".format(self.store_path))
+            return False
+        try:
+            source = self.get_source()
+        except ProvenanceStoreError:
+            return False
+        expected = self._get_source_info(provenance_path)
+        if source.get(self.VERSION) != self.STORE_VERSION:
+            self.logger.debug("Provenance store has an unsupported version")
+            current = False
+        elif any([source.get(x) != expected[x] for x in expected.keys()]):
+            self.logger.debug("Provenance store does not match the current FPR")
+            current = False
+        else:
+            current = True
+        return current
+
+    def load(self, provenance_path, decompression=AUTO, threads=0):
+        """
+        Load the FPR into a new store, replacing any existing store
+        Input may be a full FPR or a projected subset
+        decompression and threads set the backend to read the FPR; see djerba.util.decompression
+        """
+        self.logger.info("Loading provenance store {0} from {1}".format(self.store_path, provenance_path))
+        source = self._get_source_info(provenance_path)
+        reader = decompressor(decompression, threads, self.log_level, self.log_path)
+        tmp_path = temporary_path(self.store_path)
+        placeholders = ', '.join(['?']*len(self.COLUMNS))
+        insert = 'INSERT INTO {0} VALUES ({1})'.format(self.TABLE, placeholders)
+        total = 0
+        start = time.time()
+        with file_lock(self.store_path):
+            connection = sqlite3.connect(tmp_path)
+            try:
+                # the temporary database is discarded if loading fails, so no journal is needed
+                connection.execute('PRAGMA journal_mode = OFF')
+                connection.execute('PRAGMA synchronous = OFF')
+                columns = ', '.join(['{0} TEXT'.format(x) for x in self.COLUMNS])
+                connection.execute('CREATE TABLE {0} ({1})'.format(self.TABLE, columns))
+                sql = 'CREATE TABLE {0} (key TEXT PRIMARY KEY, value TEXT)'
+                connection.execute(sql.format(self.SOURCE_TABLE))
+                batch = []
+                for row in read_provenance_file(provenance_path, reader=reader):
+                    batch.append(row.to_list())
+                    if len(batch) == self.BATCH_SIZE:
+                        connection.executemany(insert, batch)
+                        total += len(batch)
+                        batch = []
+                        if total % 1000000 == 0:
+                            self.logger.debug("Loaded {0} rows".format(total))
+                connection.executemany(insert, batch)
+                total += len(batch)
+                for name, columns in self.INDEXES.items():
+                    sql = 'CREATE INDEX {0} ON {1} ({2})'.format(name, self.TABLE, ', '.join(columns))
+                    connection.execute(sql)
+                source[self.VERSION] = self.STORE_VERSION
+                source[self.TOTAL_ROWS] = total
+                source[self.LOADED] = time.strftime('%Y-%m-%d_%H:%M:%S')
+                sql = 'INSERT INTO {0} VALUES (?, ?)'.format(self.SOURCE_TABLE)
+                connection.executemany(sql, [(x, str(y)) for (x, y) in source.items()])
+                connection.commit()
+                connection.close()
+                if self._get_source_info(provenance_path) != \
+                   {x: source[x] for x in [self.PATH, self.SIZE, self.MTIME]}:
+                    msg = "File provenance {0} changed ".format(provenance_path)+\
+                        "while loading store; store not written"
+                    self.logger.error(msg)
+                    raise ProvenanceStoreError(msg)
+                os.replace(tmp_path, self.store_path)
+            finally:
+                connection.close()
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        msg = "Loaded {0} rows into provenance store {1} in {2:.1f}s".format(
+            total, self.store_path, time.time()-start
+        )
+        self.logger.info(msg)
+        return self.store_path
+
+    def query(self, study=None, donor=None, sample=None, workflow=None, modified_since=None):
+        """
+        Yield provenance_row objects matching all the given arguments, in FPR order
+        modified_since is a LAST_MODIFIED string, eg. '2024-01-01'; rows modified at or
+        after this time are returned
+        """
+        where = []
+        params = []
+        for (column, value) in [
+                ('study_title', study),
+                ('root_sample_name', donor),
+                ('sample_name', sample),
+                ('workflow_name', workflow)
+        ]:
+            if value != None:
+                where.append('{0} = ?'.format(column))
+                params.append(value)
+        if modified_since != None:
+            where.append('last_modified >= ?')
+            params.append(modified_since)
+        yield from self._query_rows(where, params)
+
+    def read_rows(self, study, donor):
+        """Yield provenance_row objects for the given study and donor"""
+        yield from self.query(study=study, donor=donor)
+
+
+class ProvenanceStoreError(Exception):
+    pass
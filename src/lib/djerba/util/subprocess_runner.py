@@ -1,8 +1,10 @@
 """Base class with method to run a subprocess"""
 
+import io
 import logging
 import subprocess
 from collections.abc import Iterable
+from contextlib import contextmanager
 from djerba.util.logger import logger
 import djerba.util.constants as constants
 
@@ -56,3 +58,44 @@ class subprocess_runner(logger):
         self.logger.debug("{0} STDOUT: '{1}'".format(description, stdout))
         self.logger.debug("{0} STDERR: '{1}'".format(description, stderr))
         return result
+
+    @contextmanager
+    def open_stdout(self, command, description='subprocess', binary=False):
+        """
+        Run a command and yield its STDOUT as a text stream, or a binary stream if
+        binary=True; eg. to read large outputs without holding them in memory.
+        STDERR is logged, and the return code checked, when the stream is closed.
+        If the stream is closed before the end of output, the process is terminated.
+        """
+        if isinstance(command, str) or not isinstance(command, Iterable):
+            msg = "Command must be a non-string iterable: Received {0}".format(command)
+            self.logger.error(msg)
+            raise ValueError(msg)
+        self.logger.info("Running {0}: '{1}'".format(description, ' '.join(command)))
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if binary:
+            stdout = process.stdout
+        else:
+            stdout = io.TextIOWrapper(process.stdout, encoding=constants.TEXT_ENCODING, newline='')
+        complete = False
+        try:
+            yield stdout
+            # check if all output was read
+            complete = len(stdout.read(1)) == 0
+        finally:
+            if not complete:
+                process.kill()
+            stdout.close()
+            stderr = process.stderr.read().decode(constants.TEXT_ENCODING)
+            process.stderr.close()
+            returncode = process.wait()
+        self.logger.debug("{0} STDERR: '{1}'".format(description, stderr))
+        if not complete:
+            self.logger.debug("Stopped {0} before end of output".format(description))
+        elif returncode != 0:
+            msg = "Failed to run {0}: return code {1}".format(description, returncode)
+            self.logger.error(msg)
+            self.logger.error("{0} STDERR: '{1}'".format(description, stderr))
+            raise subprocess.CalledProcessError(returncode, command, stderr=stderr)
+        else:
+            self.logger.info("Successfully ran {0}".format(description))
@@ -0,0 +1,175 @@
+"""
+Generate a synthetic file provenance report (FPR), for testing and benchmarking
+
+Rows have the full set of FPR columns, with realistic study, donor, sample, workflow,
+metatype and file path values, so the reader and helper can find outputs for any donor.
+Output is reproducible for a given random seed.
+"""
+
+import csv
+import gzip
+import io
+import logging
+import random
+
+import djerba.util.constants as constants
+import djerba.util.provenance_index as index
+from djerba.util.bgzf import bgzf_writer
+from djerba.util.logger import logger
+from djerba.util.provenance_reader import provenance_reader
+
+class provenance_generator(logger):
+
+    TOTAL_COLUMNS = index.LIMS_LAST_MODIFIED + 1
+    # sample name suffix, library template type, tissue type, tissue origin
+    SAMPLES = [
+        ['Ly_R_PE_500_WG', 'WG', 'R', 'Ly'],
+        ['Pa_P_PE_500_WG', 'WG', 'P', 'Pa'],
+        ['Pa_P_PE_300_WT', 'WT', 'P', 'Pa']
+    ]
+    # workflow, metatype, library template type, file suffix
+    OUTPUTS = [
+        [provenance_reader.WF_BMPP, 'application/bam', 'WG',
+         '.filter.deduped.realigned.recalibrated.bam'],
+        [provenance_reader.WF_BMPP, 'application/bam-index', 'WG',
+         '.filter.deduped.realigned.recalibrated.bai'],
+        [provenance_reader.WF_DELLY, 'application/vcf-gz', 'WG',
+         '.somatic_filtered.delly.merged.vcf.gz'],
+        [provenance_reader.WF_MUTECT, 'application/vcf-gz', 'WG', '.mutect2.filtered.vcf.gz'],
+        [provenance_reader.WF_VEP, 'application/txt-gz', 'WG', '.mutect2.filtered.maf.gz'],
+        [provenance_reader.WF_SEQUENZA, 'application/zip-report-bundle', 'WG', '_results.zip'],
+        [provenance_reader.WF_PURPLE, 'application/zip-report-bundle', 'WG', '.purple.zip'],
+        [provenance_reader.WF_MSISENSOR, 'application/octet-stream', 'WG',
+         '.recalibrated.msi.booted'],
+        [provenance_reader.WF_VIRUS, 'application/octet-stream', 'WG',
+         '.virusbreakend.vcf.summary.tsv'],
+        [provenance_reader.WF_ARRIBA, 'application/octet-stream', 'WT', '.fusions.tsv'],
+        [provenance_reader.WF_RSEM, 'application/octet-stream', 'WT', '.genes.results'],
+        [provenance_reader.WF_STAR, 'application/bam', 'WT', '.Aligned.sortedByCoord.out.bam'],
+        [provenance_reader.WF_STAR, 'application/bam-index', 'WT',
+         '.Aligned.sortedByCoord.out.bai'],
+        [provenance_reader.WF_STARFUSION, 'application/octet-stream', 'WT',
+         '.star-fusion.fusion_predictions.tsv'],
+        [provenance_reader.WF_MAVIS, 'application/octet-stream', 'WT', '.mavis_summary.tab'],
+        # outputs which Djerba does not use
+        ['fastQC', 'text/html', 'WG', '_fastqc.html'],
+        ['bcl2fastq', 'chemical/seq-na-fastq-gzip', 'WG', '_R1.fastq.gz'],
+        ['bcl2fastq', 'chemical/seq-na-fastq-gzip', 'WT', '_R1.fastq.gz']
+    ]
+    # outputs which are not written by default, but may be selected by workflow name
+    EXTRA_OUTPUTS = [
+        [provenance_reader.WF_GRIDSS, 'text/vcf', 'WG', '.allocated.vcf'],
+        [provenance_reader.WF_HRDETECT, 'text/json', 'WG', '.signatures.json'],
+        [provenance_reader.WF_MRDETECT, 'text/plain', 'WG', '.SNP.count.txt'],
+        [provenance_reader.WF_IMMUNE, 'application/octet-stream', 'WT',
+         '.immunedeconv_CIBERSORT-Percentiles.csv']
+    ]
+    STUDIES = ['PASS01', 'REVOLVE', 'TGL01', 'CHARM', 'MATS']
+    # number of runs of each workflow, eg. after a failed QC; the most recent run is used
+    DEFAULT_RERUNS = 4
+
+    def __init__(self, seed=42, log_level=logging.WARNING, log_path=None):
+        self.logger = self.get_logger(log_level, __name__, log_path)
+        self.seed = seed
+
+    def donor_name(self, i):
+        return 'DONOR_{0:06d}'.format(i)
+
+    def sample_name(self, donor, sample_suffix):
+        return '{0}_{1}'.format(donor, sample_suffix)
+
+    def study_names(self, total):
+        """Default study names, followed by generic names if more are needed"""
+        names = self.STUDIES[:total]
+        names.extend(['STUDY{0:03d}'.format(i) for i in range(len(names), total)])
+        return names
+
+    def get_outputs(self, workflows=None):
+        """Outputs for the given workflow names; if None, the default outputs"""
+        if workflows == None:
+            outputs = self.OUTPUTS
+        else:
+            outputs = [x for x in self.OUTPUTS+self.EXTRA_OUTPUTS if x[0] in workflows]
+            unknown = set(workflows).difference([x[0] for x in outputs])
+            if len(unknown) > 0:
+                msg = "Unknown workflow names for synthetic FPR: {0}".format(sorted(unknown))
+                self.logger.error(msg)
+                raise ValueError(msg)
+        return outputs
+
+    def generate_rows(self, total_rows, donors=None, studies=None, workflows=None,
+                      reruns=DEFAULT_RERUNS):
+        """
+        Yield total_rows FPR rows, as lists of strings
+        Donors are assigned in contiguous runs of rows, as in the real FPR; default
+        number of donors is one for every 100 rows
+        studies is the number of studies, default len(STUDIES); donors are assigned to
+        studies in rotation
+        workflows is a list of workflow names to write, default those in OUTPUTS
+        reruns is the number of runs of each workflow, with different modification times
+        """
+        rand = random.Random(self.seed)
+        if donors == None:
+            donors = max(1, total_rows // 100)
+        study_names = self.study_names(len(self.STUDIES) if studies == None else studies)
+        outputs = self.get_outputs(workflows)
+        rows_per_donor = max(1, total_rows // donors)
+        column_suffixes = ['_{0}'.format(j) for j in range(self.TOTAL_COLUMNS)]
+        for i in range(total_rows):
+            donor_number = min(i // rows_per_donor, donors - 1)
+            donor = self.donor_name(donor_number)
+            study = study_names[donor_number % len(study_names)]
+            [workflow, metatype, template, suffix] = rand.choice(outputs)
+            samples = [x for x in self.SAMPLES if x[1] == template]
+            [sample_suffix, template, tissue_type, tissue_origin] = rand.choice(samples)
+            sample = self.sample_name(donor, sample_suffix)
+            attributes = ';'.join([
+                'geo_external_name=EX_{0}'.format(donor),
+                'geo_library_source_template_type={0}'.format(template),
+                'geo_tissue_origin={0}'.format(tissue_origin),
+                'geo_tissue_type={0}'.format(tissue_type),
+                'geo_tube_id={0}_{1}_{2}'.format(donor, tissue_origin, tissue_type)
+            ])
+            run = rand.randint(0, reruns - 1)
+            # unused columns have a random token, for rows of about 2 kB as in the real FPR
+            token = '{0:032x}'.format(rand.getrandbits(128))
+            row = [token+x for x in column_suffixes]
+            # later runs have later modification times, one month apart
+            row[index.LAST_MODIFIED] = '{0}-{1:02d}-{2:02d} 12:00:00'.format(
+                2024 + run // 12, run % 12 + 1, rand.randint(1, 28)
+            )
+            row[index.STUDY_TITLE] = study
+            row[index.ROOT_SAMPLE_NAME] = donor
+            row[index.PARENT_SAMPLE_ATTRIBUTES] = attributes
+            row[index.SAMPLE_NAME] = sample
+            row[index.SEQUENCER_RUN_PLATFORM_ID] = 'Illumina_NovaSeq'
+            row[index.WORKFLOW_NAME] = workflow
+            row[index.FILE_META_TYPE] = metatype
+            row[index.FILE_PATH] = '/results/{0}/run{1}/{2}/{3}{4}'.format(
+                workflow, run, i, sample, suffix
+            )
+            yield row
+
+    def write(self, out_path, total_rows, donors=None, bgzf=False, studies=None,
+              workflows=None, reruns=DEFAULT_RERUNS):
+        """
+        Write a gzipped FPR; if bgzf is True, use BGZF compression
+        Other arguments are as for generate_rows()
+        """
+        self.logger.info("Writing {0} synthetic FPR rows to {1}".format(total_rows, out_path))
+        rows = self.generate_rows(total_rows, donors, studies, workflows, reruns)
+        if bgzf:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, delimiter="\t", lineterminator="\n")
+            with bgzf_writer(out_path) as out_file:
+                for row in rows:
+                    writer.writerow(row)
+                    out_file.write_record(buffer.getvalue().encode(constants.TEXT_ENCODING))
+                    buffer.seek(0)
+                    buffer.truncate(0)
+        else:
+            with gzip.open(out_path, 'wt', compresslevel=6, encoding=constants.TEXT_ENCODING) as out_file:
+                writer = csv.writer(out_file, delimiter="\t", lineterminator="\n")
+                for row in rows:
+                    writer.writerow(row)
+        return out_path
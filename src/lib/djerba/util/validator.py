@@ -3,6 +3,8 @@
 import logging
 import os
 import re
+import stat
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 import djerba.util.ini_fields as ini
 from djerba.util.logger import logger
@@ -130,6 +132,13 @@ class path_validator(logger):
 
     """Check that inputs are valid; if not, raise an error"""
 
+    # default number of threads for bulk checks of input files
+    BULK_THREADS = 16
+    # keys for results of stat_input_file
+    SIZE = 'size'
+    MTIME = 'mtime'
+    ERROR = 'error'
+
     def __init__(self, log_level=logging.WARNING, log_path=None):
         self.logger = self.get_logger(log_level, __name__, log_path)
 
@@ -157,9 +166,14 @@ class path_validator(logger):
             error = None
         return self._process_error_message(error)
     
-    def validate_input_file(self, path):
-        """Confirm an input file exists and is readable"""
-        if not path:
+    def validate_input_file(self, path, stats=None):
+        """
+        Confirm an input file exists and is readable
+        If stats is given, eg. from stat_input_files(), a path recorded there is not checked again
+        """
+        if stats and isinstance(path, str) and path in stats:
+            error = stats[path].get(self.ERROR)
+        elif not path:
             error = "Input path '%s' is not a valid path value" % path
         elif not os.path.exists(path):
             error = "Input path %s does not exist" % path
@@ -170,7 +184,46 @@ class path_validator(logger):
         else:
             error = None
         return self._process_error_message(error)
-        
+
+    def stat_input_file(self, path):
+        """
+        Check an input file with a single stat call
+        Returns a dictionary with size and mtime if the file is valid, or an error otherwise
+        """
+        if not path:
+            return {self.ERROR: "Input path '%s' is not a valid path value" % path}
+        try:
+            status = os.stat(path)
+        except FileNotFoundError:
+            return {self.ERROR: "Input path %s does not exist" % path}
+        except OSError as err:
+            return {self.ERROR: "Cannot stat input path %s: %s" % (path, err)}
+        if not stat.S_ISREG(status.st_mode):
+            error = "Input path %s is not a file" % path
+        elif not os.access(path, os.R_OK):
+            error = "Input path %s is not readable" % path
+        else:
+            error = None
+        if error:
+            result = {self.ERROR: error}
+        else:
+            result = {self.SIZE: status.st_size, self.MTIME: status.st_mtime}
+        return result
+
+    def stat_input_files(self, paths, threads=BULK_THREADS):
+        """
+        Check input files concurrently, eg. on a networked filesystem where each stat is slow
+        Returns a dictionary: path -> output of stat_input_file
+        """
+        paths = list(dict.fromkeys(paths))
+        if len(paths) == 0:
+            return {}
+        workers = max(1, min(threads, len(paths)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(self.stat_input_file, paths))
+        self.logger.debug("Checked {0} input paths with {1} threads".format(len(paths), workers))
+        return dict(zip(paths, results))
+
     def validate_output_dir(self, path):
         """Confirm an output directory exists and is writable"""
         if not path:
@@ -0,0 +1,838 @@
+#! /usr/bin/env python3
+
+"""Tests for the OncoKB annotation cache"""
+
+import csv
+import gzip
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import stat
+import subprocess
+import threading
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import djerba.util.constants as constants
+import djerba.util.oncokb.constants as oncokb_constants
+import djerba.util.oncokb.metrics as metrics
+from djerba.util.oncokb.annotator import oncokb_annotator
+from djerba.util.oncokb.benchmark import oncokb_cache_benchmark
+from djerba.util.oncokb.cache import oncokb_cache, oncokb_cache_params
+from djerba.util.oncokb.client import oncokb_client
+from djerba.util.testing.tools import TestBase
+
+
+def write_fusion_cache(cache_dir, annotated_fusion):
+    """Update the cache in a separate process"""
+    oncokb_cache(cache_dir, log_level=logging.ERROR).write_fusion_cache(annotated_fusion)
+
+
+class stub_oncokb_handler(BaseHTTPRequestHandler):
+    """Stub of the OncoKB batch annotation API; records requests on the server"""
+
+    # persistent connections, as for the OncoKB API
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        output = json.dumps({'dataVersion': {'version': 'v4.20', 'date': '10152024'}})
+        output = output.encode(constants.TEXT_ENCODING)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        queries = json.loads(body)
+        self.server.requests.append({
+            'path': self.path,
+            'authorization': self.headers['Authorization'],
+            'port': self.client_address[1],
+            'queries': queries
+        })
+        if self.server.status == 200:
+            output = json.dumps([self.server.annotation for x in queries])
+        else:
+            output = json.dumps({'title': 'Stub error'})
+        output = output.encode(constants.TEXT_ENCODING)
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OncokbTestBase(TestBase):
+
+    ONCOTREE_CODE = 'PAAD'
+    SAMPLE = 'TUMOUR_001'
+    MAF_COLUMNS = ['Hugo_Symbol', 'Chromosome', 'Start_Position', 'Reference_Allele',
+                   'Tumor_Seq_Allele2']
+    GENES = ['KRAS', 'TP53', 'CDKN2A', 'SMAD4', 'BRCA2', 'ATM']
+
+    ANNOTATION = {
+        'geneExist': True,
+        'variantExist': True,
+        'oncogenic': 'Oncogenic',
+        'mutationEffect': {
+            'knownEffect': 'Gain-of-function',
+            'citations': {'pmids': ['101', '102'], 'abstracts': []}
+        },
+        'treatments': [
+            {'level': 'LEVEL_1', 'drugs': [{'drugName': 'DrugA'}, {'drugName': 'DrugB'}], 'pmids': ['201']},
+            {'level': 'LEVEL_1', 'drugs': [{'drugName': 'DrugC'}], 'pmids': ['201', '202']},
+            {'level': 'LEVEL_R1', 'drugs': [{'drugName': 'DrugD'}], 'pmids': [],
+             'abstracts': [{'abstract': 'Abstract', 'link': 'http://example.com'}]}
+        ],
+        'highestSensitiveLevel': 'LEVEL_1',
+        'highestResistanceLevel': 'LEVEL_R1',
+        'diagnosticImplications': [
+            {'levelOfEvidence': 'LEVEL_Dx1', 'tumorType': {'name': 'Pancreatic Adenocarcinoma'},
+             'pmids': ['301']}
+        ],
+        'highestDiagnosticImplicationLevel': 'LEVEL_Dx1'
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.cache_base = os.path.join(self.tmp_dir, 'cache')
+        os.mkdir(self.cache_base)
+        self.info_path = self.write_tsv(
+            'oncokb_clinical_info.txt', [['SAMPLE_ID', 'ONCOTREE_CODE'], [self.SAMPLE, self.ONCOTREE_CODE]]
+        )
+
+    def start_stub_server(self):
+        """Start a stub OncoKB API server; return the base URL"""
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), stub_oncokb_handler)
+        self.server.requests = []
+        self.server.status = 200
+        self.server.annotation = self.ANNOTATION
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        return 'http://127.0.0.1:{0}/api/v1'.format(self.server.server_address[1])
+
+    def get_annotations(self, i, known=True):
+        annotations = ['v{0}_{1}'.format(i, j) for j in range(len(oncokb_cache.ANNOTATION_HEADERS))]
+        annotations[0] = 'True'
+        annotations[1] = 'True' if known else 'False'
+        return annotations
+
+    def maf_row(self, i):
+        return [self.GENES[i % len(self.GENES)], 'chr{0}'.format(i % 22 + 1), str(1000+i), 'A', 'T']
+
+    def read_tsv(self, path):
+        with open(path) as in_file:
+            return list(csv.reader(in_file, delimiter="\t"))
+
+    def write_tsv(self, name, rows):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as out_file:
+            for row in rows:
+                print("\t".join(row), file=out_file)
+        return path
+
+    def write_inputs(self, total):
+        """Write annotated and unannotated inputs; the annotated inputs have every other row"""
+        maf = [self.MAF_COLUMNS]
+        maf_annotated = [self.MAF_COLUMNS+oncokb_cache.ANNOTATION_HEADERS]
+        fusion = [['Tumor_Sample_Barcode', 'Fusion']]
+        fusion_annotated = [['Tumor_Sample_Barcode', 'Fusion']+oncokb_cache.ANNOTATION_HEADERS]
+        cna = [['Hugo_Symbol', self.SAMPLE]]
+        cna_annotated = [['SAMPLE_ID', 'CANCER_TYPE', 'HUGO_SYMBOL', 'ALTERATION']+\
+                         oncokb_cache.ANNOTATION_HEADERS]
+        for i in range(total):
+            fusion_id = '{0}-GENE{1}'.format(self.GENES[i % len(self.GENES)], i)
+            gene = 'GENE{0}'.format(i)
+            cna_value = '2' if i % 3 else '-2'
+            alteration = 'Amplification' if i % 3 else 'Deletion'
+            maf.append(self.maf_row(i))
+            fusion.append([self.SAMPLE, fusion_id])
+            if i % 2 == 0:
+                cna.append([gene, cna_value])
+                maf_annotated.append(self.maf_row(i)+self.get_annotations(i, known=i % 4 == 0))
+                fusion_annotated.append([self.SAMPLE, fusion_id]+self.get_annotations(i))
+                cna_annotated.append([self.SAMPLE, self.ONCOTREE_CODE, gene, alteration]+\
+                                     self.get_annotations(i))
+        paths = {
+            'maf': self.write_tsv('maf.tsv', maf),
+            'maf_annotated': self.write_tsv('maf_annotated.tsv', maf_annotated),
+            'fusion': self.write_tsv('fusion.tsv', fusion),
+            'fusion_annotated': self.write_tsv('fusion_annotated.tsv', fusion_annotated),
+            'cna': self.write_tsv('cna.tsv', cna),
+            'cna_annotated': self.write_tsv('cna_annotated.tsv', cna_annotated)
+        }
+        return paths
+
+    def write_cache(self, cache, paths):
+        cache.write_maf_cache(paths['maf_annotated'])
+        cache.write_fusion_cache(paths['fusion_annotated'])
+        cache.write_cna_cache(paths['cna_annotated'])
+
+    def annotate(self, cache, paths, name):
+        """Annotate all inputs from the cache; return the output rows"""
+        outputs = {}
+        for (cache_type, method) in [
+                ('maf', cache.annotate_maf),
+                ('fusion', cache.annotate_fusion)
+        ]:
+            out_path = os.path.join(self.tmp_dir, '{0}_{1}.tsv'.format(name, cache_type))
+            method(paths[cache_type], out_path)
+            outputs[cache_type] = self.read_tsv(out_path)
+        out_path = os.path.join(self.tmp_dir, '{0}_cna.tsv'.format(name))
+        cache.annotate_cna(paths['cna'], out_path, self.info_path)
+        outputs['cna'] = self.read_tsv(out_path)
+        return outputs
+
+
+class TestOncokbCache(OncokbTestBase):
+
+    def test_sqlite_backend(self):
+        paths = self.write_inputs(40)
+        json_cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR)
+        self.assertEqual(json_cache.backend, oncokb_constants.BACKEND_JSON)
+        self.write_cache(json_cache, paths)
+        expected = self.annotate(json_cache, paths, 'json')
+        # MAF rows with GENE_IN_ONCOKB=True are cached; others have default annotations
+        self.assertEqual(expected['maf'][1][5:], self.get_annotations(0))
+        self.assertEqual(expected['maf'][2][5:], oncokb_cache.DEFAULT_MAF_ANNOTATIONS)
+        self.assertEqual(expected['maf'][3][5:], oncokb_cache.DEFAULT_MAF_ANNOTATIONS)
+        self.assertEqual(expected['cna'][1], [self.SAMPLE, self.ONCOTREE_CODE, 'GENE0', 'Deletion']+\
+                         self.get_annotations(0))
+        # migrate, and check the store is used by default
+        sqlite_cache = oncokb_cache(
+            self.cache_base, self.ONCOTREE_CODE, logging.ERROR, backend=oncokb_constants.BACKEND_SQLITE
+        )
+        # header rows of fusion and CNA files are also cached
+        self.assertEqual(sqlite_cache.migrate(), 10+21+21)
+        sqlite_cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR)
+        self.assertEqual(sqlite_cache.backend, oncokb_constants.BACKEND_SQLITE)
+        self.assertEqual(self.annotate(sqlite_cache, paths, 'sqlite'), expected)
+        # writes to a new store are incremental upserts, with the same results
+        os.remove(sqlite_cache.store.path)
+        sqlite_cache = oncokb_cache(
+            self.cache_base, self.ONCOTREE_CODE, logging.ERROR, backend=oncokb_constants.BACKEND_SQLITE
+        )
+        self.write_cache(sqlite_cache, paths)
+        self.write_cache(sqlite_cache, paths)
+        self.assertEqual(sqlite_cache.store.count(oncokb_constants.MAF), 10)
+        self.assertEqual(self.annotate(sqlite_cache, paths, 'sqlite_upsert'), expected)
+        found = sqlite_cache.store.get(oncokb_constants.CNA, [('GENE0', 'Deletion'), ('GENE1', 'Deletion')])
+        self.assertEqual(list(found.keys()), [('GENE0', 'Deletion')])
+        # lookups are read-only, so are not blocked by a writer, eg. a concurrent cache update
+        writer = sqlite3.connect(sqlite_cache.store.path)
+        try:
+            writer.execute('BEGIN IMMEDIATE')
+            with mock.patch.object(sqlite_cache.store, 'TIMEOUT', 0.1):
+                self.assertEqual(sqlite_cache.store.count(oncokb_constants.MAF), 10)
+                self.assertEqual(self.annotate(sqlite_cache, paths, 'sqlite_locked'), expected)
+        finally:
+            writer.close()
+
+    def test_compact(self):
+        paths = self.write_inputs(40)
+        cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR, data_version='v1')
+        self.write_cache(cache, paths)
+        expected = self.annotate(cache, paths, 'v1')
+        # after a data release, apply-cache mode still uses v1 entries
+        cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR, data_version='v2')
+        self.assertEqual(self.annotate(cache, paths, 'v2_apply'), expected)
+        # but hybrid mode treats them as misses, and annotates all rows again
+        annotator_inputs = []
+        def run_annotator(in_path, out_path):
+            rows = self.read_tsv(in_path)
+            annotator_inputs.append(rows)
+            with open(out_path, 'w') as out_file:
+                print("\t".join(rows[0]+oncokb_cache.ANNOTATION_HEADERS), file=out_file)
+                for row in rows[1:]:
+                    print("\t".join(row+self.get_annotations(row[0])), file=out_file)
+        out_path = os.path.join(self.tmp_dir, 'v2_hybrid.tsv')
+        cache.annotate_maf(paths['maf'], out_path, run_annotator)
+        self.assertEqual(len(annotator_inputs[0]), 1+40)
+        cache.annotate_maf(paths['maf'], out_path, run_annotator)
+        self.assertEqual(len(annotator_inputs), 1)
+        # compact: MAF entries are now v2, others are removed
+        cmd = ['update_oncokb_cache.py', 'compact', '-c', self.cache_base, '--data-version', 'v2']
+        result = subprocess.run(cmd, capture_output=True, encoding='utf-8', check=True)
+        cache_dir = os.path.join(self.cache_base, 'paad')
+        lines = result.stdout.strip().split("\n")
+        self.assertEqual(lines, [
+            "{0}\t{1}\t{2}".format(os.path.join(cache_dir, oncokb_constants.CACHE_CNA), 0, 21),
+            "{0}\t{1}\t{2}".format(os.path.join(cache_dir, oncokb_constants.CACHE_FUSION), 0, 21),
+            "{0}\t{1}\t{2}".format(os.path.join(cache_dir, oncokb_constants.CACHE_MAF), 40, 0)
+        ])
+        # TTL; entries without metadata are stale if a TTL or data version is given
+        now = time.time()
+        size = len(oncokb_cache.ANNOTATION_HEADERS)
+        value = self.get_annotations(0)
+        cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR, ttl_days=1)
+        self.assertFalse(cache.is_stale(value+['v1', str(int(now)-3600)], now))
+        self.assertTrue(cache.is_stale(value+['v1', str(int(now)-2*86400)], now))
+        self.assertTrue(cache.is_stale(value, now))
+        cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR)
+        self.assertFalse(cache.is_stale(value, now))
+        with self.assertRaises(RuntimeError):
+            cache.compact()
+        # SQLite and binary backends
+        for backend in [oncokb_constants.BACKEND_SQLITE, oncokb_constants.BACKEND_MMAP]:
+            cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR, backend=backend)
+            cache.migrate(backend)
+        cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR, data_version='v3')
+        results = cache.compact()
+        self.assertEqual(results[cache.store.path], [0, 40])
+        self.assertEqual(results[cache.mmap_store.paths[oncokb_constants.MAF]], [0, 40])
+        self.assertEqual(cache.store.count(oncokb_constants.MAF), 0)
+        self.assertEqual(cache.mmap_store.count(oncokb_constants.MAF), 0)
+
+    def test_concurrent_update(self):
+        # each process adds 100 fusions to the same JSON file; none are lost
+        processes = 8
+        fusion_paths = []
+        for i in range(processes):
+            rows = [['Tumor_Sample_Barcode', 'Fusion']+oncokb_cache.ANNOTATION_HEADERS]
+            for j in range(100):
+                rows.append([self.SAMPLE, 'GENE{0}-GENE{1}'.format(i, j)]+self.get_annotations(j))
+            fusion_paths.append(self.write_tsv('fusion_{0}.tsv'.format(i), rows))
+        with ProcessPoolExecutor(processes) as executor:
+            futures = [executor.submit(write_fusion_cache, self.cache_base, x) for x in fusion_paths]
+            for future in futures:
+                future.result()
+        cache_path = os.path.join(self.cache_base, oncokb_constants.CACHE_FUSION)
+        with open(cache_path) as cache_file:
+            cache = json.loads(cache_file.read())
+        # header row is also cached
+        self.assertEqual(len(cache), 1+processes*100)
+        # entries have the annotations, followed by metadata
+        size = len(oncokb_cache.ANNOTATION_HEADERS)
+        self.assertEqual(cache['GENE7-GENE99'][0:size], self.get_annotations(99))
+        self.assertEqual(len(cache['GENE7-GENE99']), size+oncokb_cache.METADATA_SIZE)
+        # no temporary files are left
+        self.assertEqual(sorted(os.listdir(self.cache_base)),
+                         [oncokb_constants.CACHE_FUSION, oncokb_constants.CACHE_FUSION+'.lock'])
+
+    def test_hybrid(self):
+        paths = self.write_inputs(40)
+        cache = oncokb_cache(
+            self.cache_base, self.ONCOTREE_CODE, logging.ERROR, backend=oncokb_constants.BACKEND_SQLITE
+        )
+        self.write_cache(cache, paths)
+        cached = self.annotate(cache, paths, 'cached')
+        # fake annotator script; annotates MAF/fusion rows as in write_inputs()
+        annotator_inputs = []
+        def run_annotator(in_path, out_path):
+            rows = self.read_tsv(in_path)
+            annotator_inputs.append(rows)
+            with open(out_path, 'w') as out_file:
+                print("\t".join(rows[0]+oncokb_cache.ANNOTATION_HEADERS), file=out_file)
+                for row in rows[1:]:
+                    print("\t".join(row+self.get_annotations(row[0])), file=out_file)
+        out_path = os.path.join(self.tmp_dir, 'hybrid_maf.tsv')
+        cache.metrics.get_new()
+        cache.annotate_maf(paths['maf'], out_path, run_annotator)
+        hybrid = self.read_tsv(out_path)
+        counts = cache.metrics.get_new()[oncokb_constants.MAF]
+        self.assertEqual(counts[metrics.LOOKUPS], 40)
+        self.assertEqual(counts[metrics.HITS], 10)
+        self.assertEqual(counts[metrics.MISSES], 30)
+        self.assertEqual(counts[metrics.ANNOTATED], 30)
+        self.assertEqual(counts[metrics.SUBPROCESS_CALLS], 1)
+        self.assertTrue(counts[metrics.BYTES_LOADED] > 0)
+        # bytes loaded are the stored size of each value read
+        key = ('GENE0', 'Deletion')
+        stored = json.dumps(cache.store.get(oncokb_constants.CNA, [key])[key])
+        with cache._open_lookup(oncokb_constants.CNA) as lookup:
+            lookup([key, ('GENE1', 'Deletion')])
+        counts = cache.metrics.get_new()[oncokb_constants.CNA]
+        self.assertEqual(counts[metrics.BYTES_LOADED], len(stored.encode('utf-8')))
+        # only misses are annotated: rows cached with GENE_IN_ONCOKB=True are omitted
+        self.assertEqual(len(annotator_inputs), 1)
+        self.assertEqual(annotator_inputs[0][0], self.MAF_COLUMNS)
+        self.assertEqual(len(annotator_inputs[0]), 1+30)
+        self.assertEqual(len(hybrid), len(cached['maf']))
+        for i in range(40):
+            if i % 4 == 0:
+                self.assertEqual(hybrid[i+1], cached['maf'][i+1])
+            else:
+                self.assertEqual(hybrid[i+1], self.maf_row(i)+self.get_annotations(self.maf_row(i)[0]))
+        # all results are cached, so a second run has no misses, and identical output
+        cache.annotate_maf(paths['maf'], out_path, run_annotator)
+        self.assertEqual(len(annotator_inputs), 1)
+        counts = cache.metrics.get_new()[oncokb_constants.MAF]
+        self.assertEqual(counts[metrics.HITS], 40)
+        self.assertNotIn(metrics.MISSES, counts)
+        self.assertEqual(cache.metrics.get()[oncokb_constants.MAF][metrics.LOOKUPS], 120)
+        self.assertEqual(self.read_tsv(out_path), hybrid)
+        self.assertEqual(cache.store.count(oncokb_constants.MAF), 40)
+        # fusion misses, ie. odd-numbered rows, are annotated
+        out_path = os.path.join(self.tmp_dir, 'hybrid_fusion.tsv')
+        cache.annotate_fusion(paths['fusion'], out_path, run_annotator)
+        self.assertEqual(len(annotator_inputs), 2)
+        self.assertEqual([x[1] for x in annotator_inputs[1][1:]],
+                         [x[1] for x in self.read_tsv(paths['fusion'])[2::2]])
+        self.assertEqual(self.read_tsv(out_path)[1], cached['fusion'][1])
+
+    def test_hybrid_empty_cache(self):
+        paths = self.write_inputs(10)
+        expected = self.read_tsv(paths['maf'])
+        for backend in oncokb_constants.BACKENDS:
+            cache_base = os.path.join(self.tmp_dir, 'empty_{0}'.format(backend))
+            os.mkdir(cache_base)
+            cache = oncokb_cache(cache_base, self.ONCOTREE_CODE, logging.ERROR, backend=backend)
+            annotator_inputs = []
+            def run_annotator(in_path, out_path):
+                rows = self.read_tsv(in_path)
+                annotator_inputs.append(rows)
+                with open(out_path, 'w') as out_file:
+                    if rows[0][0] == 'Hugo_Symbol' and len(rows[0]) == 2:
+                        # CNA output has sample, cancer type, gene and alteration
+                        header = ['SAMPLE_ID', 'CANCER_TYPE', 'HUGO_SYMBOL', 'ALTERATION']
+                        print("\t".join(header+oncokb_cache.ANNOTATION_HEADERS), file=out_file)
+                        for row in rows[1:]:
+                            alteration = 'Amplification' if row[1] == '2' else 'Deletion'
+                            output = [self.SAMPLE, self.ONCOTREE_CODE, row[0], alteration]
+                            print("\t".join(output+self.get_annotations(row[0])), file=out_file)
+                    else:
+                        print("\t".join(rows[0]+oncokb_cache.ANNOTATION_HEADERS), file=out_file)
+                        for row in rows[1:]:
+                            print("\t".join(row+self.get_annotations(row[0])), file=out_file)
+            # no cache files exist; all inputs are annotated, and the cache is written
+            out_path = os.path.join(self.tmp_dir, 'hybrid_{0}_maf.tsv'.format(backend))
+            cache.annotate_maf(paths['maf'], out_path, run_annotator)
+            output = self.read_tsv(out_path)
+            self.assertEqual(len(output), len(expected))
+            self.assertEqual(output[1], expected[1]+self.get_annotations(expected[1][0]))
+            out_path = os.path.join(self.tmp_dir, 'hybrid_{0}_fusion.tsv'.format(backend))
+            cache.annotate_fusion(paths['fusion'], out_path, run_annotator)
+            self.assertEqual(len(self.read_tsv(out_path)), 11)
+            out_path = os.path.join(self.tmp_dir, 'hybrid_{0}_cna.tsv'.format(backend))
+            cache.annotate_cna(paths['cna'], out_path, self.info_path, run_annotator)
+            self.assertEqual(self.read_tsv(out_path)[1][2:4], ['GENE0', 'Deletion'])
+            self.assertEqual([len(x) for x in annotator_inputs], [11, 11, 6])
+            # a second run is entirely from the cache
+            cache.annotate_maf(paths['maf'], out_path, run_annotator)
+            self.assertEqual(len(annotator_inputs), 3)
+
+    def test_benchmark(self):
+        work_dir = os.path.join(self.tmp_dir, 'benchmark')
+        os.mkdir(work_dir)
+        benchmark = oncokb_cache_benchmark(log_level=logging.ERROR)
+        results = benchmark.run(work_dir, entries=200, rows=20)
+        self.assertEqual([x[benchmark.BACKEND] for x in results], oncokb_constants.BACKENDS)
+        self.assertEqual(results[0][benchmark.CONVERT_SECONDS], 0)
+        self.assertTrue(all([x[benchmark.ANNOTATE_SECONDS] > 0 for x in results]))
+        self.assertEqual(benchmark.format_results(results).count("\n"), 4)
+
+    def test_migrate_script(self):
+        paths = self.write_inputs(10)
+        json_cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR)
+        self.write_cache(json_cache, paths)
+        cmd = ['update_oncokb_cache.py', 'migrate', '-c', self.cache_base]
+        result = subprocess.run(cmd, capture_output=True, encoding='utf-8', check=True)
+        store_path = os.path.join(self.cache_base, 'paad', oncokb_constants.CACHE_SQLITE)
+        self.assertEqual(result.stdout, "{0}\t{1}\n".format(store_path, 3+6+6))
+        self.assertTrue(os.path.isfile(store_path))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_base, oncokb_constants.CACHE_SQLITE)))
+
+    def test_mmap_backend(self):
+        paths = self.write_inputs(40)
+        json_cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR)
+        self.write_cache(json_cache, paths)
+        expected = self.annotate(json_cache, paths, 'json')
+        # convert with the script, and check binary files are used by default
+        cmd = ['update_oncokb_cache.py', 'migrate', '-c', self.cache_base, '-f', 'mmap']
+        result = subprocess.run(cmd, capture_output=True, encoding='utf-8', check=True)
+        cache_dir = os.path.join(self.cache_base, 'paad')
+        self.assertEqual(result.stdout, "{0}\t{1}\n".format(cache_dir, 10+21+21))
+        mmap_cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR)
+        self.assertEqual(mmap_cache.backend, oncokb_constants.BACKEND_MMAP)
+        self.assertEqual(mmap_cache.mmap_store.count(oncokb_constants.MAF), 10)
+        # tables opened for lookups are closed when annotation is done
+        tables = []
+        open_table = mmap_cache.mmap_store.open
+        def record_open(cache_type):
+            tables.append(open_table(cache_type))
+            return tables[-1]
+        with mock.patch.object(mmap_cache.mmap_store, 'open', record_open):
+            self.assertEqual(self.annotate(mmap_cache, paths, 'mmap'), expected)
+        self.assertEqual(len(tables), 3)
+        self.assertTrue(all([x.mm.closed for x in tables]))
+        found = mmap_cache.mmap_store.get(oncokb_constants.CNA, [('GENE0', 'Deletion'), ('GENE1', 'Deletion')])
+        mmap_cache.metrics.get_new()
+        with mmap_cache._open_lookup(oncokb_constants.CNA) as lookup:
+            lookup(list(found.keys()))
+        counts = mmap_cache.metrics.get_new()[oncokb_constants.CNA]
+        self.assertEqual(counts[metrics.BYTES_LOADED],
+                         len("\t".join(found[('GENE0', 'Deletion')]).encode('utf-8')))
+        self.assertEqual(list(found.keys()), [('GENE0', 'Deletion')])
+        size = len(oncokb_cache.ANNOTATION_HEADERS)
+        self.assertEqual(found[('GENE0', 'Deletion')][0:size], self.get_annotations(0))
+        # updates merge with existing entries
+        for name in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, name))
+        self.write_cache(mmap_cache, paths)
+        self.write_cache(mmap_cache, paths)
+        self.assertEqual(mmap_cache.mmap_store.count(oncokb_constants.MAF), 10)
+        self.assertEqual(self.annotate(mmap_cache, paths, 'mmap_update'), expected)
+        self.assertFalse(os.path.exists(os.path.join(cache_dir, oncokb_constants.CACHE_MAF)))
+
+    def test_streaming(self):
+        paths = self.write_inputs(40)
+        cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR)
+        self.write_cache(cache, paths)
+        expected = self.annotate(cache, paths, 'unbatched')
+        # small batches, with gzipped input and output, give the same results
+        for backend in oncokb_constants.BACKENDS:
+            cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR, backend=backend)
+            cache.BATCH_SIZE = 7
+            if backend != oncokb_constants.BACKEND_JSON:
+                cache.migrate(backend)
+            for (cache_type, method) in [
+                    ('maf', cache.annotate_maf),
+                    ('fusion', cache.annotate_fusion)
+            ]:
+                gz_path = os.path.join(self.tmp_dir, '{0}.tsv.gz'.format(cache_type))
+                with open(paths[cache_type], 'rb') as in_file, gzip.open(gz_path, 'wb') as out_file:
+                    out_file.write(in_file.read())
+                out_path = os.path.join(self.tmp_dir, '{0}_{1}.tsv.gz'.format(backend, cache_type))
+                method(gz_path, out_path)
+                with gzip.open(out_path, 'rt') as out_file:
+                    output = list(csv.reader(out_file, delimiter="\t"))
+                self.assertEqual(output, expected[cache_type])
+            out_path = os.path.join(self.tmp_dir, '{0}_cna.tsv.gz'.format(backend))
+            cache.annotate_cna(paths['cna'], out_path, self.info_path)
+            with gzip.open(out_path, 'rt') as out_file:
+                self.assertEqual(list(csv.reader(out_file, delimiter="\t")), expected['cna'])
+
+
+class TestOncokbClient(OncokbTestBase):
+
+    TOKEN = 'SECRET_TOKEN_VALUE'
+
+    def get_client(self, url, batch_size=3):
+        return oncokb_client(self.TOKEN, self.SAMPLE, self.ONCOTREE_CODE, url,
+                             batch_size=batch_size, retries=0, log_level=logging.ERROR)
+
+    def test_annotate(self):
+        url = self.start_stub_server()
+        client = self.get_client(url)
+        paths = self.write_inputs(10)
+        expected = ['True', 'True', 'True', 'Gain-of-function', '101;102', 'Oncogenic',
+                    'DrugA+DrugB,DrugC', '', '', '', '', 'DrugD', '', 'LEVEL_R1', 'LEVEL_1',
+                    'LEVEL_R1', '201;202;http://example.com', 'Pancreatic Adenocarcinoma', '', '',
+                    'LEVEL_Dx1', '301', '', '', '', '', '']
+        self.assertEqual(len(expected), len(oncokb_cache.ANNOTATION_HEADERS))
+        # MAF: 10 rows in batches of 3, on one persistent connection
+        out_path = os.path.join(self.tmp_dir, 'maf_out.tsv')
+        client.annotate_maf(paths['maf'], out_path)
+        output = self.read_tsv(out_path)
+        self.assertEqual(output[0], self.MAF_COLUMNS+oncokb_cache.ANNOTATION_HEADERS)
+        self.assertEqual(len(output), 11)
+        self.assertEqual(output[1], self.maf_row(0)+expected)
+        requests = self.server.requests
+        self.assertEqual([len(x['queries']) for x in requests], [3, 3, 3, 1])
+        self.assertEqual(set([x['path'] for x in requests]), set(['/api/v1/'+client.GENOMIC_CHANGE]))
+        self.assertEqual(len(set([x['port'] for x in requests])), 1)
+        self.assertEqual(requests[0]['authorization'], 'Bearer '+self.TOKEN)
+        self.assertEqual(requests[0]['queries'][1]['genomicLocation'], '2,1001,1001,A,T')
+        self.assertEqual(requests[0]['queries'][1]['tumorType'], self.ONCOTREE_CODE)
+        # CNA: only amplifications and deletions are annotated
+        out_path = os.path.join(self.tmp_dir, 'cna_out.tsv')
+        client.annotate_cna(paths['cna'], out_path)
+        output = self.read_tsv(out_path)
+        self.assertEqual(len(output), 6)
+        self.assertEqual(output[1], [self.SAMPLE, self.ONCOTREE_CODE, 'GENE0', 'Deletion']+expected)
+        self.assertEqual(self.server.requests[-1]['queries'][1]['copyNameAlterationType'], 'AMPLIFICATION')
+        # fusion
+        out_path = os.path.join(self.tmp_dir, 'fusion_out.tsv')
+        client.annotate_fusion(paths['fusion'], out_path)
+        output = self.read_tsv(out_path)
+        self.assertEqual(len(output), 11)
+        self.assertEqual(output[1], [self.SAMPLE, 'KRAS-GENE0']+expected)
+        query = self.server.requests[-1]['queries'][0]
+        self.assertEqual([query['geneA']['hugoSymbol'], query['geneB']['hugoSymbol']], ['SMAD4', 'GENE9'])
+        self.assertEqual(len(set([x['port'] for x in self.server.requests])), 1)
+        self.assertEqual(client.total_requests, 4+2+4)
+        self.assertEqual(client.get_data_version(), 'v4.20')
+        client.close()
+
+    def test_error(self):
+        url = self.start_stub_server()
+        self.server.status = 401
+        client = self.get_client(url)
+        paths = self.write_inputs(2)
+        with self.assertLogs('djerba.util.oncokb.client', level=logging.ERROR) as logs:
+            with self.assertRaises(RuntimeError):
+                client.annotate_maf(paths['maf'], os.path.join(self.tmp_dir, 'maf_out.tsv'))
+        self.assertIn('status 401', logs.output[0])
+        self.assertNotIn(self.TOKEN, logs.output[0])
+        client.close()
+
+    def test_tumour_type(self):
+        # as for MafAnnotator.py: tumour type only for the tumour sample, and
+        # Tumor_Seq_Allele1 if it differs from the reference
+        url = self.start_stub_server()
+        client = self.get_client(url)
+        header = ['Tumor_Sample_Barcode', 'Hugo_Symbol', 'Chromosome', 'Start_Position',
+                  'Reference_Allele', 'Tumor_Seq_Allele1', 'Tumor_Seq_Allele2', 'HGVSp_Short']
+        maf_path = self.write_tsv('pooled.maf', [
+            header,
+            [self.SAMPLE, 'KRAS', 'chr12', '1001', 'A', 'A', 'T', 'p.G12D'],
+            ['NORMAL_001', 'KRAS', 'chr12', '1001', 'A', 'A', 'T', 'p.G12D'],
+            [self.SAMPLE, 'TP53', 'chr17', '2001', 'C', 'G', 'C', 'p.R175H']
+        ])
+        for genomic_change in [True, False]:
+            client.annotate_maf(maf_path, os.path.join(self.tmp_dir, 'maf_out.tsv'), genomic_change)
+            queries = self.server.requests[-1]['queries']
+            self.assertEqual([x.get('tumorType') for x in queries],
+                             [self.ONCOTREE_CODE, None, self.ONCOTREE_CODE])
+        queries = self.server.requests[0]['queries']
+        self.assertEqual([x['genomicLocation'] for x in queries],
+                         ['12,1001,1001,A,T', '12,1001,1001,A,T', '17,2001,2001,C,G'])
+        client.close()
+        # without barcode matching, eg. for cache pre-warming, all rows have the tumour type
+        client = oncokb_client(self.TOKEN, 'cohort', self.ONCOTREE_CODE, url, retries=0,
+                               match_barcode=False, log_level=logging.ERROR)
+        client.annotate_maf(maf_path, os.path.join(self.tmp_dir, 'maf_out.tsv'))
+        queries = self.server.requests[-1]['queries']
+        self.assertEqual([x.get('tumorType') for x in queries], [self.ONCOTREE_CODE]*3)
+        client.close()
+
+    def test_prewarm(self):
+        url = self.start_stub_server()
+        paths = self.write_inputs(10)
+        cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR, data_version='v4.20')
+        self.write_cache(cache, paths)
+        # report directory with annotated MAF, and CNA and fusion inputs
+        report_dir = os.path.join(self.tmp_dir, 'reports', 'report_001')
+        os.makedirs(os.path.join(report_dir, 'tmp'))
+        shutil.copy(self.info_path, report_dir)
+        shutil.copy(paths['maf_annotated'], os.path.join(report_dir, 'tmp', oncokb_constants.ANNOTATED_MAF))
+        shutil.copy(paths['cna'], os.path.join(report_dir, oncokb_constants.DATA_CNA_ONCOKB_GENES_NON_DIPLOID))
+        shutil.copy(paths['fusion'], os.path.join(report_dir, constants.DATA_FUSIONS_ONCOKB))
+        brca_cna = self.write_tsv('brca_cna.tsv', [['Hugo_Symbol', 'S2'], ['GENE1', '2'], ['GENE2', '-2'], ['GENE3', '0']])
+        token_path = self.write_tsv('token.txt', [[self.TOKEN]])
+        cmd = [
+            'update_oncokb_cache.py', 'prewarm', '-c', self.cache_base, '-u', url,
+            '-r', os.path.join(self.tmp_dir, 'reports'),
+            '--maf', self.ONCOTREE_CODE, paths['maf'],
+            '--cna', 'BRCA', brca_cna
+        ]
+        env = dict(os.environ)
+        env['ONCOKB_TOKEN'] = token_path
+        result = subprocess.run(cmd, capture_output=True, encoding='utf-8', check=True, env=env)
+        # keys are distinct across inputs; only misses are annotated, in one request for each type
+        expected = [
+            ['oncotree_code', 'cache_type', 'keys', 'annotated'],
+            ['BRCA', 'cna', '2', '2'],
+            ['PAAD', 'cna', '5', '0'],
+            ['PAAD', 'fusion', '10', '5'],
+            ['PAAD', 'maf', '10', '7']
+        ]
+        self.assertEqual([x.split("\t") for x in result.stdout.splitlines()], expected)
+        self.assertEqual(sorted([len(x['queries']) for x in self.server.requests]), [2, 5, 7])
+        # second run is entirely from cache
+        result = subprocess.run(cmd, capture_output=True, encoding='utf-8', check=True, env=env)
+        self.assertEqual([x.split("\t")[3] for x in result.stdout.splitlines()[1:]], ['0']*4)
+        self.assertEqual(len(self.server.requests), 3)
+        cache = oncokb_cache(self.cache_base, self.ONCOTREE_CODE, logging.ERROR)
+        output = self.annotate(cache, paths, 'prewarmed')
+        self.assertEqual(output['maf'][2][len(self.MAF_COLUMNS):][0:4],
+                         ['True', 'True', 'True', 'Gain-of-function'])
+        self.assertEqual(len(output['fusion']), 11)
+        with open(os.path.join(self.cache_base, 'brca', oncokb_constants.CACHE_CNA)) as in_file:
+            brca = json.loads(in_file.read())
+        self.assertEqual(sorted(brca.keys()), ['GENE1', 'GENE2'])
+        self.assertEqual(brca['GENE2']['Deletion'][-2], 'v4.20')
+
+
+class TestOncokbAnnotator(OncokbTestBase):
+
+    DELAY = 1
+    TOKEN = 'SECRET_TOKEN_VALUE'
+    # fake annotator script; appends annotations to each input row after a delay
+    # CNA output has the sample, cancer type, gene and alteration, as for CnaAnnotator.py
+    FAKE_SCRIPT = """#! /usr/bin/env python3
+import os, sys, time
+args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+time.sleep({delay})
+headers = {headers}
+with open(args['-i']) as in_file:
+    rows = [x.rstrip('\\n').split('\\t') for x in in_file]
+with open(args['-o'], 'w') as out_file:
+    if os.path.basename(sys.argv[0]) == 'CnaAnnotator.py':
+        print('\\t'.join(['SAMPLE_ID', 'CANCER_TYPE', 'HUGO_SYMBOL', 'ALTERATION']+headers), file=out_file)
+        for row in rows[1:]:
+            alteration = 'Amplification' if row[1] == '2' else 'Deletion'
+            print('\\t'.join(['S', 'C', row[0], alteration]+['x']*len(headers)), file=out_file)
+    else:
+        print('\\t'.join(rows[0]+headers), file=out_file)
+        for row in rows[1:]:
+            print('\\t'.join(row+['x']*len(headers)), file=out_file)
+"""
+
+    def setUp(self):
+        super().setUp()
+        self.report_dir = os.path.join(self.tmp_dir, 'report')
+        bin_dir = os.path.join(self.tmp_dir, 'bin')
+        for path in [self.report_dir, bin_dir]:
+            os.mkdir(path)
+        script = self.FAKE_SCRIPT.format(delay=self.DELAY, headers=oncokb_cache.ANNOTATION_HEADERS)
+        for name in ['CnaAnnotator.py', 'FusionAnnotator.py', 'MafAnnotator.py']:
+            path = os.path.join(bin_dir, name)
+            with open(path, 'w') as out_file:
+                out_file.write(script)
+            os.chmod(path, stat.S_IRWXU)
+        token_path = os.path.join(self.tmp_dir, 'token.txt')
+        with open(token_path, 'w') as out_file:
+            out_file.write(self.TOKEN)
+        environment = {
+            'PATH': bin_dir+os.pathsep+os.environ['PATH'],
+            oncokb_annotator.ONCOKB_TOKEN_VARIABLE: token_path
+        }
+        self.environment = mock.patch.dict(os.environ, environment)
+        self.environment.start()
+        paths = self.write_inputs(10)
+        os.rename(paths['cna'], os.path.join(self.report_dir, oncokb_constants.DATA_CNA_ONCOKB_GENES_NON_DIPLOID))
+        os.rename(paths['fusion'], os.path.join(self.report_dir, constants.DATA_FUSIONS_ONCOKB))
+        self.maf_path = paths['maf']
+
+    def tearDown(self):
+        self.environment.stop()
+        super().tearDown()
+
+    def test_annotate_all(self):
+        log_path = os.path.join(self.tmp_dir, 'annotator.log')
+        annotator = oncokb_annotator(
+            self.SAMPLE, self.ONCOTREE_CODE, self.report_dir, log_level=logging.DEBUG, log_path=log_path
+        )
+        biomarkers = (self.maf_path, os.path.join(self.tmp_dir, 'biomarkers_annotated.tsv'))
+        start = time.time()
+        futures = annotator.annotate_all(self.maf_path, biomarkers)
+        results = {key: future.result() for (key, future) in futures.items()}
+        elapsed = time.time() - start
+        self.assertEqual(set(results.keys()), set(['maf', 'biomarkers', 'cna', 'fusion']))
+        self.assertEqual(results['biomarkers'], biomarkers[1])
+        for path in results.values():
+            self.assertTrue(os.path.isfile(path))
+        # wall time is about that of the longest job, not the sum
+        self.assertTrue(elapsed < 3*self.DELAY, elapsed)
+        # concurrency limit of 1 runs jobs in turn
+        start = time.time()
+        futures = annotator.annotate_all(cna=True, fusion=True, max_concurrent=1)
+        [x.result() for x in futures.values()]
+        self.assertTrue(time.time() - start >= 2*self.DELAY)
+        with open(log_path) as log_file:
+            log = log_file.read()
+        self.assertIn('***REDACTED***', log)
+        self.assertNotIn(self.TOKEN, log)
+        # metrics from both runs are summed in the report directory
+        with open(os.path.join(self.report_dir, oncokb_constants.ONCOKB_METRICS)) as in_file:
+            results = json.loads(in_file.read())
+        self.assertEqual(sorted(results[metrics.ANNOTATOR].keys()),
+                         ['biomarkers', 'cna', 'fusion', 'maf'])
+        self.assertNotIn(metrics.CACHE, results)
+        for key in ['cna', 'fusion']:
+            counts = results[metrics.ANNOTATOR][key]
+            self.assertEqual(counts[metrics.SUBPROCESS_CALLS], 2)
+            self.assertTrue(counts[metrics.ANNOTATION_SECONDS] >= counts[metrics.SUBPROCESS_SECONDS])
+            self.assertTrue(counts[metrics.SUBPROCESS_SECONDS] >= 2*self.DELAY)
+        # a new annotator, eg. for a re-run, resets the metrics file
+        annotator = oncokb_annotator(self.SAMPLE, self.ONCOTREE_CODE, self.report_dir,
+                                     log_level=logging.ERROR)
+        self.assertFalse(os.path.exists(os.path.join(self.report_dir, oncokb_constants.ONCOKB_METRICS)))
+        annotator.annotate_all(cna=True, fusion=False)['cna'].result()
+        with open(os.path.join(self.report_dir, oncokb_constants.ONCOKB_METRICS)) as in_file:
+            results = json.loads(in_file.read())
+        self.assertEqual(list(results[metrics.ANNOTATOR].keys()), ['cna'])
+        self.assertEqual(results[metrics.ANNOTATOR]['cna'][metrics.SUBPROCESS_CALLS], 1)
+        # no lock files are left in the report directory
+        self.assertEqual([x for x in os.listdir(self.report_dir) if x.endswith('.lock')], [])
+
+    def test_dedup(self):
+        annotator = oncokb_annotator(self.SAMPLE, self.ONCOTREE_CODE, self.report_dir,
+                                     log_level=logging.ERROR)
+        # 5 distinct variants, each in 4 rows: 3 for the tumour sample and 1 for another sample
+        header = ['Tumor_Sample_Barcode']+self.MAF_COLUMNS
+        rows = []
+        for i in range(20):
+            sample = 'OTHER' if i % 4 == 3 else self.SAMPLE
+            rows.append([sample]+self.maf_row(i % 5))
+        in_path = self.write_tsv('pooled.maf', [header]+rows)
+        annotator_inputs = []
+        def run_annotator(in_path, out_path):
+            input_rows = self.read_tsv(in_path)
+            annotator_inputs.append(input_rows)
+            with open(out_path, 'w') as out_file:
+                print("\t".join(input_rows[0]+['ANNOTATED', 'SAMPLE']), file=out_file)
+                for row in input_rows[1:]:
+                    print("\t".join(row+['True', row[0]]), file=out_file)
+        out_path = os.path.join(self.tmp_dir, 'pooled_annotated.maf')
+        run_dedup = annotator._get_dedup_runner(run_annotator, annotator.GENOMIC_CHANGE_COLUMNS)
+        run_dedup(in_path, out_path)
+        # tumour and other samples may have different tumour types, so are annotated separately
+        self.assertEqual(len(annotator_inputs[0]), 1+5+5)
+        output = self.read_tsv(out_path)
+        self.assertEqual(output[0], header+['ANNOTATED', 'SAMPLE'])
+        self.assertEqual(len(output), 21)
+        for (row, output_row) in zip(rows, output[1:]):
+            self.assertEqual(output_row, row+['True', row[0]])
+        # annotation with the fake script has the same output rows
+        out_path = annotator.annotate_maf(in_path)
+        output = self.read_tsv(out_path)
+        self.assertEqual([x[0:6] for x in output[1:]], rows)
+        # without key columns, rows are distinct unless all columns are equal
+        run_dedup = annotator._get_dedup_runner(run_annotator, ['Missing_Column'])
+        with self.assertLogs('djerba.util.oncokb.annotator', level=logging.WARNING) as logs:
+            run_dedup(in_path, out_path)
+        self.assertIn('Missing_Column', logs.output[0])
+        self.assertEqual(len(annotator_inputs[-1]), 1+5+5)
+        self.assertEqual(len(self.read_tsv(out_path)), 21)
+
+    def test_data_version(self):
+        # data version is only fetched to write the cache; failure to fetch it is not fatal
+        cache_dir = self.cache_base
+        with mock.patch.object(oncokb_client, 'get_data_version',
+                               side_effect=RuntimeError('OncoKB is offline')) as get_version:
+            params = oncokb_cache_params(cache_dir, apply_cache=True, log_level=logging.ERROR)
+            annotator = oncokb_annotator(self.SAMPLE, self.ONCOTREE_CODE, self.report_dir,
+                                         cache_params=params, log_level=logging.ERROR,
+                                         http_client=True)
+            get_version.assert_not_called()
+            params = oncokb_cache_params(cache_dir, hybrid_cache=True, log_level=logging.ERROR)
+            log_path = os.path.join(self.tmp_dir, 'annotator.log')
+            annotator = oncokb_annotator(self.SAMPLE, self.ONCOTREE_CODE, self.report_dir,
+                                         cache_params=params, log_level=logging.WARNING,
+                                         log_path=log_path, http_client=True)
+            self.assertEqual(get_version.call_count, 1)
+            with open(log_path) as log_file:
+                self.assertIn('OncoKB is offline', log_file.read())
+            self.assertEqual(annotator.cache.data_version, None)
+
+    def test_http_client(self):
+        url = self.start_stub_server()
+        with mock.patch.object(oncokb_client, 'DEFAULT_URL', url):
+            annotator = oncokb_annotator(
+                self.SAMPLE, self.ONCOTREE_CODE, self.report_dir, log_level=logging.ERROR,
+                http_client=True
+            )
+            futures = annotator.annotate_all(self.maf_path)
+            results = {key: future.result() for (key, future) in futures.items()}
+        self.assertEqual(len(self.read_tsv(results['maf'])), 11)
+        self.assertEqual(len(self.read_tsv(results['cna'])), 6)
+        self.assertEqual(len(self.read_tsv(results['fusion'])), 11)
+        # no annotator scripts are run; all queries go to the stub server
+        self.assertEqual(sum([len(x['queries']) for x in self.server.requests]), 10+5+10)
+
+
+if __name__ == '__main__':
+    unittest.main()
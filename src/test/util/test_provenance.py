@@ -0,0 +1,868 @@
+#! /usr/bin/env python3
+
+"""Tests of file provenance utilities, using a small synthetic FPR"""
+
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+import unittest
+from configparser import ConfigParser
+from unittest import mock
+import djerba.core.constants as core_constants
+import djerba.util.decompression as decompression
+import djerba.util.ini_fields as ini
+import djerba.util.provenance_index as index
+import djerba.helpers.provenance_helper.helper as helper_module
+import djerba.plugins.demo1.plugin as demo1_module
+import djerba.plugins.demo2.plugin as demo2_module
+import djerba.plugins.demo3.plugin as demo3_module
+from djerba.core.loaders import helper_loader
+from djerba.core.main import main as djerba_main
+from djerba.core.workspace import workspace
+from djerba.helpers.provenance_helper.helper import provenance_subset_writer
+from djerba.util.bgzf import bgzf_writer, bgzf_reader, is_bgzf, MAX_BLOCK_DATA
+from djerba.util.decompression import decompressor, DecompressionError
+from djerba.util.locking import file_lock
+from djerba.util.provenance_audit import provenance_audit
+from djerba.util.provenance_benchmark import provenance_benchmark
+from djerba.util.provenance_cache import provenance_cache
+from djerba.util.provenance_reader import provenance_output, provenance_reader, \
+    sample_name_container, parse_sample_attributes
+from djerba.util.provenance_filter import provenance_filter
+from djerba.util.provenance_row import provenance_row, read_provenance_file, \
+    PROJECTED_COLUMNS, PROJECTED_HEADER, ProvenanceRowError
+from djerba.util.provenance_snapshot import provenance_snapshot
+from djerba.util.provenance_store import provenance_store
+from djerba.util.subprocess_runner import subprocess_runner
+from djerba.util.testing.provenance_generator import provenance_generator
+from djerba.util.testing.tools import TestBase
+from djerba.util.validator import path_validator
+
+class ProvenanceTestBase(TestBase):
+
+    TOTAL_COLUMNS = index.LIMS_LAST_MODIFIED + 1
+    STUDIES = ['PASS01', 'REVOLVE', 'TGL01']
+    DONORS = ['PANX_{0}'.format(x) for x in range(1500, 1520)]
+
+    def setUp(self):
+        super().setUp()
+        self.fpr_path = os.path.join(self.tmp_dir, 'fpr.tsv.gz')
+        self.write_fpr(self.fpr_path, 3000)
+
+    def make_row(self, i):
+        row = ['value_{0}_{1}'.format(i, j) for j in range(self.TOTAL_COLUMNS)]
+        row[index.LAST_MODIFIED] = '2024-01-01 00:00:{0:02d}'.format(i % 60)
+        row[index.STUDY_TITLE] = self.STUDIES[i % len(self.STUDIES)]
+        row[index.ROOT_SAMPLE_NAME] = self.DONORS[(i // 7) % len(self.DONORS)]
+        return row
+
+    def read_expected(self, study, donor):
+        with gzip.open(self.fpr_path, 'rt') as in_file:
+            rows = [
+                row for row in csv.reader(in_file, delimiter="\t")
+                if row[index.STUDY_TITLE] == study and row[index.ROOT_SAMPLE_NAME] == donor
+            ]
+        return rows
+
+    def read_expected_projected(self, study, donor):
+        return [[row[x] for x in PROJECTED_COLUMNS] for row in self.read_expected(study, donor)]
+
+    def write_fpr(self, path, total):
+        with gzip.open(path, 'wt') as out_file:
+            writer = csv.writer(out_file, delimiter="\t")
+            for i in range(total):
+                writer.writerow(self.make_row(i))
+
+
+class TestBGZF(TestBase):
+
+    def test_records(self):
+        path = os.path.join(self.tmp_dir, 'test.bgz')
+        small = b'a'*1000+b'\n'
+        large = b'b'*(MAX_BLOCK_DATA*2 + 10)+b'\n'
+        with bgzf_writer(path) as writer:
+            offsets = [writer.write_record(small) for i in range(100)]
+            large_offsets = writer.write_record(large)
+            last_offsets = writer.write_record(small)
+        self.assertTrue(is_bgzf(path))
+        self.assertEqual(len(large_offsets), 3)
+        self.assertNotIn(last_offsets[0], large_offsets)
+        # any gzip reader can read the whole file
+        with gzip.open(path, 'rb') as in_file:
+            self.assertEqual(in_file.read(), small*100 + large + small)
+        with bgzf_reader(path) as reader:
+            runs = list(reader.read_blocks(large_offsets))
+            self.assertEqual(runs, [large])
+            runs = list(reader.read_blocks([offsets[0][0], last_offsets[0]]))
+            self.assertEqual(len(runs), 2)
+            self.assertEqual(runs[1], small)
+
+
+class TestProvenanceRow(ProvenanceTestBase):
+
+    def test_row(self):
+        full = self.make_row(7)
+        row = provenance_row.from_full_row(full)
+        for column in PROJECTED_COLUMNS:
+            self.assertEqual(row[column], full[column])
+        self.assertEqual(row.file_path, full[index.FILE_PATH])
+        with self.assertRaises(ProvenanceRowError):
+            row[index.FILE_MD5SUM]
+        self.assertEqual(provenance_row(row.to_list()), row)
+        # full and projected files give the same rows
+        expected = [provenance_row(x) for x in self.read_expected_projected('PASS01', 'PANX_1500')]
+        found = list(read_provenance_file(self.fpr_path, 'PASS01', 'PANX_1500'))
+        self.assertEqual(found, expected)
+        self.assertEqual(len(list(read_provenance_file(self.fpr_path))), 3000)
+
+
+class TestDecompression(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        generator = provenance_generator(log_level=logging.ERROR)
+        self.gzip_path = generator.write(os.path.join(self.tmp_dir, 'fpr.tsv.gz'), 2000)
+        self.bgzf_path = generator.write(os.path.join(self.tmp_dir, 'fpr.bgz'), 2000, bgzf=True)
+        with gzip.open(self.gzip_path, 'rt') as in_file:
+            self.expected = list(csv.reader(in_file, delimiter="\t"))
+
+    def read_rows(self, path, backend, threads=0):
+        reader = decompressor(backend, threads, log_level=logging.ERROR)
+        with reader.open_text(path) as in_file:
+            return list(csv.reader(in_file, delimiter="\t"))
+
+    def test_backends(self):
+        self.assertEqual(len(self.expected), 2000)
+        for path in [self.gzip_path, self.bgzf_path]:
+            self.assertEqual(self.read_rows(path, decompression.GZIP), self.expected)
+            self.assertEqual(self.read_rows(path, decompression.AUTO), self.expected)
+        for threads in [1, 3]:
+            self.assertEqual(self.read_rows(self.bgzf_path, decompression.BGZF, threads), self.expected)
+        # BGZF backend falls back to gzip for a non-BGZF file
+        self.assertEqual(self.read_rows(self.gzip_path, decompression.BGZF), self.expected)
+        reader = decompressor(decompression.AUTO, 2, log_level=logging.ERROR)
+        self.assertEqual(reader.get_backend(self.bgzf_path), decompression.BGZF)
+        with self.assertRaises(DecompressionError):
+            decompressor('no_such_backend')
+
+    def test_subprocess_stream(self):
+        # streaming subprocess output, as used by the pigz backend
+        runner = subprocess_runner(log_level=logging.CRITICAL)
+        with runner.open_stdout(['gzip', '-dc', self.gzip_path]) as in_file:
+            rows = list(csv.reader(in_file, delimiter="\t"))
+        self.assertEqual(rows, self.expected)
+        # stopping early is not an error
+        with runner.open_stdout(['gzip', '-dc', self.gzip_path]) as in_file:
+            in_file.readline()
+        with self.assertRaises(subprocess.CalledProcessError):
+            with runner.open_stdout(['gzip', '-dc', 'no_such_file.gz']) as in_file:
+                in_file.read()
+
+    @unittest.skipUnless(shutil.which('pigz'), 'pigz not found on PATH')
+    def test_pigz(self):
+        for path in [self.gzip_path, self.bgzf_path]:
+            self.assertEqual(self.read_rows(path, decompression.PIGZ), self.expected)
+
+
+class TestProvenanceFilter(ProvenanceTestBase):
+
+    def csv_filter(self, data, keys):
+        # reference implementation: parse every row with csv.reader
+        text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', newline='')
+        return [
+            row for row in csv.reader(text, delimiter="\t")
+            if (row[index.STUDY_TITLE], row[index.ROOT_SAMPLE_NAME]) in keys or \
+            (row[index.STUDY_TITLE], None) in keys
+        ]
+
+    def fast_filter(self, data, keys, chunk_size):
+        return list(provenance_filter(keys, chunk_size).filter_rows(io.BytesIO(data)))
+
+    def test_edge_cases(self):
+        # quoted fields with tabs and newlines, CRLF line endings, no final newline
+        rows = [self.make_row(i) for i in range(200)]
+        rows[3][index.FILE_PATH] = 'path with\ttab'
+        rows[7][index.PARENT_SAMPLE_ATTRIBUTES] = 'attributes with\nnewline'
+        rows[8][index.SAMPLE_NAME] = 'sample "quoted"'
+        rows[9][index.ROOT_SAMPLE_NAME] = 'PANX 1500'
+        rows[10][index.FILE_DESCRIPTION] = 'description with\r\nCRLF'
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter="\t", lineterminator="\r\n")
+        for row in rows:
+            writer.writerow(row)
+        crlf_data = buffer.getvalue().encode('utf-8')
+        lf_data = crlf_data.replace(b'\r\n', b'\n')
+        keys_list = [
+            {('PASS01', 'PANX_1500')},
+            {(x, y) for x in self.STUDIES for y in self.DONORS},
+            {('PASS01', 'PANX 1500'), ('REVOLVE', 'PANX_1501'), ('NO_SUCH', 'NONE')},
+            {('REVOLVE', None), ('PASS01', 'PANX_1500')}
+        ]
+        for data in [crlf_data, lf_data, lf_data[0:-1]]:
+            for keys in keys_list:
+                expected = self.csv_filter(data, keys)
+                self.assertTrue(len(expected) > 0)
+                for chunk_size in [50, 1000, 10**6]:
+                    self.assertEqual(self.fast_filter(data, keys, chunk_size), expected)
+
+    def test_generated(self):
+        path = os.path.join(self.tmp_dir, 'generated.tsv.gz')
+        generator = provenance_generator(log_level=logging.ERROR)
+        generator.write(path, 20000, donors=200)
+        with gzip.open(path, 'rb') as in_file:
+            data = in_file.read()
+        keys = {('PASS01', generator.donor_name(0)), ('REVOLVE', generator.donor_name(101))}
+        start = time.perf_counter()
+        expected = self.csv_filter(data, keys)
+        csv_time = time.perf_counter() - start
+        self.assertEqual(len(expected), 200)
+        row_filter = provenance_filter(keys, 64*1024)
+        start = time.perf_counter()
+        found = list(row_filter.filter_rows(io.BytesIO(data)))
+        filter_time = time.perf_counter() - start
+        self.assertEqual(found, expected)
+        # most chunks are skipped, and only matching rows are parsed
+        self.assertTrue(row_filter.skipped_chunks > 0.8*row_filter.total_chunks)
+        self.assertEqual(row_filter.parsed_lines, 200)
+        self.assertTrue(filter_time < csv_time)
+        # reader output is unchanged, with the filter
+        reader_rows = list(read_provenance_file(path, 'PASS01', generator.donor_name(0)))
+        self.assertEqual(reader_rows, [provenance_row.from_full_row(x) for x in expected[0:100]])
+
+
+class TestProvenanceSnapshot(ProvenanceTestBase):
+
+    def test_snapshot(self):
+        snapshot = provenance_snapshot(self.fpr_path)
+        self.assertFalse(snapshot.is_current())
+        snapshot.build()
+        self.assertTrue(snapshot.is_current())
+        for study in self.STUDIES:
+            for donor in self.DONORS[0:5]:
+                expected = self.read_expected(study, donor)
+                self.assertEqual(list(snapshot.read_rows(study, donor)), expected)
+        self.assertEqual(list(snapshot.read_rows('NO_SUCH_STUDY', 'NO_SUCH_DONOR')), [])
+        # snapshot is out of date if the FPR changes
+        time.sleep(0.01)
+        self.write_fpr(self.fpr_path, 100)
+        self.assertFalse(provenance_snapshot(self.fpr_path).is_current())
+
+    def test_index_dir(self):
+        index_dir = os.path.join(self.tmp_dir, 'index')
+        os.mkdir(index_dir)
+        provenance_snapshot(self.fpr_path, index_dir).build()
+        self.assertFalse(provenance_snapshot(self.fpr_path).is_current())
+        self.assertTrue(provenance_snapshot(self.fpr_path, index_dir).is_current())
+
+
+class TestProvenanceStore(ProvenanceTestBase):
+
+    def test_store(self):
+        store_path = provenance_store.get_default_path(self.fpr_path)
+        store = provenance_store(store_path, log_level=logging.ERROR)
+        self.assertFalse(store.is_current(self.fpr_path))
+        store.load(self.fpr_path)
+        self.assertTrue(store.is_current(self.fpr_path))
+        self.assertEqual(store.get_source()[store.TOTAL_ROWS], 3000)
+        for study in self.STUDIES:
+            for donor in self.DONORS[0:5]:
+                rows = [x.to_list() for x in store.read_rows(study, donor)]
+                self.assertEqual(rows, self.read_expected_projected(study, donor))
+        self.assertEqual(list(store.read_rows('NO_SUCH_STUDY', 'NO_SUCH_DONOR')), [])
+        rows = list(store.query(donor=self.DONORS[0], modified_since='2024-01-01 00:00:30'))
+        self.assertTrue(len(rows) > 0)
+        self.assertTrue(all([x.last_modified >= '2024-01-01 00:00:30' for x in rows]))
+        # queries use the indexes
+        connection = store._connect()
+        for where in ['study_title = ? AND root_sample_name = ?',
+                      'sample_name = ? AND workflow_name = ?',
+                      'last_modified >= ?']:
+            sql = 'EXPLAIN QUERY PLAN SELECT * FROM provenance WHERE '+where
+            plan = connection.execute(sql, ['x']*where.count('?')).fetchall()
+            self.assertIn('USING INDEX', str(plan))
+        connection.close()
+        # store is out of date if the FPR changes
+        time.sleep(0.01)
+        self.write_fpr(self.fpr_path, 100)
+        self.assertFalse(store.is_current(self.fpr_path))
+        store.load(self.fpr_path)
+        self.assertEqual(store.get_source()[store.TOTAL_ROWS], 100)
+        self.assertEqual(len([x for x in os.listdir(self.tmp_dir) if '.tmp.' in x]), 0)
+
+
+class TestProvenanceSubsetWriter(ProvenanceTestBase):
+
+    def run_batch(self, index_dir=None):
+        targets = []
+        expected = {}
+        for i in range(6):
+            study = self.STUDIES[i % len(self.STUDIES)]
+            donor = self.DONORS[i]
+            out_path = os.path.join(self.tmp_dir, 'subset_{0}.tsv.gz'.format(i))
+            targets.append((study, donor, out_path))
+            expected[out_path] = self.read_expected_projected(study, donor)
+        # same donor in two different workspaces
+        out_path = os.path.join(self.tmp_dir, 'subset_duplicate.tsv.gz')
+        targets.append((targets[0][0], targets[0][1], out_path))
+        expected[out_path] = expected[targets[0][2]]
+        writer = provenance_subset_writer(self.fpr_path, index_dir)
+        kept = writer.write(targets)
+        for out_path, rows in expected.items():
+            with gzip.open(out_path, 'rt') as in_file:
+                found = list(csv.reader(in_file, delimiter="\t"))
+            self.assertEqual(found[0], PROJECTED_HEADER)
+            self.assertEqual(found[1:], rows)
+            self.assertEqual(kept[out_path], len(rows))
+            projected = list(read_provenance_file(out_path))
+            self.assertEqual([x.to_list() for x in projected], rows)
+        self.assertEqual(len([x for x in os.listdir(self.tmp_dir) if '.tmp.' in x]), 0)
+
+    def test_full_scan(self):
+        self.run_batch()
+
+    def test_snapshot(self):
+        provenance_snapshot(self.fpr_path).build()
+        self.run_batch()
+
+    def test_store(self):
+        store_path = provenance_store.get_default_path(self.fpr_path)
+        provenance_store(store_path, log_level=logging.ERROR).load(self.fpr_path)
+        self.run_batch()
+
+
+class TestProvenanceCache(ProvenanceTestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        os.mkdir(self.cache_dir)
+
+    def write_subset(self, study, donor, name):
+        out_path = os.path.join(self.tmp_dir, name)
+        provenance_subset_writer(self.fpr_path, log_level=logging.ERROR).write(
+            [(study, donor, out_path)]
+        )
+        return out_path
+
+    def test_get_put(self):
+        cache = provenance_cache(self.cache_dir, 10**9, 3600, log_level=logging.ERROR)
+        out_path = os.path.join(self.tmp_dir, 'from_cache.tsv.gz')
+        self.assertFalse(cache.get(self.fpr_path, 'PASS01', 'PANX_1500', out_path))
+        subset_path = self.write_subset('PASS01', 'PANX_1500', 'subset.tsv.gz')
+        entry_path = cache.put(self.fpr_path, 'PASS01', 'PANX_1500', subset_path)
+        self.assertTrue(os.path.isfile(entry_path))
+        self.assertTrue(cache.get(self.fpr_path, 'PASS01', 'PANX_1500', out_path))
+        self.assertEqual(self.read_gzip(out_path), self.read_gzip(subset_path))
+        # other donors, and other versions of the FPR, are cache misses
+        self.assertFalse(cache.get(self.fpr_path, 'PASS01', 'PANX_1501', out_path))
+        stat = os.stat(self.fpr_path)
+        os.utime(self.fpr_path, ns=(stat.st_atime_ns, stat.st_mtime_ns+10**9))
+        self.assertFalse(cache.get(self.fpr_path, 'PASS01', 'PANX_1500', out_path))
+        # subset is not cached if the FPR changed while it was written
+        old_entry = entry_path
+        os.utime(self.fpr_path, ns=(stat.st_atime_ns, stat.st_mtime_ns+2*10**9))
+        self.assertIsNone(cache.put(self.fpr_path, 'PASS01', 'PANX_1500', subset_path, old_entry))
+        self.assertFalse(cache.get(self.fpr_path, 'PASS01', 'PANX_1500', out_path))
+
+    def test_eviction(self):
+        cache = provenance_cache(self.cache_dir, 10**9, 3600, log_level=logging.ERROR)
+        entries = []
+        for donor in self.DONORS[0:3]:
+            subset_path = self.write_subset('PASS01', donor, donor+'.tsv.gz')
+            entries.append(cache.put(self.fpr_path, 'PASS01', donor, subset_path))
+        sizes = [os.path.getsize(x) for x in entries]
+        now = time.time()
+        # entry 0 is least recently used; entry 2 is older than the maximum age
+        for (entry, age) in zip(entries, [200, 100, 7200]):
+            os.utime(entry, (now-age, now-age))
+        cache.max_size = sizes[1]
+        self.assertEqual(cache.evict(), 2)
+        self.assertEqual([os.path.exists(x) for x in entries], [False, True, False])
+        # eviction is skipped while another process holds the lock
+        lock_path = os.path.join(self.cache_dir, cache.LOCK_NAME)
+        cache.max_size = 0
+        with file_lock(lock_path):
+            self.assertEqual(cache.evict(), 0)
+        self.assertEqual(cache.evict(), 1)
+
+    def read_gzip(self, path):
+        with gzip.open(path, 'rt') as in_file:
+            return in_file.read()
+
+
+class TestProvenanceReader(ProvenanceTestBase):
+
+    STUDY = 'PASS01'
+    DONOR = 'PANX_1500'
+    WG_N = 'PANX_1500_Ly_R_PE_500_WG'
+    WG_T = 'PANX_1500_Pa_P_PE_500_WG'
+    WT_T = 'PANX_1500_Pa_P_PE_300_WT'
+    ATTRIBUTES = {
+        WG_N: 'geo_external_name=EX1,EX2;geo_library_source_template_type=WG;'+\
+            'geo_tissue_origin=Ly;geo_tissue_type=R;geo_tube_id=T_NORMAL',
+        WG_T: 'geo_external_name=EX1,EX2;geo_library_source_template_type=WG;'+\
+            'geo_tissue_origin=Pa;geo_tissue_type=P;geo_tube_id=T_TUMOUR',
+        WT_T: 'geo_external_name=EX1,EX2;geo_library_source_template_type=WT;'+\
+            'geo_tissue_origin=Pa;geo_tissue_type=P;geo_tube_id=T_TUMOUR'
+    }
+    # workflow, metatype, sample, path suffix
+    OUTPUTS = [
+        ['bamMergePreprocessing_by_sample', 'application/bam', WG_T,
+         '.filter.deduped.realigned.recalibrated.bam'],
+        ['bamMergePreprocessing_by_sample', 'application/bam-index', WG_T,
+         '.filter.deduped.realigned.recalibrated.bai'],
+        ['bamMergePreprocessing_by_tumor_group', 'application/bam', WG_N,
+         '.filter.deduped.realigned.recalibrated.bam'],
+        ['variantEffectPredictor_matched', 'application/txt-gz', WG_T,
+         '.mutect2.filtered.maf.gz'],
+        ['sequenza', 'application/zip-report-bundle', WG_T, '_results.zip'],
+        ['arriba', 'application/octet-stream', WT_T, '.fusions.tsv'],
+        ['star_call_ready', 'application/bam', WT_T, '.Aligned.sortedByCoord.out.bam'],
+        ['purple', 'application/zip-report-bundle', WG_T, '.purple.zip'],
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.donor_fpr_path = os.path.join(self.tmp_dir, 'donor_fpr.tsv.gz')
+        with gzip.open(self.donor_fpr_path, 'wt') as out_file:
+            writer = csv.writer(out_file, delimiter="\t")
+            for row in self.make_donor_rows():
+                writer.writerow(row)
+
+    def make_donor_rows(self):
+        rows = []
+        i = 0
+        for rerun in range(3):
+            for [workflow, metatype, sample, suffix] in self.OUTPUTS:
+                row = self.make_row(i)
+                row[index.STUDY_TITLE] = self.STUDY
+                row[index.ROOT_SAMPLE_NAME] = self.DONOR
+                row[index.SAMPLE_NAME] = sample
+                row[index.PARENT_SAMPLE_ATTRIBUTES] = self.ATTRIBUTES[sample]
+                row[index.WORKFLOW_NAME] = workflow
+                row[index.FILE_META_TYPE] = metatype
+                row[index.LAST_MODIFIED] = '2024-01-0{0} 00:00:00'.format(rerun+1)
+                path = '/results/{0}/run{1}/{2}{3}'.format(workflow, rerun, sample, suffix)
+                row[index.FILE_PATH] = path
+                rows.append(row)
+                i += 1
+        # rows for another donor
+        rows.extend([self.make_row(x) for x in range(i, i+20)])
+        return rows
+
+    def expected_path(self, workflow, sample, suffix):
+        return '/results/{0}/run2/{1}{2}'.format(workflow, sample, suffix)
+
+    def test_reader(self):
+        reader = provenance_reader(
+            self.donor_fpr_path, self.STUDY, self.DONOR, sample_name_container(),
+            log_level=logging.ERROR
+        )
+        expected_names = {
+            ini.SAMPLE_NAME_WG_N: self.WG_N,
+            ini.SAMPLE_NAME_WG_T: self.WG_T,
+            ini.SAMPLE_NAME_WT_T: self.WT_T
+        }
+        self.assertEqual(reader.get_sample_names(), expected_names)
+        expected_ids = {
+            ini.TUMOUR_ID: 'T_TUMOUR',
+            ini.NORMAL_ID: 'T_NORMAL',
+            ini.PATIENT_ID: 'EX1'
+        }
+        self.assertEqual(reader.get_identifiers(), expected_ids)
+        bam_suffix = '.filter.deduped.realigned.recalibrated.bam'
+        self.assertEqual(
+            reader.parse_wg_bam_path(),
+            self.expected_path('bamMergePreprocessing_by_sample', self.WG_T, bam_suffix)
+        )
+        # reference BAM is found under a legacy workflow name
+        self.assertEqual(
+            reader.parse_wg_bam_ref_path(),
+            self.expected_path('bamMergePreprocessing_by_tumor_group', self.WG_N, bam_suffix)
+        )
+        self.assertEqual(
+            reader.parse_maf_path(),
+            self.expected_path('variantEffectPredictor_matched', self.WG_T, '.mutect2.filtered.maf.gz')
+        )
+        self.assertEqual(
+            reader.parse_sequenza_path(),
+            self.expected_path('sequenza', self.WG_T, '_results.zip')
+        )
+        self.assertEqual(
+            reader.parse_arriba_path(),
+            self.expected_path('arriba', self.WT_T, '.fusions.tsv')
+        )
+        self.assertEqual(
+            reader.parse_wt_bam_path(),
+            self.expected_path('star_call_ready', self.WT_T, '.Aligned.sortedByCoord.out.bam')
+        )
+        self.assertEqual(
+            reader.parse_purple_zip_path(),
+            self.expected_path('purple', self.WG_T, '.purple.zip')
+        )
+        self.assertIsNone(reader.parse_wg_index_ref_path())
+        self.assertIsNone(reader.parse_delly_path())
+        self.assertIsNone(reader.parse_wt_index_path())
+
+    def test_attributes(self):
+        attributes = self.ATTRIBUTES[self.WG_T]
+        self.assertEqual(
+            dict(parse_sample_attributes(attributes)),
+            {
+                'geo_external_name': 'EX1,EX2',
+                'geo_library_source_template_type': 'WG',
+                'geo_tissue_origin': 'Pa',
+                'geo_tissue_type': 'P',
+                'geo_tube_id': 'T_TUMOUR'
+            }
+        )
+        with self.assertRaises(ValueError):
+            parse_sample_attributes('geo_tissue_type=P;geo_tube_id')
+        # attribute strings are parsed once, and reused by later readers
+        parse_sample_attributes.cache_clear()
+        readers = [
+            provenance_reader(
+                self.donor_fpr_path, self.STUDY, self.DONOR, sample_name_container(),
+                log_level=logging.ERROR
+            ) for i in range(2)
+        ]
+        info = parse_sample_attributes.cache_info()
+        self.assertEqual(info.misses, len(self.ATTRIBUTES))
+        self.assertEqual(info.hits, len(self.ATTRIBUTES))
+        self.assertEqual(readers[0].get_identifiers(), readers[1].get_identifiers())
+        # attribute table groups values by tissue type
+        table = readers[0].attribute_table
+        self.assertEqual(table['geo_tube_id'], {True: {'T_NORMAL'}, False: {'T_TUMOUR'}})
+        self.assertEqual(readers[0]._get_unique_value('geo_tube_id', check=True), 'T_TUMOUR')
+        self.assertIsNone(readers[0]._get_unique_value('geo_tube_id', check=False))
+        self.assertIsNone(readers[0]._get_unique_value('no_such_key', check=False))
+
+    def test_resolve_output_paths(self):
+        reader = provenance_reader(
+            self.donor_fpr_path, self.STUDY, self.DONOR, sample_name_container(),
+            log_level=logging.ERROR
+        )
+        path_info = reader.resolve_output_paths()
+        # single-pass resolution agrees with the individual parse methods
+        for output in reader.get_outputs():
+            value = path_info
+            for key in output.keys:
+                value = value[key]
+            self.assertEqual(value, reader.parse_output_path(output))
+        self.assertEqual(
+            path_info[reader.WF_BMPP][reader.WG_N_BAM],
+            reader.parse_wg_bam_ref_path()
+        )
+        self.assertIsNone(path_info[reader.WF_DELLY])
+        # register an additional output, as a plugin would
+        output = provenance_output(
+            ['purple_metatype'], ['purple'], reader.MT_ZIP, r'\.zip$', ini.SAMPLE_NAME_WG_T
+        )
+        try:
+            provenance_reader.register_output(output)
+            path_info = reader.resolve_output_paths()
+        finally:
+            provenance_reader.REGISTERED_OUTPUTS = []
+        self.assertEqual(path_info['purple_metatype'], reader.parse_purple_zip_path())
+
+    def test_projected_subset(self):
+        # reader gives the same results from a full FPR and a projected subset
+        subset_path = os.path.join(self.tmp_dir, 'subset.tsv.gz')
+        writer = provenance_subset_writer(self.donor_fpr_path, log_level=logging.ERROR)
+        writer.write([(self.STUDY, self.DONOR, subset_path)])
+        readers = [
+            provenance_reader(
+                x, self.STUDY, self.DONOR, sample_name_container(), log_level=logging.ERROR
+            ) for x in [self.donor_fpr_path, subset_path]
+        ]
+        self.assertEqual(readers[0].provenance, readers[1].provenance)
+        self.assertEqual(readers[0].get_identifiers(), readers[1].get_identifiers())
+        self.assertEqual(readers[0].resolve_output_paths(), readers[1].resolve_output_paths())
+
+    def test_store(self):
+        # reader gives the same results from a full FPR and a provenance store
+        store_path = os.path.join(self.tmp_dir, 'provenance.sqlite')
+        provenance_store(store_path, log_level=logging.ERROR).load(self.donor_fpr_path)
+        readers = [
+            provenance_reader(
+                self.donor_fpr_path, self.STUDY, self.DONOR, sample_name_container(),
+                log_level=logging.ERROR
+            ),
+            provenance_reader.from_store(
+                store_path, self.STUDY, self.DONOR, sample_name_container(),
+                log_level=logging.ERROR
+            )
+        ]
+        self.assertEqual(readers[0].provenance, readers[1].provenance)
+        self.assertEqual(readers[0].get_identifiers(), readers[1].get_identifiers())
+        self.assertEqual(readers[0].resolve_output_paths(), readers[1].resolve_output_paths())
+
+
+class TestProvenanceAudit(TestBase):
+
+    STUDY = 'PASS01'
+
+    def setUp(self):
+        super().setUp()
+        self.generator = provenance_generator(log_level=logging.ERROR)
+        # donor 0 has conflicting WG tumour sample names, so it cannot be reported
+        rows = list(self.generator.generate_rows(2000))
+        conflict_name = self.generator.sample_name(self.generator.donor_name(0), 'Pa_M_PE_500_WG')
+        for row in rows:
+            if row[index.SAMPLE_NAME].endswith('Pa_P_PE_500_WG') and \
+               row[index.ROOT_SAMPLE_NAME] == self.generator.donor_name(0):
+                row[index.SAMPLE_NAME] = conflict_name
+                break
+        self.fpr_path = os.path.join(self.tmp_dir, 'fpr.tsv.gz')
+        with gzip.open(self.fpr_path, 'wt') as out_file:
+            writer = csv.writer(out_file, delimiter="\t")
+            for row in rows:
+                writer.writerow(row)
+
+    def test_audit(self):
+        audit = provenance_audit(log_level=logging.ERROR)
+        results = audit.audit(self.fpr_path, [self.STUDY])
+        donors = [self.generator.donor_name(x) for x in [0, 5, 10, 15]]
+        self.assertEqual([x[audit.DONOR] for x in results], donors)
+        self.assertEqual(results[0][audit.STATUS], audit.INVALID)
+        self.assertIn('Inconsistent sample names', results[0][audit.ERROR])
+        # results for other donors agree with a provenance reader for each donor
+        for result in results[1:]:
+            reader = provenance_reader(
+                self.fpr_path, self.STUDY, result[audit.DONOR], sample_name_container(),
+                log_level=logging.CRITICAL
+            )
+            for key, value in reader.get_sample_names().items():
+                self.assertEqual(result[key], value)
+            for key, value in reader.get_identifiers().items():
+                self.assertEqual(result[key], value)
+            missing = ','.join([x[0] for x in reader.missing_workflows])
+            self.assertEqual(result[audit.MISSING_WORKFLOWS], missing)
+            self.assertEqual(result[audit.TOTAL_ROWS], len(reader.provenance))
+            # synthetic FPR has no immunedeconv output
+            self.assertEqual(result[audit.STATUS], audit.INCOMPLETE)
+            self.assertFalse(result[audit.WGS_COMPLETE])
+            self.assertTrue(result[audit.WTS_PRESENT])
+            self.assertTrue(result[audit.WTS_COMPLETE])
+        # audit of given donors reports any which are not found
+        results = audit.audit(self.fpr_path, [self.STUDY], [donors[1], 'NO_SUCH_DONOR'])
+        self.assertEqual([x[audit.DONOR] for x in results], [donors[1], 'NO_SUCH_DONOR'])
+        self.assertEqual(results[0][audit.STATUS], audit.INCOMPLETE)
+        self.assertEqual(results[1][audit.STATUS], audit.NOT_FOUND)
+        # output formats
+        tsv_path = os.path.join(self.tmp_dir, 'audit.tsv')
+        json_path = os.path.join(self.tmp_dir, 'audit.json')
+        audit.write_tsv(results, tsv_path)
+        audit.write_json(results, json_path)
+        with open(tsv_path) as in_file:
+            table = list(csv.reader(in_file, delimiter="\t"))
+        self.assertEqual(table[0], audit.COLUMNS)
+        self.assertEqual(len(table), 3)
+        with open(json_path) as in_file:
+            self.assertEqual(json.loads(in_file.read()), results)
+
+
+class TestProvenanceBenchmark(TestBase):
+
+    def test_generator(self):
+        generator = provenance_generator(log_level=logging.ERROR)
+        workflows = [provenance_reader.WF_IMMUNE, provenance_reader.WF_BMPP]
+        rows = list(generator.generate_rows(3000, donors=30, studies=8, workflows=workflows, reruns=15))
+        self.assertEqual(len(rows), 3000)
+        self.assertEqual(len(set([x[index.STUDY_TITLE] for x in rows])), 8)
+        self.assertIn('STUDY007', set([x[index.STUDY_TITLE] for x in rows]))
+        self.assertEqual(set([x[index.WORKFLOW_NAME] for x in rows]), set(workflows))
+        self.assertIn('2025-03', ' '.join([x[index.LAST_MODIFIED] for x in rows]))
+        with self.assertRaises(ValueError):
+            list(generator.generate_rows(10, workflows=['no_such_workflow']))
+
+    def test_suite(self):
+        generator = provenance_generator(log_level=logging.ERROR)
+        fpr_path = generator.write(os.path.join(self.tmp_dir, 'fpr.tsv.gz'), 2000)
+        benchmark = provenance_benchmark(log_level=logging.ERROR)
+        results = benchmark.run_suite(fpr_path, generator.STUDIES[0], generator.donor_name(0))
+        phases = [x[benchmark.PHASE] for x in results]
+        self.assertEqual(phases[:4], [benchmark.SCAN, benchmark.SUBSET, benchmark.READER, benchmark.RESOLVE])
+        self.assertEqual(phases[4:], benchmark.get_parse_methods())
+        self.assertIn('parse_wg_bam_path', phases)
+        self.assertEqual(results[0][benchmark.ROWS], 2000)
+        self.assertTrue(all([x[benchmark.PEAK_RSS_MB] > 0 for x in results]))
+        # comparison with a baseline
+        baseline = [x.copy() for x in results]
+        baseline[1][benchmark.SECONDS] = results[1][benchmark.SECONDS]/10
+        del baseline[2]
+        compared = benchmark.compare_results(results, baseline)
+        self.assertEqual(len(compared), len(results))
+        self.assertTrue(compared[1][benchmark.REGRESSION])
+        self.assertIsNone(compared[2][benchmark.BASELINE_SECONDS])
+        self.assertFalse(any([x[benchmark.REGRESSION] for x in compared[2:]]))
+
+
+class TestProvenanceHelper(TestBase):
+
+    HELPER_NAME = 'provenance_helper'
+
+    def setUp(self):
+        super().setUp()
+        generator = provenance_generator(log_level=logging.ERROR)
+        self.fpr_path = generator.write(os.path.join(self.tmp_dir, 'fpr.tsv.gz'), 2000)
+        self.study = generator.STUDIES[0]
+        self.donor = generator.donor_name(0)
+
+    def get_helper(self, name):
+        work_dir = os.path.join(self.tmp_dir, name)
+        os.mkdir(work_dir)
+        helper = helper_loader(logging.ERROR).load(self.HELPER_NAME, workspace(work_dir))
+        config = helper.get_expected_config()
+        config.add_section(ini.CORE)
+        config.set(self.HELPER_NAME, helper.STUDY_TITLE, self.study)
+        config.set(self.HELPER_NAME, helper.ROOT_SAMPLE_NAME, self.donor)
+        config.set(self.HELPER_NAME, helper.PROVENANCE_INPUT_KEY, self.fpr_path)
+        return helper, config, work_dir
+
+    def read_outputs(self, work_dir):
+        outputs = []
+        for name in ['provenance_subset.tsv.gz', core_constants.DEFAULT_SAMPLE_INFO,
+                     core_constants.DEFAULT_PATH_INFO]:
+            path = os.path.join(work_dir, name)
+            if name.endswith('.gz'):
+                with gzip.open(path, 'rt') as in_file:
+                    outputs.append(in_file.read())
+            else:
+                with open(path) as in_file:
+                    outputs.append(in_file.read())
+        return outputs
+
+    def test_prefetch(self):
+        helper, config, work_dir = self.get_helper('no_prefetch')
+        config_out = helper.configure(config)
+        expected = self.read_outputs(work_dir)
+        helper, config, work_dir = self.get_helper('prefetch')
+        helper.prefetch(config)
+        self.assertIsNotNone(helper.prefetch_future)
+        self.assertEqual(helper.configure(config), config_out)
+        self.assertIsNone(helper.prefetch_future)
+        self.assertEqual(self.read_outputs(work_dir), expected)
+        # if the donor changes after prefetch, the subset is rewritten
+        helper, config, work_dir = self.get_helper('changed')
+        helper.prefetch(config)
+        self.donor = provenance_generator().donor_name(5)
+        config.set(self.HELPER_NAME, helper.ROOT_SAMPLE_NAME, self.donor)
+        helper.configure(config)
+        rows = list(read_provenance_file(os.path.join(work_dir, helper.PROVENANCE_OUTPUT)))
+        self.assertTrue(len(rows) > 0)
+        self.assertTrue(all([x.root_sample_name == self.donor for x in rows]))
+
+    def test_deferred_configure(self):
+        """Components which do not need provenance are configured during the prefetch"""
+        work_dir = os.path.join(self.tmp_dir, 'deferred')
+        os.mkdir(work_dir)
+        config = ConfigParser()
+        config.read_dict({
+            ini.CORE: {},
+            self.HELPER_NAME: {
+                'project': self.study,
+                'donor': self.donor,
+                'provenance_input_path': self.fpr_path
+            },
+            # before the core, and independent of the helper
+            'demo1': {'integer': '5', core_constants.CONFIGURE_PRIORITY: '60'},
+            # before the core, with a configure dependency on the helper
+            'demo2': {
+                'integer_2': '3',
+                core_constants.CONFIGURE_PRIORITY: '70',
+                core_constants.DEPENDS_CONFIGURE: self.HELPER_NAME
+            },
+            # before the core, reads sample info without declaring a dependency
+            'demo3': {'salutation': 'hello', core_constants.CONFIGURE_PRIORITY: '65'}
+        })
+        events = []
+        demo1_started = threading.Event()
+        write_subset = helper_module.main.write_provenance_subset
+        helper_configure = helper_module.main.configure
+        demo1_configure = demo1_module.main.configure
+        demo2_configure = demo2_module.main.configure
+        demo3_configure = demo3_module.main.configure
+        def slow_write(helper, *args):
+            # the scan does not finish until demo1 is configured, or a timeout
+            events.append(('scan overlaps demo1', demo1_started.wait(10)))
+            return write_subset(helper, *args)
+        def record_helper(helper, config):
+            events.append('helper')
+            return helper_configure(helper, config)
+        def record_demo1(plugin, config):
+            events.append('demo1')
+            demo1_started.set()
+            return demo1_configure(plugin, config)
+        def record_demo2(plugin, config):
+            events.append('demo2')
+            return demo2_configure(plugin, config)
+        def record_demo3(plugin, config):
+            events.append('demo3')
+            events.append(plugin.workspace.read_json(core_constants.DEFAULT_SAMPLE_INFO) != None)
+            return demo3_configure(plugin, config)
+        with mock.patch.object(helper_module.main, 'write_provenance_subset', slow_write), \
+             mock.patch.object(helper_module.main, 'configure', record_helper), \
+             mock.patch.object(demo1_module.main, 'configure', record_demo1), \
+             mock.patch.object(demo2_module.main, 'configure', record_demo2), \
+             mock.patch.object(demo3_module.main, 'configure', record_demo3):
+            config_out = djerba_main(work_dir, log_level=logging.ERROR).configure_from_parser(config)
+        # demo1 was configured while the scan was still running; reading sample info in
+        # demo3 ran the helper configuration first
+        self.assertIn(('scan overlaps demo1', True), events)
+        self.assertEqual([x for x in events if not isinstance(x, tuple)],
+                         ['demo1', 'demo3', 'helper', True, 'demo2'])
+        # output is in priority order, and the core has the tumour ID from sample info
+        self.assertEqual(config_out.sections(),
+                         [self.HELPER_NAME, 'demo1', 'demo3', 'demo2', ini.CORE])
+        with open(os.path.join(work_dir, core_constants.DEFAULT_SAMPLE_INFO)) as in_file:
+            tumour_id = json.load(in_file)[core_constants.TUMOUR_ID]
+        self.assertTrue(config_out.get(ini.CORE, core_constants.REPORT_ID).startswith(tumour_id))
+
+    def test_path_info(self):
+        helper, config, work_dir = self.get_helper('path_info')
+        helper.configure(config)
+        with open(os.path.join(work_dir, core_constants.DEFAULT_PATH_INFO)) as in_file:
+            path_info = json.load(in_file)
+        with open(os.path.join(work_dir, core_constants.DEFAULT_FILE_STATS)) as in_file:
+            file_stats = json.load(in_file)
+        # path info has workflow outputs only; stats are for each path
+        self.assertNotIn('file_stats', path_info)
+        self.assertTrue(len(file_stats) > 0)
+        self.assertTrue(all([x in file_stats for x in path_info.values() if isinstance(x, str)]))
+        # synthetic FPR paths do not exist
+        self.assertTrue(all([path_validator.ERROR in x for x in file_stats.values()]))
+        # components reuse recorded stats, instead of checking paths again
+        self.assertEqual(helper.read_file_stats(), file_stats)
+        (key, path) = [(x, y) for (x, y) in path_info.items() if isinstance(y, str)][0]
+        validator = path_validator(logging.CRITICAL)
+        with mock.patch('os.stat') as stat, mock.patch('os.path.exists') as exists:
+            with self.assertRaises(OSError):
+                validator.validate_input_file(path, file_stats)
+            recorded = {path: {path_validator.SIZE: 1, path_validator.MTIME: 0}}
+            self.assertTrue(validator.validate_input_file(path, recorded))
+            stat.assert_not_called()
+            exists.assert_not_called()
+        wrapper = helper.get_config_wrapper(config)
+        wrapper.set_my_param('test_path', core_constants.NULL)
+        with self.assertRaises(OSError):
+            helper.update_wrapper_if_null(wrapper, core_constants.DEFAULT_PATH_INFO, 'test_path', key)
+        # bulk checks of real files
+        validator = path_validator(logging.ERROR)
+        file_stats = validator.stat_input_files([self.fpr_path, work_dir, self.fpr_path+'.x'])
+        self.assertEqual(len(file_stats), 3)
+        self.assertEqual(file_stats[self.fpr_path][path_validator.SIZE], os.path.getsize(self.fpr_path))
+        self.assertIn(path_validator.MTIME, file_stats[self.fpr_path])
+        self.assertIn('is not a file', file_stats[work_dir][path_validator.ERROR])
+        self.assertIn('does not exist', file_stats[self.fpr_path+'.x'][path_validator.ERROR])
+
+
+if __name__ == '__main__':
+    unittest.main()